@@ -0,0 +1,139 @@
+import atexit
+import json
+import os
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from cache import read_generation
+from logger import Logger
+
+log = Logger("Answer Cache Logs", log_file_needed=True, log_file="Logs/answer_cache.log")
+
+ANSWER_CACHE_PATH = Path("embeddings/answer_cache.json")
+SIMILARITY_THRESHOLD = 0.95   # Minimum cosine similarity between questions for a hit
+MAX_ENTRIES = 1000
+SAVE_INTERVAL = 30.0           # Seconds between rewrites of the cache file; pending entries are also written by flush() and at exit
+
+class SemanticAnswerCache:
+    def __init__(self, path: Path = ANSWER_CACHE_PATH, threshold: float = SIMILARITY_THRESHOLD, max_entries: int = MAX_ENTRIES):
+        """
+        Bounded, disk-persisted cache of generated answers keyed on question embeddings.
+
+        A lookup hits when a cached question is within `threshold` cosine
+        similarity of the new one AND was answered from exactly the same set
+        of retrieved chunk_ids in the current collection generation (chunk_ids
+        are positional, so entries from before a re-index are dropped). The
+        least recently used entry is evicted once max_entries is exceeded.
+        """
+        self.path = Path(path)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = []
+        self._matrix = None
+        self._generation = read_generation()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+            log.info(f"Loaded {len(self._entries)} cached answers from {self.path}")
+            self._drop_stale()
+        atexit.register(self.flush)
+
+    def _drop_stale(self):
+        """Forget entries answered from an older collection generation."""
+        fresh = [entry for entry in self._entries if entry.get("generation") == self._generation]
+        if len(fresh) < len(self._entries):
+            log.info(f"Dropping {len(self._entries) - len(fresh)} cached answers from before generation {self._generation}")
+            self._entries = fresh
+            self._matrix = None
+            self._dirty = True
+
+    def _check_generation(self):
+        generation = read_generation()
+        if generation != self._generation:
+            self._generation = generation
+            self._drop_stale()
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _embeddings(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix = np.array([entry["embedding"] for entry in self._entries], dtype=np.float32).reshape(len(self._entries), -1)
+        return self._matrix
+
+    def lookup(self, embedding, chunk_ids):
+        """
+        Return the cached entry ('question', 'answer', 'sources', ...) for a
+        similar question answered from the same chunks, or None.
+        """
+        with self._lock:
+            self._check_generation()
+            if self._entries:
+                chunk_ids = sorted(chunk_ids)
+                scores = self._embeddings() @ self._normalize(embedding)
+                for idx in np.argsort(-scores):
+                    if scores[idx] < self.threshold:
+                        break
+                    entry = self._entries[idx]
+                    if entry["chunk_ids"] == chunk_ids:
+                        entry["last_used"] = time.time()
+                        self.hits += 1
+                        log.info(f"Cache hit (similarity {scores[idx]:.3f}) for: {entry['question'][:100]}")
+                        return entry
+            self.misses += 1
+            return None
+
+    def add(self, question: str, embedding, chunk_ids, answer: str, sources: list):
+        """Store an answer and evict the least recently used entries; saved at most every SAVE_INTERVAL seconds."""
+        with self._lock:
+            self._check_generation()
+            self._entries.append({
+                "question": question,
+                "embedding": self._normalize(embedding).tolist(),
+                "chunk_ids": sorted(chunk_ids),
+                "answer": answer,
+                "sources": sources,
+                "generation": self._generation,
+                "last_used": time.time(),
+            })
+            if len(self._entries) > self.max_entries:
+                self._entries.sort(key=lambda entry: entry["last_used"])
+                self._entries = self._entries[-self.max_entries:]
+            self._matrix = None
+            self._dirty = True
+            if time.monotonic() - self._saved_at >= SAVE_INTERVAL:
+                self._save()
+
+    def flush(self):
+        """Write entries added since the last save."""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+            "maxsize": self.max_entries,
+        }
@@ -0,0 +1,105 @@
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from logger import Logger
+
+log = Logger("Batch Answer Logs", log_file_needed=True, log_file="Logs/batch_answer.log")
+
+CHECKPOINT_QUESTIONS = 64   # Questions answered per generate_answers() call; results are flushed after each
+TOP_K = 5
+
+def read_questions(path: Path) -> list:
+    """(id, question) pairs from a JSONL file of {"question": ..., "id": ...} objects; id defaults to the line number."""
+    questions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            questions.append((item.get("id", line_number), item["question"]))
+    return questions
+
+def read_checkpoint(path: Path) -> set:
+    """
+    Ids already answered in an existing output file. A partially written last
+    line (from an interrupted run) is cut off so appending continues cleanly.
+    """
+    if not path.exists():
+        return set()
+    done, good_bytes = set(), 0
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                break
+            good_bytes += len(line)
+    if good_bytes < path.stat().st_size:
+        log.warning(f"Dropping a partial record at the end of {path}")
+        with open(path, 'r+b') as f:
+            f.truncate(good_bytes)
+    return done
+
+def answer_file(in_path: Path, out_path: Path, top_k: int = TOP_K, checkpoint_questions: int = CHECKPOINT_QUESTIONS,
+                use_cache: bool = False, max_new_tokens: int = None) -> dict:
+    """
+    Answer every question of in_path with generate_answers() and append one
+    JSONL record per question (id, question, answer, sources, chunk_ids,
+    cached, context_stats, timings) to out_path. Questions whose id is
+    already in out_path are skipped, so an interrupted run resumes where it
+    stopped. Returns run totals.
+    """
+    from generation_pipeline import generate_answers
+
+    questions = read_questions(in_path)
+    done = read_checkpoint(out_path)
+    pending = [(qid, question) for qid, question in questions if qid not in done]
+    log.info(f"{len(pending)} of {len(questions)} questions to answer ({len(done)} already in {out_path})")
+
+    start = time.perf_counter()
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, 'a', encoding='utf-8') as f:
+        for offset in range(0, len(pending), checkpoint_questions):
+            batch = pending[offset:offset + checkpoint_questions]
+            results = generate_answers(
+                [question for _, question in batch], top_k=top_k, use_cache=use_cache, max_new_tokens=max_new_tokens
+            )
+            for (qid, question), result in zip(batch, results):
+                f.write(json.dumps({
+                    "id": qid,
+                    "question": question,
+                    "answer": result["answer"],
+                    "sources": result["sources"],
+                    "chunk_ids": [chunk["chunk_id"] for chunk in result["retrieved_chunks"]],
+                    "cached": result["cached"],
+                    "context_stats": result["context_stats"],
+                    "timings": result["timings"],
+                }, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            answered = offset + len(batch)
+            log.info(f"[{answered}/{len(pending)}] answered, {answered / (time.perf_counter() - start):.2f} questions/s")
+
+    seconds = time.perf_counter() - start
+    totals = {
+        "questions": len(questions),
+        "skipped": len(questions) - len(pending),
+        "answered": len(pending),
+        "seconds": seconds,
+        "questions_per_second": len(pending) / seconds if pending and seconds else None,
+    }
+    log.info(f"Batch answering complete: {totals}")
+    return totals
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions in batches, resuming from the output file.")
+    parser.add_argument("questions", type=Path, help='JSONL with one {"question": ..., "id": ...} per line')
+    parser.add_argument("output", type=Path, help="JSONL answers; existing ids are skipped")
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_QUESTIONS, help="Questions per batch/checkpoint")
+    parser.add_argument("--max-new-tokens", type=int, default=None)
+    parser.add_argument("--use-cache", action="store_true", help="Serve near-identical questions from the semantic answer cache")
+    args = parser.parse_args()
+    answer_file(args.questions, args.output, args.top_k, args.checkpoint_every, args.use_cache, args.max_new_tokens)
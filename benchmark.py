@@ -0,0 +1,845 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+from pathlib import Path
+
+BENCH_DIR = Path("benchmarks")           # Results are written to BENCH_DIR/results
+SIZES = [100, 1000]                      # Corpus sizes, in chunks
+STAGES = ["ingest", "clean", "dedup", "embed", "encoder", "index", "retrieve", "generate", "prefix", "quantize", "assisted", "batch", "backends", "vectorquant", "serve", "logging"]
+CHUNKS_PER_PAGE = 4
+CHUNKS_PER_FILE = 200
+NUM_QUERIES = 200
+NUM_GENERATIONS = 5
+GENERATION_TOKENS = 64
+SERVE_BATCH_SIZES = [1, 4, 16]   # Micro-batch limits compared by the serve stage
+SERVE_GENERATIONS = 16
+PREFIX_TOP_KS = [1, 5]           # Context sizes compared by the prefix stage
+ASSISTED_MODES = [None, "prompt-lookup", "draft"]   # Decoding modes compared by the assisted stage
+ASSISTED_GENERATIONS = 12        # More than generation_pipeline.ACCEPTANCE_WINDOW, so the fallback can trigger
+BATCH_QUESTIONS = 32             # Questions answered by the batch stage, sequentially and with generate_answers
+OVERSAMPLING_FACTORS = [1.0, 4.0, 10.0]   # RESCORE_OVERSAMPLING values compared by the vectorquant stage
+LOG_CALLS = 50000                # Records written per logging mode by the logging stage (enough to rotate the 5MB file once)
+LOG_SAMPLE_EVERY = 10            # SAMPLE_EVERY of the sampled logging mode
+DUPLICATE_SHARE = 0.3            # Share of the dedup stage's chunks copying an earlier chunk (half verbatim, half with one word changed)
+SEED = 0
+
+WORDS = (
+    "network protocol layer packet router switch subnet cidr mask gateway tcp udp ip http https dns dhcp "
+    "osi transport session presentation application physical datalink handshake syn ack flood firewall "
+    "latency bandwidth throughput encryption certificate python java sql join index query cache thread "
+    "process memory stack heap queue graph tree hash array sort search algorithm complexity recursion "
+    "analyst scientist engineer manager stakeholder requirement metric dashboard model regression "
+    "classification cluster feature pipeline deployment testing review design pattern interface "
+    "question answer explain describe difference example interview candidate skill experience project"
+).split()
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "<s>", "</s>"]
+
+# ---------------------------------------------------------------------------
+# Synthetic data
+# ---------------------------------------------------------------------------
+
+def synthetic_sentence(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + "."
+
+def synthetic_text(rng: random.Random, chars: int) -> str:
+    sentences = []
+    length = 0
+    while length < chars:
+        sentence = synthetic_sentence(rng)
+        sentences.append(sentence)
+        length += len(sentence) + 1
+    return " ".join(sentences)
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_pdf(path: Path, pages: list):
+    """Write a minimal digital-text PDF with one page per string in pages."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Pages, filled in once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_refs = []
+    for text in pages:
+        lines = textwrap.wrap(text, 90)
+        stream = "BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(f"({_pdf_escape(line)}) '" for line in lines) + " ET"
+        stream = stream.encode("latin-1", errors="replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        page_refs.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % ref for ref in page_refs), len(page_refs)
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(bytes(out))
+
+def make_pdf_corpus(pdf_dir: Path, size: int, pages_per_pdf: int = 10):
+    """Write enough synthetic PDFs for roughly `size` chunks."""
+    rng = random.Random(SEED)
+    pdf_dir.mkdir(parents=True, exist_ok=True)
+    pages = max(1, size // CHUNKS_PER_PAGE)
+    for pdf_num, start in enumerate(range(0, pages, pages_per_pdf)):
+        count = min(pages_per_pdf, pages - start)
+        write_pdf(pdf_dir / f"synthetic_{pdf_num:04d}.pdf", [synthetic_text(rng, 1800) for _ in range(count)])
+    return pages
+
+def make_chunk_texts(size: int) -> list:
+    rng = random.Random(SEED)
+    return [synthetic_text(rng, 450) for _ in range(size)]
+
+def make_duplicated_chunk_texts(size: int) -> list:
+    """make_chunk_texts with DUPLICATE_SHARE of the texts replaced by (near-)copies of earlier ones."""
+    rng = random.Random(SEED + 9)
+    texts = make_chunk_texts(size)
+    for i in sorted(rng.sample(range(1, size), int(size * DUPLICATE_SHARE))) if size > 1 else []:
+        words = texts[rng.randrange(i)].split()
+        if rng.random() < 0.5:
+            words[rng.randrange(len(words))] = rng.choice(WORDS)
+        texts[i] = " ".join(words)
+    return texts
+
+def make_clean_chunk_corpus(chunks_dir: Path, size: int, texts: list = None):
+    """Write `size` synthetic cleaned chunks (make_chunk_texts unless texts is given) as *_chunks.json files."""
+    chunks_dir.mkdir(parents=True, exist_ok=True)
+    texts = texts or make_chunk_texts(size)
+    for file_num, start in enumerate(range(0, size, CHUNKS_PER_FILE)):
+        chunks = [
+            {
+                "text": text.lower(),
+                "metadata": {
+                    "source": f"synthetic_{file_num:04d}.pdf",
+                    "page": (start + i) // CHUNKS_PER_PAGE + 1,
+                    "chunk_id": f"synthetic_{file_num:04d}_p{(start + i) // CHUNKS_PER_PAGE + 1}_c{(start + i) % CHUNKS_PER_PAGE}",
+                },
+            }
+            for i, text in enumerate(texts[start:start + CHUNKS_PER_FILE])
+        ]
+        with open(chunks_dir / f"synthetic_{file_num:04d}_chunks.json", 'w', encoding='utf-8') as f:
+            json.dump(chunks, f)
+
+# ---------------------------------------------------------------------------
+# Tiny stand-in models (randomly initialised, built offline)
+# ---------------------------------------------------------------------------
+
+def _tiny_tokenizer(**special):
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors
+    from transformers import PreTrainedTokenizerFast
+
+    vocab = {token: i for i, token in enumerate(SPECIAL_TOKENS + sorted(set(WORDS)) + list(".,:;()?-/"))}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.BertPreTokenizer()
+    if special.get("cls_token"):
+        tokenizer.post_processor = processors.TemplateProcessing(
+            single="[CLS] $A [SEP]", special_tokens=[("[CLS]", vocab["[CLS]"]), ("[SEP]", vocab["[SEP]"])]
+        )
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="[UNK]", pad_token="[PAD]", **special)
+
+def build_tiny_encoder(out_dir: Path) -> str:
+    """A 1-layer, 384-dim BERT wrapped as a SentenceTransformer, standing in for MiniLM."""
+    import torch
+    from transformers import BertConfig, BertModel
+    from sentence_transformers import SentenceTransformer, models
+
+    torch.manual_seed(SEED)
+    tokenizer = _tiny_tokenizer(cls_token="[CLS]", sep_token="[SEP]", mask_token="[MASK]")
+    config = BertConfig(
+        vocab_size=len(tokenizer), hidden_size=384, num_hidden_layers=1, num_attention_heads=4,
+        intermediate_size=256, max_position_embeddings=512,
+    )
+    hf_dir = out_dir / "hf"
+    BertModel(config).save_pretrained(hf_dir)
+    tokenizer.save_pretrained(hf_dir)
+
+    transformer = models.Transformer(str(hf_dir), max_seq_length=256)
+    pooling = models.Pooling(transformer.get_word_embedding_dimension(), pooling_mode="mean")
+    SentenceTransformer(modules=[transformer, pooling, models.Normalize()]).save(str(out_dir))
+    return str(out_dir)
+
+def build_tiny_llm(out_dir: Path, layers: int = 2) -> str:
+    """A 2-layer, 64-dim Llama standing in for Llama-3.2-3B (1 layer: the draft model)."""
+    import torch
+    from transformers import LlamaConfig, LlamaForCausalLM
+
+    torch.manual_seed(SEED)
+    tokenizer = _tiny_tokenizer(bos_token="<s>", eos_token="</s>")
+    config = LlamaConfig(
+        vocab_size=len(tokenizer), hidden_size=64, intermediate_size=128, num_hidden_layers=layers,
+        num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=4096,
+        bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    LlamaForCausalLM(config).save_pretrained(out_dir)
+    tokenizer.save_pretrained(out_dir)
+    return str(out_dir)
+
+# ---------------------------------------------------------------------------
+# Measurements
+# ---------------------------------------------------------------------------
+
+def percentiles(latencies: list) -> dict:
+    """p50/p90/p99/max of a list of seconds, in milliseconds."""
+    if not latencies:
+        return None
+    ordered = sorted(latencies)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {"p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99), "max": ordered[-1] * 1000}
+
+def peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def _result(stage: str, size: int, count: int, unit: str, seconds: float, latencies=None, **extra) -> dict:
+    return {
+        "stage": stage,
+        "size": size,
+        "count": count,
+        "unit": unit,
+        "seconds": seconds,
+        "throughput": count / seconds if seconds else None,
+        "latency_ms": percentiles(latencies or []),
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_children_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        **extra,
+    }
+
+# Each bench_* function runs in a fresh process whose working directory is the
+# benchmark workspace, so all of the repo's relative paths point into it.
+
+def bench_ingest(size: int, models: dict) -> dict:
+    import ingest
+    pages = make_pdf_corpus(ingest.PDF_DIR, size)
+    start = time.perf_counter()
+    ingest.extract_and_save(full_rebuild=True)
+    return _result("ingest", size, pages, "pages/s", time.perf_counter() - start, workers=ingest.MAX_WORKERS)
+
+def bench_clean(size: int, models: dict) -> dict:
+    import data_cleaning
+    texts = make_chunk_texts(size)
+    latencies = []
+    start = time.perf_counter()
+    cleaned = []
+    for text in texts:
+        t = time.perf_counter()
+        cleaned.append(data_cleaning.clean_text(text))
+        latencies.append(time.perf_counter() - t)
+    seconds = time.perf_counter() - start
+    extra = {}
+    if data_cleaning.has_punkt_model():  # The NLTK reference only runs with local punkt data
+        start = time.perf_counter()
+        legacy = [data_cleaning.legacy_clean_text(text) for text in texts]
+        extra = {
+            "legacy_seconds": time.perf_counter() - start,
+            "parity_mismatches": sum(a != b for a, b in zip(cleaned, legacy)),
+        }
+    return _result("clean", size, size, "chunks/s", seconds, latencies, **extra)
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file())
+
+def bench_dedup(size: int, models: dict) -> dict:
+    """
+    Dedup time on a corpus with DUPLICATE_SHARE duplicated chunks, and the
+    chunk count, embedding/index time and on-disk size (embedding store +
+    NumPy vector snapshot + BM25 postings) of the build with and without it.
+    """
+    import dedup
+    import embed
+    import index
+    import vector_store
+    embed.EMBED_MODEL = models["encoder"]
+    embed.load_encoder(embed.EMBED_MODEL).encode(["warm up"])  # Keep one-off import costs out of the first build
+    make_clean_chunk_corpus(dedup.CLEAN_CHUNKS_DIR, size, make_duplicated_chunk_texts(size))
+    builds = {}
+    for deduplicate in (False, True):
+        shutil.rmtree(embed.CHUNKS_DIR, ignore_errors=True)
+        if deduplicate:
+            start = time.perf_counter()
+            stats = dedup.dedup_data()
+            seconds = time.perf_counter() - start
+        else:
+            shutil.copytree(dedup.CLEAN_CHUNKS_DIR, embed.CHUNKS_DIR)
+        t = time.perf_counter()
+        embed.embed_data(full_rebuild=True)
+        embed_seconds = time.perf_counter() - t
+        t = time.perf_counter()
+        index.index_data(full_rebuild=True, backend="numpy")
+        builds["dedup" if deduplicate else "plain"] = {
+            "chunks": sum(1 for _ in embed.iter_chunks()),
+            "embed_seconds": embed_seconds,
+            "index_seconds": time.perf_counter() - t,
+            "bytes": _dir_size(embed.OUT_PATH) + _dir_size(vector_store.NUMPY_PATH) + _dir_size("vector_stores/lexical"),
+        }
+    print(
+        f"    chunks {builds['plain']['chunks']} -> {builds['dedup']['chunks']}, "
+        f"embed {builds['plain']['embed_seconds']:.2f}s -> {builds['dedup']['embed_seconds']:.2f}s, "
+        f"{builds['plain']['bytes'] / 1e6:.1f} -> {builds['dedup']['bytes'] / 1e6:.1f} MB"
+    )
+    return _result("dedup", size, size, "chunks/s", seconds, exact_duplicates=stats["exact_duplicates"],
+                   near_duplicates=stats["near_duplicates"], builds=builds)
+
+def _prepare_embeddings(size: int, models: dict):
+    import embed
+    embed.EMBED_MODEL = models["encoder"]
+    make_clean_chunk_corpus(embed.CHUNKS_DIR, size)
+    return embed
+
+def bench_embed(size: int, models: dict) -> dict:
+    embed = _prepare_embeddings(size, models)
+    start = time.perf_counter()
+    embed.embed_data(full_rebuild=True)
+    return _result("embed", size, size, "vectors/s", time.perf_counter() - start)
+
+def bench_encoder(size: int, models: dict) -> dict:
+    """
+    Single-query latency and bulk throughput of the PyTorch and ONNX int8
+    encoder backends on the chunk corpus, and their minimum cosine similarity.
+    """
+    import numpy as np
+    import encoder
+    texts = make_chunk_texts(size)
+    rng = random.Random(SEED + 8)
+    queries = [synthetic_sentence(rng) for _ in range(NUM_QUERIES)]
+    by_backend, embeddings = {}, {}
+    for backend in ("torch", "onnx"):
+        start = time.perf_counter()
+        model = encoder.load_encoder(models["encoder"], backend, device="cpu")
+        load_seconds = time.perf_counter() - start
+        model.encode(queries[:8])
+        latencies = []
+        for query in queries:
+            t = time.perf_counter()
+            model.encode([query])
+            latencies.append(time.perf_counter() - t)
+        start = time.perf_counter()
+        embeddings[backend] = model.encode(texts, batch_size=64)
+        bulk_seconds = time.perf_counter() - start
+        by_backend[backend] = {
+            "load_seconds": load_seconds,
+            "query_latency_ms": percentiles(latencies),
+            "bulk_vectors_per_s": len(texts) / bulk_seconds,
+        }
+        print(
+            f"    {backend:>5}: query p50 {by_backend[backend]['query_latency_ms']['p50']:.2f} ms, "
+            f"bulk {by_backend[backend]['bulk_vectors_per_s']:.0f} vectors/s, loaded in {load_seconds:.2f}s"
+        )
+    similarity = encoder.min_cosine(embeddings["onnx"], np.asarray(embeddings["torch"]))
+    print(f"    min cosine onnx vs torch: {similarity:.4f}")
+    return _result(
+        "encoder", size, size, "vectors/s", size / by_backend["onnx"]["bulk_vectors_per_s"],
+        by_backend=by_backend, min_cosine=similarity,
+    )
+
+def bench_index(size: int, models: dict) -> dict:
+    _prepare_embeddings(size, models).embed_data(full_rebuild=True)
+    import index
+    start = time.perf_counter()
+    index.index_data(full_rebuild=True)
+    return _result("index", size, size, "vectors/s", time.perf_counter() - start)
+
+def _prepare_index(size: int, models: dict):
+    _prepare_embeddings(size, models).embed_data(full_rebuild=True)
+    import index
+    index.index_data(full_rebuild=True)
+    import retrieve
+    retrieve.EMBED_MODEL = models["encoder"]
+    retrieve.RESULT_CACHE_SIZE = 0
+    retrieve.QUERY_CACHE_SIZE = 0
+    return retrieve
+
+def bench_retrieve(size: int, models: dict) -> dict:
+    retrieve = _prepare_index(size, models)
+    retriever = retrieve.Retriever()
+    rng = random.Random(SEED + 1)
+    queries = [synthetic_sentence(rng) for _ in range(NUM_QUERIES)]
+    by_mode = {}
+    for mode in ("dense", "lexical", "hybrid"):
+        latencies = []
+        for query in queries:
+            t = time.perf_counter()
+            retriever.retrieve(query, mode=mode)
+            latencies.append(time.perf_counter() - t)
+        by_mode[mode] = percentiles(latencies)
+
+    latencies = []
+    start = time.perf_counter()
+    for query in queries:
+        t = time.perf_counter()
+        retriever.retrieve(query)
+        latencies.append(time.perf_counter() - t)
+    return _result(
+        "retrieve", size, len(queries), "queries/s", time.perf_counter() - start, latencies,
+        mode=retrieve.RETRIEVAL_MODE, latency_ms_by_mode=by_mode,
+    )
+
+def bench_generate(size: int, models: dict) -> dict:
+    _prepare_index(size, models)
+    import generation_pipeline
+    generation_pipeline.MODEL_NAME = models["llm"]
+    generation_pipeline.MAX_NEW_TOKENS = GENERATION_TOKENS
+    generation_pipeline.get_llm()
+    rng = random.Random(SEED + 2)
+    questions = [synthetic_sentence(rng) for _ in range(NUM_GENERATIONS)]
+    latencies = []
+    start = time.perf_counter()
+    for question in questions:
+        t = time.perf_counter()
+        generation_pipeline.generate_answer(question, use_cache=False)
+        latencies.append(time.perf_counter() - t)
+    return _result(
+        "generate", size, len(questions), "answers/s", time.perf_counter() - start, latencies,
+        max_new_tokens=GENERATION_TOKENS,
+    )
+
+def bench_prefix(size: int, models: dict) -> dict:
+    """Prefill time with and without the shared prompt-prefix KV cache, per top_k."""
+    _prepare_index(size, models)
+    import generation_pipeline
+    generation_pipeline.MODEL_NAME = models["llm"]
+    retriever = generation_pipeline.get_retriever()
+    generation_pipeline.get_prefix_cache()
+    rng = random.Random(SEED + 5)
+    questions = [synthetic_sentence(rng) for _ in range(NUM_GENERATIONS)]
+    by_top_k = {}
+    start = time.perf_counter()
+    for top_k in PREFIX_TOP_KS:
+        runs = []
+        for question in questions:
+            context, _ = generation_pipeline.build_context(retriever.retrieve(question, top_k=top_k))
+            runs.append(generation_pipeline.measure_prefill(generation_pipeline.prompt.format(context=context, question=question)))
+        full = sum(run["full_seconds"] for run in runs) / len(runs)
+        cached = sum(run["prefix_cache_seconds"] for run in runs) / len(runs)
+        by_top_k[top_k] = {
+            "prompt_tokens": sum(run["prompt_tokens"] for run in runs) / len(runs),
+            "prefix_tokens": runs[0]["prefix_tokens"],
+            "full_prefill_ms": full * 1000,
+            "prefix_cache_prefill_ms": cached * 1000,
+            "speedup": full / cached if cached else None,
+        }
+        print(
+            f"    top_k {top_k}: prefill {by_top_k[top_k]['full_prefill_ms']:.2f} ms -> "
+            f"{by_top_k[top_k]['prefix_cache_prefill_ms']:.2f} ms with the prefix cache"
+        )
+    return _result(
+        "prefix", size, len(questions) * len(PREFIX_TOP_KS), "prompts/s", time.perf_counter() - start,
+        by_top_k=by_top_k,
+    )
+
+def bench_quantize(size: int, models: dict) -> dict:
+    """Load time, peak RSS and decode tokens/s of each ModelHandler quantization mode (size is unused)."""
+    import model_handler
+    start = time.perf_counter()
+    reports = model_handler.compare_modes(models["llm"], prompt=synthetic_sentence(random.Random(SEED)), max_new_tokens=GENERATION_TOKENS)
+    for report in reports:
+        if "error" in report:
+            print(f"    {report['mode']:>17}: unavailable ({report['error']})")
+        else:
+            print(f"    {report['mode']:>17}: {report['tokens_per_second']:.1f} tokens/s, peak RSS {report['peak_rss_mb']:.0f} MB")
+    return _result(
+        "quantize", size, len(reports), "modes/s", time.perf_counter() - start,
+        by_mode={report["mode"]: report for report in reports},
+    )
+
+def bench_assisted(size: int, models: dict) -> dict:
+    """
+    Decode tokens/s and draft acceptance rate of each assisted decoding mode.
+    The tiny models are random, so acceptance is low and the fallback is
+    expected to kick in; the stage checks the plumbing and its overhead.
+    """
+    _prepare_index(size, models)
+    import generation_pipeline
+    import registry
+    generation_pipeline.MODEL_NAME = models["llm"]
+    generation_pipeline.DRAFT_MODEL_NAME = models["draft"]
+    generation_pipeline.MAX_NEW_TOKENS = GENERATION_TOKENS
+    rng = random.Random(SEED + 6)
+    questions = [synthetic_sentence(rng) for _ in range(ASSISTED_GENERATIONS)]
+    by_mode = {}
+    start = time.perf_counter()
+    for mode in ASSISTED_MODES:
+        generation_pipeline.ASSISTED_DECODING = mode
+        registry.drop("llm")
+        registry.drop("assisted_stats")
+        for question in questions:
+            generation_pipeline.generate_answer(question, use_cache=False)
+        summary = by_mode[str(mode)] = generation_pipeline.get_assisted_stats().summary()
+        line = f"    {str(mode):>13}: plain {summary['plain']['tokens_per_second'] or 0:.1f} tokens/s"
+        if mode:
+            line += (
+                f", assisted {summary['assisted']['tokens_per_second']:.1f} tokens/s, "
+                f"acceptance {summary['acceptance_rate']:.0%}" + ("" if summary["enabled"] else " (fell back)")
+            )
+        print(line)
+    return _result(
+        "assisted", size, len(questions) * len(ASSISTED_MODES), "answers/s", time.perf_counter() - start,
+        by_mode=by_mode, max_new_tokens=GENERATION_TOKENS,
+    )
+
+def bench_batch(size: int, models: dict) -> dict:
+    """Throughput of generate_answers() against a generate_answer() loop over the same questions."""
+    _prepare_index(size, models)
+    import generation_pipeline
+    generation_pipeline.MODEL_NAME = models["llm"]
+    generation_pipeline.MAX_NEW_TOKENS = GENERATION_TOKENS
+    generation_pipeline.get_retriever()
+    generation_pipeline.get_llm()
+    rng = random.Random(SEED + 7)
+    questions = [synthetic_sentence(rng) for _ in range(BATCH_QUESTIONS)]
+
+    start = time.perf_counter()
+    for question in questions:
+        generation_pipeline.generate_answer(question, use_cache=False)
+    sequential_seconds = time.perf_counter() - start
+    generation_pipeline.get_retriever().result_cache.clear()
+    generation_pipeline.get_retriever().query_cache.clear()
+
+    start = time.perf_counter()
+    generation_pipeline.generate_answers(questions, use_cache=False)
+    batch_seconds = time.perf_counter() - start
+    print(
+        f"    sequential {len(questions) / sequential_seconds:.2f} answers/s, "
+        f"batched {len(questions) / batch_seconds:.2f} answers/s ({sequential_seconds / batch_seconds:.1f}x)"
+    )
+    return _result(
+        "batch", size, len(questions), "answers/s", batch_seconds,
+        sequential_answers_per_s=len(questions) / sequential_seconds, speedup=sequential_seconds / batch_seconds,
+        max_new_tokens=GENERATION_TOKENS,
+    )
+
+def bench_serve(size: int, models: dict) -> dict:
+    """
+    Aggregate throughput of server.AnswerService with every request submitted
+    at once, for each micro-batch limit in SERVE_BATCH_SIZES.
+    """
+    import asyncio
+    _prepare_index(size, models)
+    import generation_pipeline
+    import server
+    generation_pipeline.MODEL_NAME = models["llm"]
+    generation_pipeline.MAX_NEW_TOKENS = GENERATION_TOKENS
+    generation_pipeline.get_retriever()
+    generation_pipeline.get_llm()
+    rng = random.Random(SEED + 4)
+    queries = [synthetic_sentence(rng) for _ in range(NUM_QUERIES)]
+    questions = [synthetic_sentence(rng) for _ in range(SERVE_GENERATIONS)]
+
+    async def run(batch_size: int) -> dict:
+        service = server.AnswerService(retrieval_batch=batch_size, generation_batch=batch_size)
+        service.start()
+        start = time.perf_counter()
+        await asyncio.gather(*(service.retrieve(query, 5, "hybrid") for query in queries))
+        retrieve_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        await asyncio.gather(*(service.answer(question, 5, use_cache=False) for question in questions))
+        answer_seconds = time.perf_counter() - start
+        return {
+            "retrieve_qps": len(queries) / retrieve_seconds,
+            "answers_per_s": len(questions) / answer_seconds,
+            "mean_retrieval_batch": service.retrieval.stats()["mean_batch_size"],
+            "mean_generation_batch": service.generation.stats()["mean_batch_size"],
+        }
+
+    by_batch = {}
+    for batch_size in SERVE_BATCH_SIZES:
+        by_batch[batch_size] = asyncio.run(run(batch_size))
+        print(
+            f"    batch {batch_size:>3}: {by_batch[batch_size]['retrieve_qps']:.1f} queries/s, "
+            f"{by_batch[batch_size]['answers_per_s']:.2f} answers/s"
+        )
+    largest = by_batch[SERVE_BATCH_SIZES[-1]]
+    return _result(
+        "serve", size, len(queries), "queries/s", len(queries) / largest["retrieve_qps"],
+        by_batch_size=by_batch, max_new_tokens=GENERATION_TOKENS,
+    )
+
+def synthetic_vectors(size: int, dim: int = 384, clusters: int = 64, seed: int = SEED):
+    """Clustered unit vectors, which behave more like sentence embeddings than uniform noise."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, size)] + 0.5 * rng.standard_normal((size, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def bench_backends(size: int, models: dict) -> dict:
+    """Build/query latency and recall@10 of each vector backend against exact NumPy search."""
+    import vector_store
+
+    vectors = synthetic_vectors(size)
+    queries = synthetic_vectors(NUM_QUERIES, seed=SEED + 3)
+    ids = [f"00000000-0000-0000-0000-{i:012d}" for i in range(size)]
+    payloads = [{"row": i} for i in range(size)]
+    k = 10
+
+    backends = {}
+    exact = None
+    for backend in ("numpy", "hnsw", "qdrant"):
+        start = time.perf_counter()
+        store = vector_store.open_store(backend)
+        store.recreate()
+        for i in range(0, size, 1000):
+            store.upsert(ids[i:i + 1000], vectors[i:i + 1000], payloads[i:i + 1000])
+        store.publish(size)
+        store.close()
+        build_seconds = time.perf_counter() - start
+
+        store = vector_store.open_store(backend, read_only=True)
+        latencies = []
+        hits = []
+        for query in queries:
+            t = time.perf_counter()
+            hits.append([pid for pid, _, _ in store.search(query, k)])
+            latencies.append(time.perf_counter() - t)
+        store.close()
+        if exact is None:
+            exact = hits
+        recall = sum(len(set(h) & set(e)) for h, e in zip(hits, exact)) / sum(len(e) for e in exact)
+        backends[backend] = {
+            "build_seconds": build_seconds,
+            "latency_ms": percentiles(latencies),
+            "recall_at_10": recall,
+        }
+        print(f"    {backend:>7} {size:>7}: recall@10 {recall:.3f}, p50 {backends[backend]['latency_ms']['p50']:.2f} ms")
+
+    return _result(
+        "backends", size, size, "vectors/s", backends["numpy"]["build_seconds"],
+        backends=backends,
+    )
+
+def bench_vectorquant(size: int, models: dict) -> dict:
+    """
+    Recall@10 against exact search, query latency and first-pass memory (the
+    matrix every query scans) of int8 and binary NumPy snapshots at several
+    rescoring oversampling factors.
+    """
+    import vector_store
+
+    vectors = synthetic_vectors(size)
+    queries = synthetic_vectors(NUM_QUERIES, seed=SEED + 3)
+    ids = [f"00000000-0000-0000-0000-{i:012d}" for i in range(size)]
+    k = 10
+
+    start = time.perf_counter()
+    store = vector_store.NumpyStore(quantization=None)
+    store.recreate()
+    store.upsert(ids, vectors, [{"row": i} for i in range(size)])
+    store.close()
+    build_seconds = time.perf_counter() - start
+
+    modes = {}
+    exact = None
+    for mode in (None, "int8", "binary"):
+        vector_store.NumpyStore(quantization=mode).close()   # Adds the mode's codes to the snapshot
+        store = vector_store.NumpyStore(read_only=True, quantization=mode)
+        first_pass_bytes = store.vectors.nbytes if mode is None else store.codes.nbytes
+        for oversampling in [1.0] if mode is None else OVERSAMPLING_FACTORS:
+            vector_store.RESCORE_OVERSAMPLING = oversampling
+            latencies, hits = [], []
+            for query in queries:
+                t = time.perf_counter()
+                hits.append([pid for pid, _, _ in store.search(query, k)])
+                latencies.append(time.perf_counter() - t)
+            if exact is None:
+                exact = hits
+            recall = sum(len(set(h) & set(e)) for h, e in zip(hits, exact)) / sum(len(e) for e in exact)
+            name = "float32" if mode is None else f"{mode} x{oversampling:g}"
+            modes[name] = {
+                "first_pass_mb": first_pass_bytes / 1e6,
+                "latency_ms": percentiles(latencies),
+                "recall_at_10": recall,
+            }
+            print(f"    {name:>12}: recall@10 {recall:.3f}, p50 {modes[name]['latency_ms']['p50']:.2f} ms, "
+                  f"first pass {first_pass_bytes / 1e6:.1f} MB")
+        store.close()
+
+    return _result("vectorquant", size, size, "vectors/s", build_seconds, modes=modes)
+
+def bench_logging(size: int, models: dict) -> dict:
+    """
+    Per-call latency of Logger.info() with synchronous handlers, the async
+    writer thread under the drop and block policies, and async with sampling,
+    plus the time to drain the queue and how many records were dropped.
+    Console output goes to /dev/null; every record also goes to the rotating
+    log file.
+    """
+    import logger
+
+    modes = {
+        "sync": {"async_mode": False},
+        "async drop": {"async_mode": True, "full_policy": "drop"},
+        "async block": {"async_mode": True, "full_policy": "block"},
+        f"async sampled 1/{LOG_SAMPLE_EVERY}": {"async_mode": True, "sample_every": LOG_SAMPLE_EVERY},
+    }
+    results = {}
+    stderr = sys.stderr
+    with open(os.devnull, 'w') as devnull:
+        for mode, (name, options) in enumerate(modes.items()):
+            sys.stderr = devnull    # StreamHandler binds sys.stderr when it is created
+            try:
+                log = logger.Logger(f"Bench {name}", log_file_needed=True, log_file=f"Logs/bench_logging_{mode}.log", **options)
+            finally:
+                sys.stderr = stderr
+            latencies = []
+            start = time.perf_counter()
+            for i in range(LOG_CALLS):
+                t = time.perf_counter()
+                log.info(f"Retrieving for query {i}: what is the difference between a process and a thread?")
+                latencies.append(time.perf_counter() - t)
+            call_seconds = time.perf_counter() - start
+            log.flush()
+            results[name] = {
+                "latency_ms": percentiles(latencies),
+                "calls_per_s": LOG_CALLS / call_seconds,
+                "drain_seconds": time.perf_counter() - start - call_seconds,
+                "dropped": log.dropped,
+            }
+            log.close()
+            print(
+                f"    {name:>20}: p50 {results[name]['latency_ms']['p50'] * 1000:.1f} us, "
+                f"p99 {results[name]['latency_ms']['p99'] * 1000:.1f} us, max {results[name]['latency_ms']['max']:.2f} ms, "
+                f"drain {results[name]['drain_seconds']:.2f}s, dropped {log.dropped}"
+            )
+    sync = results["sync"]
+    return _result("logging", size, LOG_CALLS, "calls/s", LOG_CALLS / sync["calls_per_s"], modes=results)
+
+BENCHMARKS = {
+    "ingest": bench_ingest,
+    "clean": bench_clean,
+    "dedup": bench_dedup,
+    "embed": bench_embed,
+    "encoder": bench_encoder,
+    "index": bench_index,
+    "retrieve": bench_retrieve,
+    "generate": bench_generate,
+    "prefix": bench_prefix,
+    "quantize": bench_quantize,
+    "assisted": bench_assisted,
+    "batch": bench_batch,
+    "backends": bench_backends,
+    "vectorquant": bench_vectorquant,
+    "serve": bench_serve,
+    "logging": bench_logging,
+}
+
+def _child(stage: str, size: int, models: dict, workdir: str, repo_dir: str, results):
+    os.chdir(workdir)
+    sys.path.insert(0, repo_dir)
+    Path("Logs").mkdir(exist_ok=True)
+    try:
+        results.put(BENCHMARKS[stage](size, models))
+    except Exception as e:
+        results.put({"stage": stage, "size": size, "error": repr(e)})
+
+def run_stage(stage: str, size: int, models: dict) -> dict:
+    """Run one benchmark in a fresh process and workspace, so peak RSS is per stage."""
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    workdir = tempfile.mkdtemp(prefix=f"bench_{stage}_{size}_")
+    try:
+        process = ctx.Process(
+            target=_child, args=(stage, size, models, workdir, str(Path(__file__).resolve().parent), results)
+        )
+        process.start()
+        while True:
+            try:
+                result = results.get(timeout=1)
+                break
+            except queue.Empty:
+                if not process.is_alive():
+                    result = {"stage": stage, "size": size, "error": f"exited with code {process.exitcode}"}
+                    break
+        process.join()
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(baseline_path: Path, results: list):
+    """Print the throughput of each stage/size relative to a previous results file."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(r["stage"], r["size"]): r for r in json.load(f)["results"]}
+    for result in results:
+        old = baseline.get((result["stage"], result["size"]))
+        if old and old.get("throughput") and result.get("throughput"):
+            print(f"{result['stage']:>10} {result['size']:>7}: {result['throughput'] / old['throughput']:.2f}x throughput vs baseline")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline per-stage benchmarks with tiny stand-in models.")
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=list(BENCHMARKS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--compare", type=Path, default=None, help="Previous results JSON to compare against")
+    args = parser.parse_args()
+
+    model_dir = Path(tempfile.mkdtemp(prefix="bench_models_"))
+    try:
+        models = {
+            "encoder": build_tiny_encoder(model_dir / "encoder"),
+            "llm": build_tiny_llm(model_dir / "llm"),
+            "draft": build_tiny_llm(model_dir / "draft", layers=1),
+        }
+        results = []
+        for size in args.sizes:
+            for stage in args.stages:
+                result = run_stage(stage, size, models)
+                results.append(result)
+                if "error" in result:
+                    print(f"{stage:>10} {size:>7}: ERROR {result['error']}")
+                else:
+                    latency = result["latency_ms"]
+                    print(
+                        f"{stage:>10} {size:>7}: {result['throughput']:.1f} {result['unit']}, "
+                        f"peak RSS {result['peak_rss_mb']:.0f} MB"
+                        + (f", p50 {latency['p50']:.2f} ms, p99 {latency['p99']:.2f} ms" if latency else "")
+                    )
+    finally:
+        shutil.rmtree(model_dir, ignore_errors=True)
+
+    commit = git_commit()
+    output = args.output or BENCH_DIR / "results" / f"{time.strftime('%Y%m%d-%H%M%S')}_{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "results": results,
+        }, f, indent=2)
+    print(f"Saved results to {output}")
+    if args.compare:
+        compare(args.compare, results)
+
+if __name__ == "__main__":
+    main()
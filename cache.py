@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+GENERATION_PATH = Path("vector_stores/generation")  # Bumped by every (re)index of the collection
+
+def normalize_query(query: str) -> str:
+    """Lower-case and collapse whitespace so trivially different queries share a cache entry."""
+    return " ".join(query.lower().split())
+
+def read_generation(path: Path = GENERATION_PATH) -> int:
+    """Current collection generation (0 if the collection was never indexed)."""
+    try:
+        return int(Path(path).read_text().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+def bump_generation(path: Path = GENERATION_PATH) -> int:
+    """Increment the collection generation after the collection changed."""
+    path = Path(path)
+    generation = read_generation(path) + 1
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(str(generation))
+    os.replace(tmp_path, path)
+    return generation
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        """
+        Thread-safe LRU cache whose entries also expire ttl seconds after insertion.
+
+        1. maxsize -> int -> Maximum number of entries kept.\n
+        2. ttl -> float -> Entry lifetime in seconds.\n
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current size, for sizing the cache."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
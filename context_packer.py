@@ -0,0 +1,138 @@
+import re
+
+CONTEXT_TOKEN_BUDGET = 1024     # Max tokens of packed context per prompt
+MAX_OVERLAP_WORDS = 64          # Longest chunk-boundary overlap looked for when merging
+MIN_OVERLAP_WORDS = 3           # Shortest overlap trusted as the splitter's chunk_overlap (50 chars); shorter matches are coincidence
+NEAR_DUPLICATE_THRESHOLD = 0.8  # Share of a passage's shingles already in a kept passage for it to be dropped
+SHINGLE_SIZE = 3
+
+CHUNK_INDEX_RE = re.compile(r"_p\d+_c(\d+)$")
+
+def format_passage(source: str, page, text: str) -> str:
+    return f"[Source: {source}, Page: {page}]\n{text}"
+
+def _chunk_index(chunk_id: str):
+    match = CHUNK_INDEX_RE.search(chunk_id)
+    return int(match.group(1)) if match else None
+
+def _merge_words(left: list, right: list) -> list:
+    """
+    left + right without the longest suffix of left that right starts with;
+    overlaps under MIN_OVERLAP_WORDS are not removed.
+    """
+    for size in range(min(len(left), len(right), MAX_OVERLAP_WORDS), MIN_OVERLAP_WORDS - 1, -1):
+        if left[-size:] == right[:size]:
+            return left + right[size:]
+    return left + right
+
+def merge_chunks(retrieved: list) -> list:
+    """
+    Merge chunks that are neighbours on the same source/page (consecutive
+    chunk_ids, whose text overlaps by the splitter's chunk_overlap) into
+    passages: dicts with 'source', 'page', 'words', 'score' (best of its
+    chunks), 'chunk_ids' and 'rank' (best retrieval rank, for stable ordering).
+    """
+    by_page = {}
+    for rank, chunk in enumerate(retrieved):
+        by_page.setdefault((chunk["source"], chunk["page"]), []).append((rank, chunk))
+
+    passages = []
+    for (source, page), chunks in by_page.items():
+        chunks.sort(key=lambda item: _chunk_index(item[1]["chunk_id"]) if _chunk_index(item[1]["chunk_id"]) is not None else -1)
+        current, last_index = None, None
+        for rank, chunk in chunks:
+            index = _chunk_index(chunk["chunk_id"])
+            if current is not None and index is not None and last_index is not None and index <= last_index + 1:
+                if index == last_index + 1:
+                    current["words"] = _merge_words(current["words"], chunk["text"].split())
+                current["chunk_ids"].append(chunk["chunk_id"])
+                current["score"] = max(current["score"], chunk["score"])
+                current["rank"] = min(current["rank"], rank)
+            else:
+                current = {
+                    "source": source,
+                    "page": page,
+                    "words": chunk["text"].split(),
+                    "score": chunk["score"],
+                    "chunk_ids": [chunk["chunk_id"]],
+                    "rank": rank,
+                }
+                passages.append(current)
+            last_index = index
+    return passages
+
+def _shingles(words: list) -> set:
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def drop_near_duplicates(passages: list) -> tuple:
+    """
+    Keep passages best first, dropping any whose word shingles are mostly
+    (NEAR_DUPLICATE_THRESHOLD) contained in an already kept passage.
+    Returns (kept, number dropped).
+    """
+    kept, kept_shingles = [], []
+    for passage in sorted(passages, key=lambda p: (-p["score"], p["rank"])):
+        shingles = _shingles(passage["words"])
+        if any(len(shingles & other) >= NEAR_DUPLICATE_THRESHOLD * len(shingles) for other in kept_shingles):
+            continue
+        kept.append(passage)
+        kept_shingles.append(shingles)
+    return kept, len(passages) - len(kept)
+
+def _truncate(passage: dict, count_tokens, budget: int) -> str:
+    """Longest word prefix of the passage whose block fits in budget tokens ('' if none)."""
+    words = passage["words"]
+    lo, hi = 0, len(words)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(format_passage(passage["source"], passage["page"], " ".join(words[:mid]))) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return format_passage(passage["source"], passage["page"], " ".join(words[:lo])) if lo else ""
+
+def pack_context(retrieved: list, count_tokens, budget: int = CONTEXT_TOKEN_BUDGET) -> tuple:
+    """
+    Build the prompt context from retrieved chunks:
+      1. merge neighbouring/overlapping chunks of the same page,
+      2. drop near-duplicate passages,
+      3. add passages best score first while they fit in `budget` tokens
+         (as measured by count_tokens); the best passage is truncated if it
+         alone is over budget.
+
+    Returns (context, stats) where stats compares the token count with the
+    chunks joined verbatim.
+    """
+    passages = merge_chunks(retrieved)
+    passages, duplicates = drop_near_duplicates(passages)
+
+    blocks, used = [], 0
+    separator_tokens = count_tokens("\n\n")
+    for passage in passages:
+        block = format_passage(passage["source"], passage["page"], " ".join(passage["words"]))
+        cost = count_tokens(block) + (separator_tokens if blocks else 0)
+        if used + cost > budget:
+            if blocks:
+                continue
+            block = _truncate(passage, count_tokens, budget)
+            if not block:
+                continue
+            cost = count_tokens(block)
+        blocks.append(block)
+        used += cost
+
+    context = "\n\n".join(blocks)
+    unpacked = "\n\n".join(format_passage(c["source"], c["page"], c["text"]) for c in retrieved)
+    tokens, unpacked_tokens = count_tokens(context), count_tokens(unpacked)
+    stats = {
+        "chunks": len(retrieved),
+        "passages": len(passages) + duplicates,
+        "near_duplicates": duplicates,
+        "packed_passages": len(blocks),
+        "tokens": tokens,
+        "unpacked_tokens": unpacked_tokens,
+        "tokens_saved": unpacked_tokens - tokens,
+    }
+    return context, stats
@@ -1,25 +1,41 @@
-import re
+import argparse
 import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
-import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
+import tracing
 from logger import Logger
+from manifest import Manifest, file_hash
+from text_tokenizer import word_tokenize, load_stopwords, has_punkt_model
 
 log = Logger("Data Cleaning Logs", log_file_needed=True, log_file='Logs/data_cleaning.log')
 
-nltk.download("punkt")
-nltk.download("stopwords")
-nltk.download("wordnet")
-
 TXT_DIR   = Path("Interview Prep TXTs")  # Path where the extracted/raw text files are stored
 CLEAN_TXT_DIR = Path("Clean Interview Prep TXTs")    # Path where the clean text files are stored
 CHUNKS_DIR = Path("Interview Prep Chunks")  # Path where the chunked data is stored
 CLEAN_CHUNKS_DIR = Path("Clean Interview Prep Chunks")  # Path where cleaned chunks will be stored
 
-STOPWORDS = set(stopwords.words("english"))
-LEMMATIZER = WordNetLemmatizer()
+MAX_WORKERS = os.cpu_count() or 1   # Number of files cleaned in parallel
+LEMMATIZE = False                   # Lemmatize kept tokens with WordNet (needs the local wordnet corpus)
+LEMMA_CACHE_SIZE = 1 << 16          # Distinct tokens whose lemma is memoized
+
+STOPWORDS = load_stopwords()  # Local NLTK stopwords corpus, or the bundled copy; never downloaded
+
+NON_ASCII_RE = re.compile(r'[^\x00-\x7f]+')
+DISALLOWED_RE = re.compile(r'[^a-z0-9\.\s#/@(),:;\-\+%A-Z&]')
+
+@lru_cache(maxsize=None)
+def _lemmatizer():
+    from nltk.stem import WordNetLemmatizer
+    return WordNetLemmatizer()
+
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def lemmatize(token: str) -> str:
+    return _lemmatizer().lemmatize(token)
 
 def clean_text(text: str) -> str:
     """
@@ -27,49 +43,169 @@ def clean_text(text: str) -> str:
     - convert the entire data into lower case.
     - remove all non-ASCII characters.
     - preserves a specially defined set of characters.
-    - tokenization.
+    - tokenization (text_tokenizer, token-for-token equal to nltk.word_tokenize).
     - removal of stopwords.
+    - lemmatization, if LEMMATIZE is set.
     """
     text = text.lower()
+    text = NON_ASCII_RE.sub(' ', text)
+    text = DISALLOWED_RE.sub(' ', text)
+    tokens = [t for t in word_tokenize(text) if t not in STOPWORDS]
+    if LEMMATIZE:
+        tokens = [lemmatize(t) for t in tokens]
+    return " ".join(tokens)
+
+def legacy_clean_text(text: str) -> str:
+    """The original NLTK-based clean_text, kept as the reference for check_parity."""
+    from nltk.tokenize import word_tokenize as nltk_word_tokenize
+    text = text.lower()
     text = re.sub(r'[^\x00-\x7f]+', ' ', text)
     text = re.sub(r'[^a-z0-9\.\s#/@(),:;\-\+%A-Z&]', ' ', text)
-    tokens = word_tokenize(text)
+    tokens = nltk_word_tokenize(text)
     tokens = [t for t in tokens if t not in STOPWORDS]
     return " ".join(tokens)
 
-def clean_data():
-    # Clean full text files
-    for txt_file in TXT_DIR.glob("*.txt"):
-        log.info(f"Cleaning {txt_file.name}")
-        raw      = txt_file.read_text(encoding="utf-8")
-        cleaned  = clean_text(raw)
-        out_path = CLEAN_TXT_DIR / txt_file.name
-        CLEAN_TXT_DIR.mkdir(parents=True, exist_ok=True)
-        out_path.write_text(cleaned, encoding="utf-8")
-        log.info(f"Saved cleaned text to {out_path.name}")
-    
-    # Clean chunked data
-    for chunks_file in CHUNKS_DIR.glob("*_chunks.json"):
-        log.info(f"Cleaning chunks from {chunks_file.name}")
-        with open(chunks_file, 'r', encoding='utf-8') as f:
-            chunks_data = json.load(f)
-        
-        cleaned_chunks = []
-        for chunk in chunks_data:
-            cleaned_text = clean_text(chunk["text"])
-            if len(cleaned_text.strip()) > 20:  # Skip very short chunks
-                cleaned_chunks.append({
-                    "text": cleaned_text,
-                    "metadata": chunk["metadata"]
-                })
-        
-        out_path = CLEAN_CHUNKS_DIR / chunks_file.name
-        CLEAN_CHUNKS_DIR.mkdir(parents=True, exist_ok=True)
-        with open(out_path, 'w', encoding='utf-8') as f:
-            json.dump(cleaned_chunks, f, indent=2, ensure_ascii=False)
-        log.info(f"Saved {len(cleaned_chunks)} cleaned chunks to {out_path.name}")
-
-    log.info("Data cleaning complete.")
+def clean_chunks(chunks_data: list) -> list:
+    """Clean the text of each chunk, dropping chunks that end up very short."""
+    cleaned_chunks = []
+    for chunk in chunks_data:
+        cleaned_text = clean_text(chunk["text"])
+        if len(cleaned_text.strip()) > 20:  # Skip very short chunks
+            cleaned_chunks.append({
+                "text": cleaned_text,
+                "metadata": chunk["metadata"]
+            })
+    return cleaned_chunks
+
+def _remove_stale_outputs(manifest: Manifest, prefix: str, in_dir: Path, out_dir: Path, pattern: str):
+    """Delete cleaned outputs whose source file no longer exists."""
+    current = {f"{prefix}:{path.name}" for path in in_dir.glob(pattern)}
+    for key in manifest.keys("clean") - current:
+        if key.startswith(f"{prefix}:"):
+            name = key.split(":", 1)[1]
+            log.info(f"{name} was removed, deleting its cleaned output")
+            (out_dir / name).unlink(missing_ok=True)
+            manifest.remove("clean", key)
+
+
+def _init_worker(lemmatize_tokens: bool):
+    """Carry the parent's LEMMATIZE setting into spawned workers."""
+    global LEMMATIZE
+    LEMMATIZE = lemmatize_tokens
+
+def clean_file(kind: str, in_path: Path, out_path: Path) -> int:
+    """
+    Clean one full text ("txt") or chunk ("chunks") file into out_path.
+    Returns the number of cleaned chunks (1 for a text file).
+    """
+    if kind == "txt":
+        out_path.write_text(clean_text(in_path.read_text(encoding="utf-8")), encoding="utf-8")
+        return 1
+    with open(in_path, 'r', encoding='utf-8') as f:
+        chunks_data = json.load(f)
+    cleaned_chunks = clean_chunks(chunks_data)
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump(cleaned_chunks, f, indent=2, ensure_ascii=False)
+    return len(cleaned_chunks)
+
+@tracing.traced("build.clean")
+def clean_data(full_rebuild: bool = False, max_workers: int = MAX_WORKERS):
+    """
+    Clean the full text files and chunk files, one file per task on a
+    process pool (largest files first).
+    Inputs whose content hash matches the manifest (and whose cleaned output
+    exists) are skipped unless full_rebuild is set.
+    """
+    if not has_punkt_model():
+        log.warning("No local punkt_tab model: sentence ends are decided without it and may differ from nltk")
+    manifest = Manifest()
+    _remove_stale_outputs(manifest, "txt", TXT_DIR, CLEAN_TXT_DIR, "*.txt")
+    _remove_stale_outputs(manifest, "chunks", CHUNKS_DIR, CLEAN_CHUNKS_DIR, "*_chunks.json")
+    skipped = 0
+
+    jobs = []
+    for kind, in_dir, out_dir, pattern in (
+        ("txt", TXT_DIR, CLEAN_TXT_DIR, "*.txt"),
+        ("chunks", CHUNKS_DIR, CLEAN_CHUNKS_DIR, "*_chunks.json"),
+    ):
+        for in_path in in_dir.glob(pattern):
+            out_path = out_dir / in_path.name
+            key = f"{kind}:{in_path.name}"
+            digest = file_hash(in_path)
+            if not full_rebuild and out_path.exists() and manifest.is_current("clean", key, digest):
+                skipped += 1
+                continue
+            out_dir.mkdir(parents=True, exist_ok=True)
+            jobs.append((kind, in_path, out_path, key, digest))
+    jobs.sort(key=lambda job: job[1].stat().st_size, reverse=True)
+
+    log.info(f"Cleaning {len(jobs)} files ({skipped} unchanged) with {max_workers} workers")
+    start_time = time.time()
+    chunks = failed = 0
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(LEMMATIZE,)) as executor:
+        futures = {executor.submit(clean_file, kind, in_path, out_path): (kind, in_path, out_path, key, digest)
+                   for kind, in_path, out_path, key, digest in jobs}
+        for done, future in enumerate(as_completed(futures), 1):
+            kind, in_path, out_path, key, digest = futures[future]
+            try:
+                count = future.result()
+            except Exception as e:
+                failed += 1
+                log.error(f"[{done}/{len(jobs)}] Failed to clean {in_path.name}: {e}")
+                continue
+            manifest.update("clean", key, digest)
+            if kind == "chunks":
+                chunks += count
+                log.info(f"[{done}/{len(jobs)}] Saved {count} cleaned chunks to {out_path.name}")
+            else:
+                log.info(f"[{done}/{len(jobs)}] Saved cleaned text to {out_path.name}")
+
+    manifest.save()
+    tracing.annotate(files=len(jobs), failed=failed, skipped=skipped, chunks=chunks)
+    tracing.metrics.inc("build_items_total", chunks, stage="clean")
+    log.info(
+        f"Data cleaning complete: {len(jobs) - failed}/{len(jobs)} files, {chunks} chunks in "
+        f"{time.time() - start_time:.1f}s ({skipped} unchanged files skipped)."
+    )
+
+def check_parity(paths=None, max_report: int = 5) -> int:
+    """
+    Compare clean_text with legacy_clean_text token for token over a fixture
+    corpus: the given .txt / *_chunks.json files, or everything in TXT_DIR and
+    CHUNKS_DIR. Needs nltk and its punkt_tab model installed locally.
+    Returns the number of mismatching texts.
+    """
+    if not has_punkt_model():
+        raise LookupError("check_parity needs the punkt_tab model in the local NLTK data")
+    if paths is None:
+        paths = sorted(TXT_DIR.glob("*.txt")) + sorted(CHUNKS_DIR.glob("*_chunks.json"))
+
+    texts = mismatches = 0
+    for path in map(Path, paths):
+        if path.suffix == ".json":
+            with open(path, 'r', encoding='utf-8') as f:
+                samples = [chunk["text"] for chunk in json.load(f)]
+        else:
+            samples = [path.read_text(encoding="utf-8")]
+        for i, text in enumerate(samples):
+            texts += 1
+            fast, legacy = clean_text(text).split(), legacy_clean_text(text).split()
+            if fast == legacy:
+                continue
+            mismatches += 1
+            if mismatches <= max_report:
+                at = next((j for j, (a, b) in enumerate(zip(fast, legacy)) if a != b), min(len(fast), len(legacy)))
+                log.warning(f"{path.name}[{i}]: first difference at token {at}: {fast[at:at + 5]} vs {legacy[at:at + 5]}")
+    log.info(f"Parity check: {texts - mismatches}/{texts} texts identical to the NLTK implementation")
+    return mismatches
 
 if __name__ == "__main__":
-    clean_data()
+    parser = argparse.ArgumentParser(description="Clean the extracted texts and chunks.")
+    parser.add_argument("--full-rebuild", action="store_true", help="Ignore the build manifest")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--check-parity", nargs="*", metavar="FILE",
+                        help="Compare against the NLTK implementation instead of cleaning")
+    args = parser.parse_args()
+    if args.check_parity is not None:
+        sys.exit(1 if check_parity(args.check_parity or None) else 0)
+    clean_data(full_rebuild=args.full_rebuild, max_workers=args.workers)
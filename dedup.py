@@ -0,0 +1,188 @@
+import argparse
+import hashlib
+import json
+import time
+import zlib
+from pathlib import Path
+import numpy as np
+import tracing
+from logger import Logger
+
+log = Logger("Dedup Logs", log_file_needed=True, log_file='Logs/dedup.log')
+
+CLEAN_CHUNKS_DIR = Path("Clean Interview Prep Chunks")          # Input: cleaned chunks (data_cleaning.py)
+DEDUP_CHUNKS_DIR = Path("Deduplicated Interview Prep Chunks")   # Output: canonical chunks, read by embed.py
+
+SHINGLE_SIZE = 3            # Words per shingle
+NUM_PERM = 128              # MinHash signature length
+LSH_BANDS = 16              # NUM_PERM / LSH_BANDS rows per band; pairs above ~(1/bands)^(1/rows) = 0.71 Jaccard become candidates
+JACCARD_THRESHOLD = 0.8     # Estimated shingle Jaccard similarity at which a chunk counts as a near-duplicate
+SEED = 1
+
+MERSENNE_PRIME = (1 << 31) - 1
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    words = text.split()
+    if len(words) < SHINGLE_SIZE:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+def _reference(chunk: dict) -> dict:
+    metadata = chunk["metadata"]
+    return {"source": metadata["source"], "page": metadata["page"], "chunk_id": metadata["chunk_id"]}
+
+class Deduplicator:
+    """
+    Online exact + near-duplicate filter over chunk texts.
+
+    add() is called once per chunk in corpus order. The first chunk of each
+    duplicate group is canonical; later exact copies (same text hash) and near
+    copies (MinHash/LSH estimated shingle Jaccard >= threshold with a kept
+    chunk) are rejected and their source/page/chunk_id are recorded under the
+    canonical chunk_id. Only hashes, signatures, LSH buckets and these
+    references are held, never the chunks; with_duplicates() attaches the
+    references to a canonical chunk when its file is written.
+    """
+    def __init__(self, threshold: float = JACCARD_THRESHOLD, num_perm: int = NUM_PERM, bands: int = LSH_BANDS,
+                 seed: int = SEED):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.threshold = threshold
+        self.rows = num_perm // bands
+        self.buckets = [{} for _ in range(bands)]
+        self.by_hash = {}
+        self.chunk_ids = []
+        self.signatures = []
+        self.duplicates = {}
+        self.exact = self.near = 0
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash signature of the text's word shingles."""
+        hashes = _shingle_hashes(text)
+        # a * x + b stays below 2^63 for x < 2^32 and a, b < 2^31, so uint64 never overflows
+        return ((np.outer(hashes, self.a) + self.b) % MERSENNE_PRIME).min(axis=0).astype(np.uint32)
+
+    def _bands(self, signature: np.ndarray):
+        for band in range(len(self.buckets)):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, chunk: dict):
+        """chunk_id of the canonical chunk that `chunk` duplicates (recording it there), or None if `chunk` is kept."""
+        digest = hashlib.sha1(chunk["text"].encode("utf-8")).digest()
+        canonical = self.by_hash.get(digest)
+        if canonical is not None:
+            self.exact += 1
+        else:
+            signature = self.signature(chunk["text"])
+            candidates = {i for band, key in self._bands(signature) for i in self.buckets[band].get(key, ())}
+            best, best_similarity = None, self.threshold
+            for i in sorted(candidates):
+                similarity = float((self.signatures[i] == signature).mean())
+                if similarity >= best_similarity:
+                    best, best_similarity = i, similarity
+            if best is None:
+                index = len(self.chunk_ids)
+                self.chunk_ids.append(chunk["metadata"]["chunk_id"])
+                self.signatures.append(signature)
+                self.by_hash[digest] = index
+                for band, key in self._bands(signature):
+                    self.buckets[band].setdefault(key, []).append(index)
+                return None
+            canonical = best
+            self.near += 1
+        canonical_id = self.chunk_ids[canonical]
+        self.duplicates.setdefault(canonical_id, []).append(_reference(chunk))
+        return canonical_id
+
+    def with_duplicates(self, chunk: dict) -> dict:
+        """Copy of a kept chunk whose metadata["duplicates"] lists the duplicates recorded for it so far."""
+        metadata = {key: value for key, value in chunk["metadata"].items() if key != "duplicates"}
+        refs = self.duplicates.get(metadata["chunk_id"])
+        if refs:
+            metadata["duplicates"] = list(refs)
+        return {**chunk, "metadata": metadata}
+
+    def stats(self) -> dict:
+        kept = len(self.chunk_ids)
+        total = kept + self.exact + self.near
+        return {
+            "chunks": total,
+            "kept": kept,
+            "exact_duplicates": self.exact,
+            "near_duplicates": self.near,
+            "reduction": (total - kept) / total if total else 0.0,
+        }
+
+def write_chunk_file(path: Path, chunks: list):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(chunks, f, indent=2, ensure_ascii=False)
+
+def remove_stale_chunk_files(names, out_dir: Path = DEDUP_CHUNKS_DIR):
+    """Delete the chunk files of out_dir whose names are not in names."""
+    names = set(names)
+    for stale in out_dir.glob("*_chunks.json"):
+        if stale.name not in names:
+            log.info(f"{stale.name} was removed, deleting its deduplicated output")
+            stale.unlink()
+
+def patch_chunk_files(deduplicator: Deduplicator, names, out_dir: Path = DEDUP_CHUNKS_DIR) -> int:
+    """
+    Attach references to duplicates found after a file was written, one file
+    at a time. Returns the number of files rewritten.
+    """
+    patched = 0
+    for name in names:
+        with open(out_dir / name, 'r', encoding='utf-8') as f:
+            chunks = json.load(f)
+        updated = [deduplicator.with_duplicates(chunk) for chunk in chunks]
+        if updated != chunks:
+            write_chunk_file(out_dir / name, updated)
+            patched += 1
+    return patched
+
+@tracing.traced("build.dedup")
+def dedup_data(in_dir: Path = CLEAN_CHUNKS_DIR, out_dir: Path = DEDUP_CHUNKS_DIR,
+               threshold: float = JACCARD_THRESHOLD) -> dict:
+    """
+    Deduplicate the cleaned chunk files as one corpus (files in name order)
+    and write the canonical chunks to out_dir under the same file names, one
+    file at a time. Duplicates are found across files, so every file is
+    rewritten on each run, and files whose chunks gained duplicates from a
+    later file are patched afterwards; embed.py still only re-encodes chunks
+    whose text changed. Returns Deduplicator.stats() plus the run time.
+    """
+    start_time = time.time()
+    deduplicator = Deduplicator(threshold)
+    written = []
+    for chunks_file in sorted(in_dir.glob("*_chunks.json")):
+        with open(chunks_file, 'r', encoding='utf-8') as f:
+            chunks = json.load(f)
+        kept = [chunk for chunk in chunks if deduplicator.add(chunk) is None]
+        if kept:
+            write_chunk_file(out_dir / chunks_file.name, [deduplicator.with_duplicates(chunk) for chunk in kept])
+            written.append(chunks_file.name)
+    remove_stale_chunk_files(written, out_dir)
+    patch_chunk_files(deduplicator, written, out_dir)
+
+    stats = deduplicator.stats()
+    stats["seconds"] = time.time() - start_time
+    tracing.annotate(**stats)
+    tracing.metrics.inc("build_items_total", stats["chunks"], stage="dedup")
+    log.info(
+        f"Deduplication complete: kept {stats['kept']}/{stats['chunks']} chunks "
+        f"({stats['exact_duplicates']} exact, {stats['near_duplicates']} near duplicates, "
+        f"{stats['reduction']:.1%} fewer) in {stats['seconds']:.1f}s"
+    )
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drop exact and near-duplicate cleaned chunks before embedding.")
+    parser.add_argument("--threshold", type=float, default=JACCARD_THRESHOLD, help="Estimated Jaccard similarity for near-duplicates")
+    args = parser.parse_args()
+    dedup_data(threshold=args.threshold)
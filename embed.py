@@ -1,50 +1,112 @@
 import json
+import time
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
+import numpy as np
+import encoder
+import tracing
+from encoder import load_encoder
 from logger import Logger
+from manifest import Manifest, text_hash
+from embedding_store import EmbeddingStore, EmbeddingStoreWriter, STORE_DIR
 
 log = Logger("Embeddings Logs", log_file_needed=True, log_file='Logs/embeddings.log')
 
-CLEAN_CHUNKS_DIR = Path("Clean Interview Prep Chunks")    # Path where the cleaned chunks are stored
+CHUNKS_DIR  = Path("Deduplicated Interview Prep Chunks")    # Path where the deduplicated chunks are stored (dedup.py)
 EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 BATCH_SIZE  = 64
-OUT_PATH    = Path("embeddings/chunks_with_embeddings.json")
+DIM         = 384
+STORE_DTYPE = "float32"   # "float16" halves the store size
+OUT_PATH    = STORE_DIR
 
-def load_chunks():
-    """Load all chunks from JSON files."""
-    all_chunks = []
-    for chunks_file in sorted(CLEAN_CHUNKS_DIR.glob("*_chunks.json")):
+def iter_chunks():
+    """Yield chunks file by file, so only one chunks file is in memory at a time."""
+    for chunks_file in sorted(CHUNKS_DIR.glob("*_chunks.json")):
         log.info(f"Loading chunks from {chunks_file.name}")
         with open(chunks_file, 'r', encoding='utf-8') as f:
             chunks = json.load(f)
-            all_chunks.extend(chunks)
-    return all_chunks
-
-def embed_data():
-    """Embed all chunks and save with metadata."""
-    chunks = load_chunks()
-    log.info(f"Loaded {len(chunks)} chunks total")
-    
-    model = SentenceTransformer(EMBED_MODEL)
-    texts = [chunk["text"] for chunk in chunks]
-    
-    all_embeddings = []
-    for i in range(0, len(texts), BATCH_SIZE):
-        batch = texts[i:i+BATCH_SIZE]
-        log.info(f"Embedding batch {i//BATCH_SIZE+1}/{(len(texts)-1)//BATCH_SIZE+1}")
-        embs = model.encode(batch, show_progress_bar=False)
-        all_embeddings.extend(embs.tolist())
-    
-    # Combine chunks with embeddings
-    for chunk, embedding in zip(chunks, all_embeddings):
-        chunk["embedding"] = embedding
-    
-    # Save as JSON
-    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUT_PATH, 'w', encoding='utf-8') as f:
-        json.dump(chunks, f, indent=2, ensure_ascii=False)
-    
-    log.info(f"Saved {len(chunks)} chunks with embeddings to {OUT_PATH}")
+        yield from chunks
+
+def load_chunks():
+    """Load all chunks from JSON files."""
+    return list(iter_chunks())
+
+def iter_batches(items, batch_size: int = BATCH_SIZE):
+    """Group any iterable into lists of at most batch_size items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def embedding_hash(text: str) -> str:
+    """Manifest digest of a chunk's embedding: its text plus the model and backend that encode it."""
+    return text_hash(f"{EMBED_MODEL}|{encoder.ENCODER_BACKEND}|{text}")
+
+def load_previous_rows(manifest: Manifest):
+    """
+    Open the previous embedding store and map chunk_id -> row for chunks whose
+    text, model and encoder backend are still recorded in the manifest.
+    """
+    if not EmbeddingStore.exists(OUT_PATH):
+        return None, {}
+    store = EmbeddingStore(OUT_PATH)
+    rows = {
+        chunk["metadata"]["chunk_id"]: row
+        for row, chunk in enumerate(store.iter_chunks())
+        if manifest.is_current("embed", chunk["metadata"]["chunk_id"], embedding_hash(chunk["text"]))
+    }
+    return store, rows
+
+@tracing.traced("build.embed")
+def embed_data(full_rebuild: bool = False):
+    """
+    Stream chunks from the cleaned chunk files, embed them batch by batch and
+    append each batch to the embedding store, so memory does not grow with the
+    corpus. Embeddings of chunks whose text, EMBED_MODEL and ENCODER_BACKEND are
+    unchanged since the last run are copied from the previous store unless
+    full_rebuild is set.
+    """
+    manifest = Manifest()
+    previous, rows = (None, {}) if full_rebuild else load_previous_rows(manifest)
+    embedded_hashes = manifest.stage("embed")
+    manifest.clear("embed")
+
+    model = None
+    total = reused = 0
+    with EmbeddingStoreWriter(OUT_PATH, dim=DIM, dtype=STORE_DTYPE) as writer:
+        for batch_num, batch in enumerate(iter_batches(iter_chunks()), 1):
+            embs = np.empty((len(batch), DIM), dtype=np.float32)
+
+            pending = []
+            for j, chunk in enumerate(batch):
+                chunk_id = chunk["metadata"]["chunk_id"]
+                digest = embedding_hash(chunk["text"])
+                row = rows.get(chunk_id)
+                if row is not None and embedded_hashes.get(chunk_id, {}).get("hash") == digest:
+                    embs[j] = previous.vectors[row]
+                else:
+                    pending.append(j)
+                manifest.update("embed", chunk_id, digest)
+            reused += len(batch) - len(pending)
+            total += len(batch)
+
+            if pending:
+                if model is None:
+                    model = load_encoder(EMBED_MODEL, encoder.ENCODER_BACKEND)
+                log.info(f"Embedding batch {batch_num} ({len(pending)} new chunks)")
+                start = time.perf_counter()
+                embs[pending] = model.encode([batch[j]["text"] for j in pending], show_progress_bar=False)
+                tracing.metrics.observe("encode_batch_seconds", time.perf_counter() - start, stage="embed")
+            writer.append(embs, batch)
+
+    manifest.save()
+    tracing.annotate(chunks=total, reused=reused)
+    tracing.metrics.inc("build_items_total", total - reused, stage="embed")
+    log.info(f"{reused} chunks unchanged, {total - reused} embedded")
+    log.info(f"Saved {total} chunks with embeddings to {OUT_PATH}")
 
 if __name__ == "__main__":
     embed_data()
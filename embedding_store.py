@@ -0,0 +1,146 @@
+import json
+import shutil
+import sys
+from pathlib import Path
+import numpy as np
+from logger import Logger
+
+log = Logger("Embedding Store Logs", log_file_needed=True, log_file="Logs/embedding_store.log")
+
+STORE_DIR = Path("embeddings/store")
+LEGACY_JSON_PATH = Path("embeddings/chunks_with_embeddings.json")
+VECTORS_FILE = "vectors.bin"      # Row-major float32/float16 matrix, no header
+METADATA_FILE = "metadata.jsonl"  # One {"text", "metadata"} object per matrix row
+INFO_FILE = "store.json"          # {"dim", "dtype", "count"}
+
+class EmbeddingStoreWriter:
+    def __init__(self, store_dir: Path = STORE_DIR, dim: int = 384, dtype: str = "float32"):
+        """
+        Append-only writer for an embedding store.
+
+        Rows are written to a temporary directory next to store_dir, which
+        replaces the previous store on close(). Readers of the old store are
+        therefore never exposed to a partially written one.
+
+        1. store_dir -> Path -> Final location of the store.\n
+        2. dim -> int -> Embedding dimension.\n
+        3. dtype -> str -> "float32" or "float16".\n
+        """
+        if dtype not in ("float32", "float16"):
+            raise ValueError("The value of dtype must be 'float32' or 'float16'")
+        self.store_dir = Path(store_dir)
+        self.tmp_dir = self.store_dir.with_name(self.store_dir.name + ".tmp")
+        self.dim = dim
+        self.dtype = dtype
+        self.count = 0
+
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        self.tmp_dir.mkdir(parents=True)
+        self._vectors = open(self.tmp_dir / VECTORS_FILE, 'wb')
+        self._metadata = open(self.tmp_dir / METADATA_FILE, 'w', encoding='utf-8')
+
+    def append(self, vectors, chunks):
+        """Append a batch of vectors and their row-aligned chunks (dicts with 'text' and 'metadata')."""
+        vectors = np.asarray(vectors, dtype=self.dtype).reshape(-1, self.dim)
+        if len(vectors) != len(chunks):
+            raise ValueError(f"Got {len(vectors)} vectors for {len(chunks)} chunks")
+        self._vectors.write(np.ascontiguousarray(vectors).tobytes())
+        for chunk in chunks:
+            self._metadata.write(json.dumps(
+                {"text": chunk["text"], "metadata": chunk["metadata"]},
+                ensure_ascii=False
+            ) + "\n")
+        self.count += len(vectors)
+
+    def close(self):
+        """Finish writing and atomically replace the previous store."""
+        self._vectors.close()
+        self._metadata.close()
+        with open(self.tmp_dir / INFO_FILE, 'w', encoding='utf-8') as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype, "count": self.count}, f)
+
+        old_dir = self.store_dir.with_name(self.store_dir.name + ".old")
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if self.store_dir.exists():
+            self.store_dir.rename(old_dir)
+        self.tmp_dir.rename(self.store_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._vectors.close()
+            self._metadata.close()
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+class EmbeddingStore:
+    def __init__(self, store_dir: Path = STORE_DIR):
+        """
+        Read-only view of an embedding store.
+        `vectors` is a memory-mapped (count, dim) matrix, so nothing is read
+        from disk until rows are actually accessed.
+        """
+        self.store_dir = Path(store_dir)
+        with open(self.store_dir / INFO_FILE, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        self.dim = info["dim"]
+        self.dtype = info["dtype"]
+        self.count = info["count"]
+        if self.count:
+            self.vectors = np.memmap(
+                self.store_dir / VECTORS_FILE,
+                dtype=self.dtype,
+                mode='r',
+                shape=(self.count, self.dim)
+            )
+        else:
+            self.vectors = np.empty((0, self.dim), dtype=self.dtype)
+
+    @staticmethod
+    def exists(store_dir: Path = STORE_DIR) -> bool:
+        return (Path(store_dir) / INFO_FILE).exists()
+
+    def __len__(self):
+        return self.count
+
+    def iter_chunks(self):
+        """Yield the chunk dict ('text', 'metadata') of every row, in row order."""
+        with open(self.store_dir / METADATA_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def iter_batches(self, batch_size: int = 1024):
+        """Yield (chunks, vectors) batches; vectors are float32 views/copies of the memmap rows."""
+        chunks = []
+        start = 0
+        for chunk in self.iter_chunks():
+            chunks.append(chunk)
+            if len(chunks) == batch_size:
+                yield chunks, np.asarray(self.vectors[start:start + len(chunks)], dtype=np.float32)
+                start += len(chunks)
+                chunks = []
+        if chunks:
+            yield chunks, np.asarray(self.vectors[start:start + len(chunks)], dtype=np.float32)
+
+def convert_json(json_path: Path = LEGACY_JSON_PATH, store_dir: Path = STORE_DIR, dtype: str = "float32", batch_size: int = 1024):
+    """One-time conversion of the legacy chunks_with_embeddings.json into an embedding store."""
+    log.info(f"Converting {json_path} to {store_dir} ({dtype})")
+    with open(json_path, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)
+    dim = len(chunks[0]["embedding"]) if chunks else 384
+
+    with EmbeddingStoreWriter(store_dir, dim=dim, dtype=dtype) as writer:
+        for i in range(0, len(chunks), batch_size):
+            batch = chunks[i:i+batch_size]
+            writer.append([chunk["embedding"] for chunk in batch], batch)
+    log.info(f"Converted {len(chunks)} chunks into {store_dir}")
+
+if __name__ == "__main__":
+    convert_json(
+        Path(sys.argv[1]) if len(sys.argv) > 1 else LEGACY_JSON_PATH,
+        dtype=sys.argv[2] if len(sys.argv) > 2 else "float32"
+    )
@@ -0,0 +1,224 @@
+import json
+import os
+import time
+from pathlib import Path
+import numpy as np
+from logger import Logger
+
+log = Logger("Encoder Logs", log_file_needed=True, log_file="Logs/encoder.log")
+
+ENCODER_BACKEND = "torch"           # "torch" (SentenceTransformer) or "onnx" (exported, int8 ONNX Runtime model); used by embed.py and retrieve.py
+ONNX_DIR = Path("models/onnx")      # Exported encoders, one directory per model
+ONNX_QUANTIZE = True                # Dynamically quantize the exported weights to int8
+ONNX_OPSET = 17
+ONNX_THREADS = os.cpu_count() or 1
+COSINE_TOLERANCE = 0.98             # Minimum cosine similarity between ONNX and PyTorch embeddings on VALIDATION_TEXTS
+ENCODER_INPUTS = ["input_ids", "attention_mask", "token_type_ids"]
+VALIDATION_TEXTS = [
+    "What is the difference between TCP and UDP?",
+    "Explain the OSI model and the role of each layer.",
+    "How does a hash map handle collisions?",
+    "Describe a time you resolved a conflict within your team.",
+    "binary search tree insertion deletion time complexity worst case",
+    "What happens when you type a URL into the browser and press enter?",
+    "normalization database 1nf 2nf 3nf bcnf functional dependency",
+    "Why do you want to work here?",
+]
+
+def load_encoder(model_name: str, backend: str = ENCODER_BACKEND, device: str = None):
+    """
+    Sentence encoder with a SentenceTransformer-compatible encode(). The torch
+    backend runs on `device` (default: CUDA, then MPS, then CPU). The onnx
+    backend runs on CPU; it exports the model on first use (which needs
+    PyTorch once) and afterwards runs without importing torch.
+    """
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name, device=device)
+        log.info(f"Loaded {model_name} with PyTorch on {model.device}")
+        return model
+    if backend == "onnx":
+        path = onnx_path(model_name)
+        if not OnnxEncoder.exists(path):
+            export_encoder(model_name, path)
+        return OnnxEncoder(path)
+    raise ValueError(f"Unknown encoder backend {backend!r}, expected 'torch' or 'onnx'")
+
+def onnx_path(model_name: str) -> Path:
+    return ONNX_DIR / model_name.replace("/", "--")
+
+class OnnxEncoder:
+    """
+    Transformer exported to ONNX, run with ONNX Runtime and pooled/normalized
+    in NumPy exactly like the SentenceTransformer it was exported from.
+    Tokenization uses the `tokenizers` library, so no torch import is needed.
+    """
+    def __init__(self, path: Path, threads: int = ONNX_THREADS):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.path = Path(path)
+        with open(self.path / "encoder.json", 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        self.tokenizer = Tokenizer.from_file(str(self.path / "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"])
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            str(self.path / self.config["model_file"]), options, providers=["CPUExecutionProvider"]
+        )
+        log.info(f"Loaded ONNX encoder from {self.path / self.config['model_file']}")
+
+    @staticmethod
+    def exists(path: Path) -> bool:
+        return (Path(path) / "encoder.json").exists()
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dim"]
+
+    def encode(self, sentences, batch_size: int = 32, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        """Embeddings of sentences as a float32 (n, dim) array (a single string gives a (dim,) vector)."""
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        embeddings = np.empty((len(sentences), self.config["dim"]), dtype=np.float32)
+        # Length-sorted batches keep padding small; results go back in input order
+        order = sorted(range(len(sentences)), key=lambda i: len(sentences[i]))
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            embeddings[rows] = self._encode_batch([sentences[i] for i in rows])
+        return embeddings[0] if single else embeddings
+
+    def _encode_batch(self, sentences: list) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(sentences)
+        features = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {name: features[name] for name in self.config["inputs"]})[0]
+        mask = features["attention_mask"][:, :, None].astype(np.float32)
+        if self.config["pooling"] == "cls":
+            pooled = hidden[:, 0]
+        elif self.config["pooling"] == "max":
+            pooled = np.where(mask > 0, hidden, -1e9).max(axis=1)
+        else:
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config["normalize"]:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled
+
+def _pooling_mode(pooling) -> str:
+    config = pooling.get_config_dict()
+    if "pooling_mode" in config:
+        return config["pooling_mode"]
+    return pooling.get_pooling_mode_str()
+
+def min_cosine(a: np.ndarray, b: np.ndarray) -> float:
+    """Smallest row-wise cosine similarity between two embedding matrices."""
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return float((a * b).sum(axis=1).min())
+
+def export_encoder(model_name: str, path: Path = None, quantize: bool = ONNX_QUANTIZE, texts: list = None,
+                   tolerance: float = COSINE_TOLERANCE) -> Path:
+    """
+    Export the transformer of a SentenceTransformer (Transformer -> Pooling
+    -> optional Normalize) to ONNX, quantize its weights to int8, and check
+    that its embeddings of `texts` (VALIDATION_TEXTS by default) have a cosine
+    similarity of at least `tolerance` with the PyTorch model's. Nothing is
+    kept if the check fails.
+    """
+    import shutil
+    import torch
+    from sentence_transformers import SentenceTransformer, models
+
+    path = Path(path or onnx_path(model_name))
+    texts = texts or VALIDATION_TEXTS
+    start = time.time()
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer, pooling = model[0], model[1]
+    if not isinstance(transformer, models.Transformer) or not isinstance(pooling, models.Pooling):
+        raise ValueError(f"{model_name} is not a Transformer + Pooling SentenceTransformer")
+    pooling_mode = _pooling_mode(pooling)
+    if pooling_mode not in ("mean", "cls", "max"):
+        raise ValueError(f"Unsupported pooling mode {pooling_mode!r}")
+    inputs = [name for name in ENCODER_INPUTS if name in model.tokenizer.model_input_names]
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, *features):
+            return self.auto_model(**dict(zip(inputs, features))).last_hidden_state
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    sample = model.tokenizer(texts[:2], padding=True, return_tensors="pt")
+    torch.onnx.export(
+        LastHiddenState(transformer.auto_model).eval(),
+        tuple(sample[name] for name in inputs),
+        str(tmp_path / "model.onnx"),
+        input_names=inputs,
+        output_names=["last_hidden_state"],
+        dynamic_axes={name: {0: "batch", 1: "sequence"} for name in inputs + ["last_hidden_state"]},
+        opset_version=ONNX_OPSET,
+        dynamo=False,
+    )
+    model_file = "model.onnx"
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(str(tmp_path / "model.onnx"), str(tmp_path / "model.int8.onnx"), weight_type=QuantType.QInt8)
+        (tmp_path / "model.onnx").unlink()
+        model_file = "model.int8.onnx"
+
+    model.tokenizer.backend_tokenizer.save(str(tmp_path / "tokenizer.json"))
+    config = {
+        "model_name": model_name,
+        "model_file": model_file,
+        "inputs": inputs,
+        "max_seq_length": model.max_seq_length,
+        "pad_token_id": model.tokenizer.pad_token_id or 0,
+        "pooling": pooling_mode,
+        "normalize": any(isinstance(module, models.Normalize) for module in model),
+        "dim": model.get_sentence_embedding_dimension(),
+        "min_cosine": None,
+    }
+    with open(tmp_path / "encoder.json", 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+
+    config["min_cosine"] = min_cosine(OnnxEncoder(tmp_path).encode(texts), model.encode(texts, convert_to_numpy=True))
+    if config["min_cosine"] < tolerance:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise ValueError(f"ONNX embeddings of {model_name} drift too far from PyTorch (min cosine {config['min_cosine']:.4f} < {tolerance})")
+    with open(tmp_path / "encoder.json", 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    log.info(f"Exported {model_name} to {path / model_file} in {time.time() - start:.1f}s (min cosine {config['min_cosine']:.4f})")
+    return path
+
+def check_encoder(model_name: str, texts: list = None) -> float:
+    """Min cosine similarity between the exported ONNX encoder and PyTorch on texts (VALIDATION_TEXTS by default)."""
+    texts = texts or VALIDATION_TEXTS
+    onnx_model = load_encoder(model_name, "onnx")
+    torch_model = load_encoder(model_name, "torch", device="cpu")
+    similarity = min_cosine(onnx_model.encode(texts), torch_model.encode(texts, convert_to_numpy=True))
+    log.info(f"{model_name}: min cosine between ONNX and PyTorch embeddings over {len(texts)} texts is {similarity:.4f}")
+    return similarity
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description="Export the sentence encoder to int8 ONNX and check it against PyTorch.")
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--no-quantize", action="store_true", help="Export float32 weights")
+    parser.add_argument("--check", nargs="*", metavar="TEXT", help="Only compare an existing export against PyTorch")
+    args = parser.parse_args()
+    if args.check is not None:
+        sys.exit(0 if check_encoder(args.model, args.check or None) >= COSINE_TOLERANCE else 1)
+    export_encoder(args.model, quantize=not args.no_quantize)
@@ -1,18 +1,32 @@
-from model_handler import ModelHandler
-from retrieve import Retriever
-from transformers import pipeline
-from langchain_huggingface.llms import HuggingFacePipeline
+import copy
+import threading
+import time
+from collections import deque
+import registry
+import tracing
+from answer_cache import SemanticAnswerCache
+from context_packer import pack_context
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from logger import Logger
 
-# Initialize retriever
-retriever = Retriever()
+log = Logger("Generation Logs", log_file_needed=True, log_file="Logs/generation.log")
 
-model_name = "meta-llama/Llama-3.2-3B-Instruct"
-m = ModelHandler(model_name, quantize=True)
-model, tokenizer = m.load_model()
+MODEL_NAME = "meta-llama/Llama-3.2-3B-Instruct"
+MAX_NEW_TOKENS = 1024
+QUANTIZATION = True   # True for the device's default mode, False for fp32, or a model_handler.QUANTIZATION_MODES name
+GENERATION_BATCH_SIZE = 8        # Prompts per model.generate call in generate_batch()
+GENERATION_BATCH_TOKENS = 16384  # Cap on padded prompt tokens per batch
+LENGTH_BUCKET_RATIO = 1.5        # A batch's longest prompt is at most this much longer than its shortest
+USE_ANSWER_CACHE = False  # Serve answers to near-identical questions from the semantic cache (opt-in)
+USE_PREFIX_CACHE = True   # Prefill the fixed template preamble once per process and reuse its KV cache
+ASSISTED_DECODING = None  # None, "draft" (DRAFT_MODEL_NAME proposes tokens) or "prompt-lookup" (copies n-grams from the context)
+DRAFT_MODEL_NAME = "meta-llama/Llama-3.2-1B-Instruct"   # Shares the Llama 3.2 tokenizer
+MIN_ACCEPTANCE_RATE = 0.3  # Assisted decoding is switched off when the share of accepted draft tokens drops below this
+ACCEPTANCE_WINDOW = 8      # Generations the acceptance rate is averaged over
+WARM_UP_PROMPT = "Answer in one word: what does TCP stand for?"
 
-tokenizer.chat_template = """{{- bos_token -}}
+CHAT_TEMPLATE = """{{- bos_token -}}
 {%- if custom_tools is defined -%}
 	{%- set tools = custom_tools -%}
 {%- endif -%}
@@ -102,20 +116,6 @@ tokenizer.chat_template = """{{- bos_token -}}
 	{{- "<|start_header_id|>assistant<|end_header_id|>\n\n" -}}
 {%- endif -%}"""
 
-hf_pipe = pipeline(
-    "text-generation",
-    model=model,
-    tokenizer=tokenizer,
-    max_new_tokens=1024,
-    do_sample=True,
-    temperature=0.3,
-    eos_token_id=tokenizer.eos_token_id,
-    pad_token_id=tokenizer.eos_token_id,
-    return_full_text=False
-)
-
-lc_pipe = HuggingFacePipeline(pipeline=hf_pipe)
-
 template = """
 You are an interview preparation assistant. Use the provided context to answer the user's question accurately and concisely.
 
@@ -129,40 +129,548 @@ Answer:
 """
 prompt = PromptTemplate.from_template(template)
 
-chain = prompt | lc_pipe | StrOutputParser()
+def get_retriever():
+    """Process-wide Retriever, built on first use."""
+    from retrieve import Retriever
+    return registry.get("retriever", Retriever)
+
+def get_answer_cache():
+    """Process-wide semantic answer cache, loaded on first use."""
+    return registry.get("answer_cache", SemanticAnswerCache)
+
+def _load_llm() -> dict:
+    # Heavy imports are deferred so importing this module stays cheap
+    from model_handler import ModelHandler
+    from transformers import pipeline
+    from langchain_huggingface.llms import HuggingFacePipeline
+
+    m = ModelHandler(MODEL_NAME, quantize=QUANTIZATION, assisted=ASSISTED_DECODING, draft_model_name=DRAFT_MODEL_NAME)
+    model, tokenizer = m.load_model()
+    tokenizer.chat_template = CHAT_TEMPLATE
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    assistant = m.load_assistant(tokenizer)
+    if assistant:
+        model.register_forward_pre_hook(_record_forward, with_kwargs=True)
+
+    hf_pipe = pipeline(
+        "text-generation",
+        model=model,
+        tokenizer=tokenizer,
+        max_new_tokens=MAX_NEW_TOKENS,
+        do_sample=True,
+        temperature=0.3,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.eos_token_id,
+        return_full_text=False
+    )
+
+    lc_pipe = HuggingFacePipeline(pipeline=hf_pipe)
+    chain = prompt | lc_pipe | StrOutputParser()
+    return {"model": model, "tokenizer": tokenizer, "hf_pipe": hf_pipe, "chain": chain, "assistant": assistant}
+
+def get_llm() -> dict:
+    """Process-wide model, tokenizer, HF pipeline, chain and assisted decoding arguments, built on first use."""
+    return registry.get("llm", _load_llm)
+
+# Input lengths of the main model's forward calls during the current thread's assisted generation
+_forward_calls = threading.local()
+
+def _record_forward(module, args, kwargs):
+    lengths = getattr(_forward_calls, "lengths", None)
+    if lengths is not None and kwargs.get("input_ids") is not None:
+        lengths.append(kwargs["input_ids"].shape[1])
+
+class AssistedStats:
+    """
+    Acceptance rate and tokens/sec of assisted decoding against plain decoding.
+    Assisted decoding is disabled for the rest of the process once the
+    acceptance rate over the last `window` assisted generations is below
+    `min_rate`, since rejected drafts only cost time.
+    """
+    def __init__(self, window: int = ACCEPTANCE_WINDOW, min_rate: float = MIN_ACCEPTANCE_RATE):
+        self.min_rate = min_rate
+        self.enabled = True
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._totals = {
+            "assisted": {"generations": 0, "tokens": 0, "seconds": 0.0, "drafted": 0, "accepted": 0},
+            "plain": {"generations": 0, "tokens": 0, "seconds": 0.0},
+        }
+
+    def record(self, new_tokens: int, seconds: float, forward_lengths: list = None, prompt_tokens: int = 0):
+        """
+        Record one generation. For assisted ones, forward_lengths are the main
+        model's input lengths per call: the first call takes the prompt and
+        later ones the last accepted token, each plus the drafted tokens, and
+        every call emits its accepted drafts plus one token of its own.
+        """
+        with self._lock:
+            totals = self._totals["plain" if forward_lengths is None else "assisted"]
+            totals["generations"] += 1
+            totals["tokens"] += new_tokens
+            totals["seconds"] += seconds
+            if forward_lengths is None:
+                return
+            steps = len(forward_lengths)
+            drafted = max(sum(forward_lengths) - prompt_tokens - (steps - 1), 0)
+            accepted = min(max(new_tokens - steps, 0), drafted)
+            totals["drafted"] += drafted
+            totals["accepted"] += accepted
+            self._recent.append((drafted, accepted))
+
+            window_drafted = sum(d for d, _ in self._recent)
+            rate = sum(a for _, a in self._recent) / window_drafted if window_drafted else 0.0
+            if self.enabled and len(self._recent) == self._recent.maxlen and rate < self.min_rate:
+                self.enabled = False
+                log.warning(
+                    f"Assisted decoding accepted {rate:.0%} of drafted tokens over the last "
+                    f"{len(self._recent)} generations; falling back to plain decoding"
+                )
+
+    def summary(self) -> dict:
+        """Acceptance rate and tokens/sec per decoding mode."""
+        with self._lock:
+            summary = {"enabled": self.enabled}
+            for mode, totals in self._totals.items():
+                summary[mode] = {
+                    **totals,
+                    "tokens_per_second": totals["tokens"] / totals["seconds"] if totals["seconds"] else None,
+                }
+            assisted = self._totals["assisted"]
+            summary["acceptance_rate"] = assisted["accepted"] / assisted["drafted"] if assisted["drafted"] else None
+            return summary
+
+def get_assisted_stats() -> AssistedStats:
+    """Process-wide assisted decoding statistics."""
+    return registry.get("assisted_stats", AssistedStats)
+
+def warm_up():
+    """Load every component and run a short generation to prime kernels and caches."""
+    try:
+        get_retriever().embed_query(WARM_UP_PROMPT)
+        get_answer_cache()
+        get_llm()["hf_pipe"](WARM_UP_PROMPT, max_new_tokens=8)
+        if USE_PREFIX_CACHE:
+            get_prefix_cache()
+        log.info(f"Warm-up finished {registry.mark('warm'):.1f}s after cold start")
+    except Exception as e:
+        log.error(f"Warm-up failed: {e}")
+        registry.mark("warm_up_failed")
+
+def start_warm_up():
+    """Start warm_up() on a background thread, once per process."""
+    return registry.get("warm_up_thread", lambda: _start_thread(warm_up))
+
+def _start_thread(target) -> threading.Thread:
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+def is_ready() -> bool:
+    """True once warm-up has completed."""
+    return "warm" in registry.events()
+
+def prompt_prefix() -> str:
+    """The part of the prompt template before the context, identical for every request."""
+    return template[:template.index("{context}")]
+
+def _build_prefix_cache() -> dict:
+    import torch
+
+    llm = get_llm()
+    model, tokenizer = llm["model"], llm["tokenizer"]
+    input_ids = tokenizer(prompt_prefix(), return_tensors="pt")["input_ids"].to(model.device)
+    start = time.perf_counter()
+    with torch.inference_mode():
+        cache = model(input_ids=input_ids, use_cache=True).past_key_values
+    seconds = time.perf_counter() - start
+    log.info(f"Prefilled the {input_ids.shape[1]}-token prompt prefix in {seconds * 1000:.1f} ms")
+    return {"input_ids": input_ids[0].tolist(), "cache": cache, "seconds": seconds}
 
-def generate_answer(question: str, top_k: int = 5) -> dict:
+def get_prefix_cache() -> dict:
+    """
+    Process-wide KV cache of prompt_prefix() (with the BOS token), built on
+    first use: {'input_ids', 'cache', 'seconds'}. Never mutated; callers
+    generate from a deep copy.
+    """
+    return registry.get("prefix_cache", _build_prefix_cache)
+
+def _generation_inputs(prompt_text: str, use_prefix_cache: bool = USE_PREFIX_CACHE) -> dict:
+    """
+    model.generate() inputs for prompt_text. When the prompt starts with the
+    cached prefix tokens, a copy of the prefix KV cache is passed along so only
+    the remaining tokens (context and question) are prefilled.
+    """
+    llm = get_llm()
+    model, tokenizer = llm["model"], llm["tokenizer"]
+    inputs = dict(tokenizer(prompt_text, return_tensors="pt").to(model.device))
+    if use_prefix_cache:
+        prefix = get_prefix_cache()
+        length = len(prefix["input_ids"])
+        if inputs["input_ids"].shape[1] > length and inputs["input_ids"][0, :length].tolist() == prefix["input_ids"]:
+            inputs["past_key_values"] = copy.deepcopy(prefix["cache"])
+        else:
+            log.warning("Prompt does not start with the cached prefix tokens; prefilling it in full")
+    return inputs
+
+class _PhaseTimer:
+    """
+    Generation streamer that timestamps the first generated token (the end
+    of prefill) and forwards everything to `inner`. generate() puts the
+    prompt first, then the new tokens.
+    """
+    def __init__(self, inner=None):
+        self.inner = inner
+        self.puts = 0
+        self.first_token = None
+
+    def put(self, value):
+        self.puts += 1
+        if self.puts == 2:
+            self.first_token = time.perf_counter()
+        if self.inner is not None:
+            self.inner.put(value)
+
+    def end(self):
+        if self.inner is not None:
+            self.inner.end()
+
+def generate_text(prompt_text: str, streamer=None, max_new_tokens: int = None) -> str:
+    """
+    Completion for one formatted prompt, sampled like the HF pipeline. Uses
+    assisted decoding (ASSISTED_DECODING) until it falls back for a low
+    acceptance rate, and otherwise reuses the prefix KV cache
+    (USE_PREFIX_CACHE); transformers' assisted generation re-prefills the
+    whole prompt, so the two are not combined. Tokens are also pushed to
+    streamer if one is given. Traced as tokenize, prefill, decode and
+    detokenize spans.
+    """
+    import torch
+
+    with tracing.span("generate_text") as trace:
+        llm = get_llm()
+        model, tokenizer = llm["model"], llm["tokenizer"]
+        stats = get_assisted_stats()
+        assistant = llm["assistant"] if stats.enabled else {}
+        with tracing.span("tokenize"):
+            inputs = _generation_inputs(prompt_text, use_prefix_cache=USE_PREFIX_CACHE and not assistant)
+        prompt_tokens = inputs["input_ids"].shape[1]
+        timer = _PhaseTimer(streamer) if tracing.TRACING else streamer
+        _forward_calls.lengths = [] if assistant else None
+        start = time.perf_counter()
+        try:
+            with torch.inference_mode():
+                output = model.generate(
+                    **inputs,
+                    **assistant,
+                    streamer=timer,
+                    max_new_tokens=max_new_tokens or MAX_NEW_TOKENS,
+                    do_sample=True,
+                    temperature=0.3,
+                    eos_token_id=tokenizer.eos_token_id,
+                    pad_token_id=tokenizer.eos_token_id,
+                )
+            end = time.perf_counter()
+            new_tokens = output.shape[1] - prompt_tokens
+            stats.record(new_tokens, end - start, _forward_calls.lengths, prompt_tokens)
+        finally:
+            _forward_calls.lengths = None
+        if tracing.TRACING:
+            first_token = timer.first_token or end
+            cached_tokens = inputs["past_key_values"].get_seq_length() if "past_key_values" in inputs else 0
+            tracing.add_span("prefill", first_token - start, tokens=prompt_tokens - cached_tokens, cached_tokens=cached_tokens)
+            tracing.add_span("decode", end - first_token, tokens=max(new_tokens - 1, 0))
+            tracing.record_tokens("decode", max(new_tokens - 1, 0), end - first_token)
+            tracing.record_tokens("generate", new_tokens, end - start)
+            trace.set(prompt_tokens=prompt_tokens, new_tokens=new_tokens, assisted=bool(assistant))
+        with tracing.span("detokenize"):
+            return tokenizer.decode(output[0, prompt_tokens:], skip_special_tokens=True)
+
+def measure_prefill(prompt_text: str, repeats: int = 3) -> dict:
+    """
+    Best-of-repeats prefill time (one forward pass over the prompt) with and
+    without the shared prefix cache, in seconds.
+    """
+    import torch
+
+    model = get_llm()["model"]
+    timings = {}
+    for use_prefix_cache in (False, True):
+        best = float("inf")
+        for _ in range(repeats):
+            inputs = _generation_inputs(prompt_text, use_prefix_cache)
+            cache = inputs.get("past_key_values")
+            input_ids = inputs["input_ids"][:, cache.get_seq_length():] if cache is not None else inputs["input_ids"]
+            start = time.perf_counter()
+            with torch.inference_mode():
+                model(input_ids=input_ids, past_key_values=cache, use_cache=True)
+            best = min(best, time.perf_counter() - start)
+        timings["prefix_cache" if use_prefix_cache else "full"] = best
+    return {
+        "prompt_tokens": int(inputs["input_ids"].shape[1]),
+        "prefix_tokens": len(get_prefix_cache()["input_ids"]),
+        "full_seconds": timings["full"],
+        "prefix_cache_seconds": timings["prefix_cache"],
+    }
+
+def count_tokens(text: str) -> int:
+    """Length of text in model tokens."""
+    return len(get_llm()["tokenizer"](text, add_special_tokens=False)["input_ids"])
+
+def build_context(retrieved: list) -> tuple:
+    """
+    Combine retrieved chunks into the prompt context, merging overlapping
+    neighbours, dropping near-duplicates and packing to the token budget
+    (see context_packer). Returns (context, stats).
+    """
+    with tracing.span("context_assembly", chunks=len(retrieved)) as trace:
+        context, stats = pack_context(retrieved, count_tokens)
+        trace.set(tokens=stats["tokens"], passages=stats["packed_passages"])
+    log.info(
+        f"Context: {stats['packed_passages']} passages from {stats['chunks']} chunks, "
+        f"{stats['tokens']} tokens ({stats['tokens_saved']} saved)"
+    )
+    return context, stats
+
+def extract_sources(retrieved: list) -> list:
+    """Unique 'source (Page n)' strings of the retrieved chunks."""
+    return list(set([
+        f"{chunk['source']} (Page {chunk['page']})"
+        for chunk in retrieved
+    ]))
+
+def generate_answer(question: str, top_k: int = 5, use_cache: bool = USE_ANSWER_CACHE) -> dict:
     """
     Given a user question, retrieves relevant context and returns the LLaMA-generated answer.
     
     Args:
         question: User's question about invoices
         top_k: Number of chunks to retrieve
+        use_cache: Return a cached answer for a near-identical question answered from the same chunks
     
     Returns:
-        dict with 'answer', 'sources', and 'retrieved_chunks'
+        dict with 'answer', 'sources', 'retrieved_chunks', 'cached' and
+        'context_stats' (None for cached answers)
     """
-    # Retrieve relevant chunks
-    retrieved = retriever.retrieve(question, top_k=top_k)
-    
-    # Combine chunks into context
-    context = "\n\n".join([
-        f"[Source: {chunk['source']}, Page: {chunk['page']}]\n{chunk['text']}"
-        for chunk in retrieved
-    ])
-    
-    # Generate answer
-    answer = chain.invoke({"context": context, "question": question})
-    
-    # Extract unique sources
-    sources = list(set([
-        f"{chunk['source']} (Page {chunk['page']})"
-        for chunk in retrieved
-    ]))
-    
+    with tracing.span("generate_answer", top_k=top_k) as trace:
+        # Retrieve relevant chunks
+        retrieved = get_retriever().retrieve(question, top_k=top_k)
+        chunk_ids = [chunk["chunk_id"] for chunk in retrieved]
+
+        if use_cache:
+            with tracing.span("answer_cache_lookup"):
+                cached = get_answer_cache().lookup(get_retriever().embed_query(question), chunk_ids)
+            trace.set(cached=cached is not None)
+            if cached is not None:
+                return {
+                    "answer": cached["answer"],
+                    "sources": cached["sources"],
+                    "retrieved_chunks": retrieved,
+                    "cached": True,
+                    "context_stats": None
+                }
+
+        # Generate answer
+        context, context_stats = build_context(retrieved)
+        answer = generate_text(prompt.format(context=context, question=question))
+        with tracing.span("postprocess"):
+            sources = extract_sources(retrieved)
+            if use_cache:
+                get_answer_cache().add(question, get_retriever().embed_query(question), chunk_ids, answer, sources)
+
     return {
         "answer": answer,
         "sources": sources,
-        "retrieved_chunks": retrieved
+        "retrieved_chunks": retrieved,
+        "cached": False,
+        "context_stats": context_stats
+    }
+
+def generate_answer_stream(question: str, top_k: int = 5, use_cache: bool = USE_ANSWER_CACHE) -> dict:
+    """
+    Streaming variant of generate_answer().
+
+    Retrieval happens before this function returns, so sources and retrieved
+    chunks are available up front; the answer itself is produced by
+    iterating over 'tokens', which yields text pieces as the model generates
+    them on a background thread.
+
+    Returns:
+        dict with 'tokens' (iterator of str), 'sources', 'retrieved_chunks',
+        'cached' and 'context_stats'
+
+    The part up to the first token is traced as a generate_answer_stream
+    span; the generation thread records its own generate_text trace.
+    """
+    with tracing.span("generate_answer_stream", top_k=top_k) as trace:
+        retrieved = get_retriever().retrieve(question, top_k=top_k)
+        chunk_ids = [chunk["chunk_id"] for chunk in retrieved]
+        sources = extract_sources(retrieved)
+
+        if use_cache:
+            with tracing.span("answer_cache_lookup"):
+                cached = get_answer_cache().lookup(get_retriever().embed_query(question), chunk_ids)
+            trace.set(cached=cached is not None)
+            if cached is not None:
+                return {
+                    "tokens": iter([cached["answer"]]),
+                    "sources": cached["sources"],
+                    "retrieved_chunks": retrieved,
+                    "cached": True,
+                    "context_stats": None
+                }
+
+        from transformers import TextIteratorStreamer
+        llm = get_llm()
+        context, context_stats = build_context(retrieved)
+        prompt_text = prompt.format(context=context, question=question)
+    streamer = TextIteratorStreamer(llm["tokenizer"], skip_prompt=True, skip_special_tokens=True)
+    errors = []
+
+    def generate():
+        try:
+            generate_text(prompt_text, streamer=streamer)
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+
+    def tokens():
+        thread = threading.Thread(target=generate, daemon=True)
+        thread.start()
+        pieces = []
+        for piece in streamer:
+            pieces.append(piece)
+            yield piece
+        thread.join()
+        if errors:
+            raise errors[0]
+        if use_cache:
+            get_answer_cache().add(question, get_retriever().embed_query(question), chunk_ids, "".join(pieces), sources)
+
+    return {
+        "tokens": tokens(),
+        "sources": sources,
+        "retrieved_chunks": retrieved,
+        "cached": False,
+        "context_stats": context_stats
     }
 
+def length_groups(lengths: list, max_batch: int = GENERATION_BATCH_SIZE, max_tokens: int = GENERATION_BATCH_TOKENS) -> list:
+    """
+    Split item indices into batches of similar length, shortest first. A batch
+    is closed when it is full, when its padded size would exceed max_tokens,
+    or when the next item is more than LENGTH_BUCKET_RATIO times longer than
+    the batch's shortest one, so little compute is spent on padding.
+    """
+    groups, group = [], []
+    for i in sorted(range(len(lengths)), key=lengths.__getitem__):
+        if group and (
+            len(group) >= max_batch
+            or (len(group) + 1) * lengths[i] > max_tokens
+            or lengths[i] > LENGTH_BUCKET_RATIO * max(lengths[group[0]], 1)
+        ):
+            groups.append(group)
+            group = []
+        group.append(i)
+    if group:
+        groups.append(group)
+    return groups
+
+def generate_batch(prompt_texts: list, max_new_tokens: int = None, return_timings: bool = False):
+    """
+    Completions for already formatted prompts, in order. Prompts are grouped
+    by token length (length_groups) and each group runs as one left-padded
+    model.generate call with the same sampling settings as the HF pipeline.
+    With return_timings, returns (completions, seconds) where seconds[i] is
+    prompt i's share of its batch's wall time.
+    """
+    import torch
+
+    llm = get_llm()
+    model, tokenizer = llm["model"], llm["tokenizer"]
+    # Default special tokens, as in _generation_inputs, so batched prompts keep the BOS token
+    encoded = [tokenizer(text)["input_ids"] for text in prompt_texts]
+    completions = [None] * len(prompt_texts)
+    seconds = [None] * len(prompt_texts)
+    for group in length_groups([len(ids) for ids in encoded]):
+        start = time.perf_counter()
+        batch = tokenizer.pad(
+            {"input_ids": [encoded[i] for i in group]}, padding=True, padding_side="left", return_tensors="pt"
+        ).to(model.device)
+        with torch.inference_mode():
+            output = model.generate(
+                **batch,
+                max_new_tokens=max_new_tokens or MAX_NEW_TOKENS,
+                do_sample=True,
+                temperature=0.3,
+                eos_token_id=tokenizer.eos_token_id,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+        for i, tokens in zip(group, output[:, batch["input_ids"].shape[1]:]):
+            completions[i] = tokenizer.decode(tokens, skip_special_tokens=True)
+            seconds[i] = (time.perf_counter() - start) / len(group)
+        new_tokens = int((output[:, batch["input_ids"].shape[1]:] != tokenizer.pad_token_id).sum())
+        tracing.add_span("generate_group", time.perf_counter() - start, prompts=len(group), new_tokens=new_tokens)
+        tracing.record_tokens("batch", new_tokens, time.perf_counter() - start)
+        log.info(f"Generated a batch of {len(group)} (prompt length {batch['input_ids'].shape[1]})")
+    return (completions, seconds) if return_timings else completions
+
+def generate_answers(questions: list, top_k: int = 5, use_cache: bool = USE_ANSWER_CACHE, max_new_tokens: int = None) -> list:
+    """
+    generate_answer() for many questions at once: all queries are embedded in
+    one pass and searched in one batched vector lookup (Retriever.retrieve_batch),
+    and uncached answers are generated in length-bucketed batches
+    (generate_batch).
+
+    Returns:
+        one dict per question, in order, with the keys of generate_answer()
+        plus 'timings': {'retrieve_seconds', 'generate_seconds'}, each item's
+        share of the batched retrieval and of its generation batch
+    """
+    if not questions:
+        return []
+    with tracing.span("generate_answers", questions=len(questions), top_k=top_k):
+        return _generate_answers(questions, top_k, use_cache, max_new_tokens)
+
+def _generate_answers(questions: list, top_k: int, use_cache: bool, max_new_tokens: int) -> list:
+    retriever = get_retriever()
+    start = time.perf_counter()
+    retrieved_all = retriever.retrieve_batch(questions, top_k=top_k)
+    retrieve_seconds = (time.perf_counter() - start) / len(questions)
+    embeddings = retriever.embed_queries(questions) if use_cache else [None] * len(questions)
+
+    results, pending = [None] * len(questions), []
+    for i, (question, retrieved, embedding) in enumerate(zip(questions, retrieved_all, embeddings)):
+        cached = get_answer_cache().lookup(embedding, [chunk["chunk_id"] for chunk in retrieved]) if use_cache else None
+        if cached is not None:
+            results[i] = {
+                "answer": cached["answer"],
+                "sources": cached["sources"],
+                "retrieved_chunks": retrieved,
+                "cached": True,
+                "context_stats": None,
+                "timings": {"retrieve_seconds": retrieve_seconds, "generate_seconds": 0.0},
+            }
+        else:
+            pending.append(i)
+
+    contexts = [build_context(retrieved_all[i]) for i in pending]
+    prompt_texts = [prompt.format(context=context, question=questions[i]) for i, (context, _) in zip(pending, contexts)]
+    answers, seconds = generate_batch(prompt_texts, max_new_tokens, return_timings=True) if pending else ([], [])
+    for i, (_, context_stats), answer, generate_seconds in zip(pending, contexts, answers, seconds):
+        sources = extract_sources(retrieved_all[i])
+        if use_cache:
+            get_answer_cache().add(questions[i], embeddings[i], [chunk["chunk_id"] for chunk in retrieved_all[i]], answer, sources)
+        results[i] = {
+            "answer": answer,
+            "sources": sources,
+            "retrieved_chunks": retrieved_all[i],
+            "cached": False,
+            "context_stats": context_stats,
+            "timings": {"retrieve_seconds": retrieve_seconds, "generate_seconds": generate_seconds},
+        }
+    if use_cache and pending:
+        get_answer_cache().flush()
+    log.info(f"Answered {len(questions)} questions ({len(questions) - len(pending)} from cache)")
+    return results
@@ -1,65 +1,207 @@
+import hashlib
 import json
-from pathlib import Path
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import tracing
 from logger import Logger
+from cache import bump_generation
+from manifest import Manifest
+from embedding_store import EmbeddingStore, STORE_DIR
+from lexical_index import LexicalIndex, build_lexical_index
+from vector_store import VectorStore, open_store, VECTOR_BACKEND
 
 log = Logger("Indexing Logs", log_file_needed=True, log_file="Logs/indexing.log")
 
-CHUNKS_PATH = Path("embeddings/chunks_with_embeddings.json")
-COLLECTION_NAME = "invoices"
-QDRANT_PATH = Path("vector_stores/qdrant")
-DIM = 384
+CHUNKS_PATH = STORE_DIR
+POINT_ID_NAMESPACE = uuid.UUID("6f2a4c1e-7d3b-4e8a-9c5f-0b1d2e3f4a5b")
+UPSERT_BATCH_SIZE = 512     # Points per upsert request
+UPLOAD_WORKERS = 4          # Concurrent upsert requests, for stores with parallel_upserts (Qdrant server)
 
-def index_data():
-    """Index chunks with embeddings into Qdrant."""
-    log.info("Loading chunks with embeddings...")
-    with open(CHUNKS_PATH, 'r', encoding='utf-8') as f:
-        chunks = json.load(f)
-    
-    log.info(f"Loaded {len(chunks)} chunks")
-    
-    # Initialize Qdrant client (local storage)
-    QDRANT_PATH.mkdir(parents=True, exist_ok=True)
-    client = QdrantClient(path=str(QDRANT_PATH))
-    
-    # Create collection if it doesn't exist
-    try:
-        client.get_collection(COLLECTION_NAME)
-        log.info(f"Collection '{COLLECTION_NAME}' already exists, deleting...")
-        client.delete_collection(COLLECTION_NAME)
-    except:
-        pass
-    
-    log.info(f"Creating collection '{COLLECTION_NAME}'...")
-    client.create_collection(
-        collection_name=COLLECTION_NAME,
-        vectors_config=VectorParams(size=DIM, distance=Distance.COSINE)
+def point_id(chunk_id: str) -> str:
+    """Stable point ID (a UUID string, as Qdrant requires) derived from a chunk_id."""
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, chunk_id))
+
+def chunk_digest(chunk: dict, vector: np.ndarray) -> str:
+    """Hash of everything that ends up in a vector store point."""
+    digest = hashlib.sha256(
+        json.dumps({"text": chunk["text"], "metadata": chunk["metadata"]}, sort_keys=True).encode("utf-8")
     )
+    digest.update(np.ascontiguousarray(vector, dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+def chunk_payload(chunk: dict) -> dict:
+    """Payload stored with a chunk's vector (plus the references of its duplicates, see dedup.py)."""
+    payload = {
+        "text": chunk["text"],
+        "source": chunk["metadata"]["source"],
+        "page": chunk["metadata"]["page"],
+        "chunk_id": chunk["metadata"]["chunk_id"]
+    }
+    if chunk["metadata"].get("duplicates"):
+        payload["duplicates"] = chunk["metadata"]["duplicates"]
+    return payload
+
+def prepare_store(vectors: VectorStore, manifest: Manifest, backend: str, recreate: bool = False):
+    """
+    Make sure the vector store exists. It is (re)created when recreate is set,
+    the backend changed since the last run, or it still uses the legacy
+    enumerate-based point IDs; the manifest's index entries are cleared
+    whenever the store starts out empty.
+    """
+    if (
+        recreate
+        or not vectors.exists()
+        or not manifest.keys("index")
+        or not manifest.is_current("index_backend", "backend", backend)
+    ):
+        vectors.recreate()
+        manifest.clear("index")
+        manifest.update("index_backend", "backend", backend)
+
+def _upsert_points(vectors: VectorStore, batch):
+    vectors.upsert(
+        [point_id(chunk["metadata"]["chunk_id"]) for chunk, _, _ in batch],
+        np.stack([vector for _, vector, _ in batch]),
+        [chunk_payload(chunk) for chunk, _, _ in batch]
+    )
+
+def _record_batch(manifest: Manifest, batch):
+    for chunk, _, digest in batch:
+        manifest.update("index", chunk["metadata"]["chunk_id"], digest)
+
+def upsert_batch(vectors: VectorStore, manifest: Manifest, batch) -> int:
+    """Upsert a list of (chunk, vector, digest) and record them in the manifest."""
+    _upsert_points(vectors, batch)
+    _record_batch(manifest, batch)
+    return len(batch)
+
+class BatchUploader:
+    """
+    Upserts batches of (chunk, vector, digest) with up to `workers` requests
+    in flight when the store supports parallel upserts, serially otherwise.
+    A batch is recorded in the manifest (from the calling thread) only once
+    its upsert has completed, and at most 2 * workers batches are held in
+    memory at a time.
+    """
+    def __init__(self, vectors: VectorStore, manifest: Manifest, workers: int = UPLOAD_WORKERS):
+        self.vectors = vectors
+        self.manifest = manifest
+        self.workers = max(workers, 1) if vectors.parallel_upserts else 1
+        self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix="upsert") if self.workers > 1 else None
+        self.pending = deque()
+        self.upserted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+    def submit(self, batch):
+        if self.pool is None:
+            self.upserted += upsert_batch(self.vectors, self.manifest, batch)
+            return
+        self.pending.append((self.pool.submit(_upsert_points, self.vectors, batch), batch))
+        while len(self.pending) > 2 * self.workers:
+            self._finish_oldest()
+
+    def _finish_oldest(self):
+        future, batch = self.pending.popleft()
+        future.result()
+        _record_batch(self.manifest, batch)
+        self.upserted += len(batch)
+
+    def close(self):
+        """Wait for every submitted batch."""
+        try:
+            while self.pending:
+                self._finish_oldest()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown(cancel_futures=True)
+
+@tracing.traced("build.index")
+def index_data(full_rebuild: bool = False, batch_size: int = UPSERT_BATCH_SIZE, backend: str = None,
+               workers: int = UPLOAD_WORKERS):
+    """
+    Index chunks with embeddings into the configured vector backend.
+    Chunks are streamed from the embedding store and upserted batch by batch
+    (`workers` at a time where the store allows it); only chunks whose content
+    changed since the last run are sent, and points of chunks that
+    disappeared are deleted. The store is only recreated when full_rebuild is
+    set, the backend changed, or it still uses the legacy enumerate-based
+    point IDs. A recreated Qdrant store is built next to the live collection
+    and only swapped in once its point count checks out, so queries keep
+    being served during the rebuild.
+    """
+    backend = backend or VECTOR_BACKEND
+    log.info("Opening embedding store...")
+    store = EmbeddingStore(CHUNKS_PATH)
+    log.info(f"Embedding store has {len(store)} chunks")
+    manifest = Manifest()
     
-    # Prepare points for insertion
-    points = []
-    for idx, chunk in enumerate(chunks):
-        point = PointStruct(
-            id=idx,
-            vector=chunk["embedding"],
-            payload={
-                "text": chunk["text"],
-                "source": chunk["metadata"]["source"],
-                "page": chunk["metadata"]["page"],
-                "chunk_id": chunk["metadata"]["chunk_id"]
-            }
-        )
-        points.append(point)
-    
-    # Insert in batches
-    batch_size = 100
-    for i in range(0, len(points), batch_size):
-        batch = points[i:i+batch_size]
-        client.upsert(collection_name=COLLECTION_NAME, points=batch)
-        log.info(f"Inserted batch {i//batch_size+1}/{(len(points)-1)//batch_size+1}")
+    vectors = open_store(backend)
+    prepare_store(vectors, manifest, backend, recreate=full_rebuild)
     
-    log.info(f"Successfully indexed {len(points)} chunks into Qdrant")
+    # Upsert changed chunks in batches as they stream out of the store
+    current = set()
+    batch = []
+    batches = 0
+    with BatchUploader(vectors, manifest, workers) as uploader:
+        for chunk, vector in zip(store.iter_chunks(), store.vectors):
+            chunk_id = chunk["metadata"]["chunk_id"]
+            current.add(chunk_id)
+            digest = chunk_digest(chunk, vector)
+            if manifest.is_current("index", chunk_id, digest):
+                continue
+            batch.append((chunk, np.asarray(vector, dtype=np.float32), digest))
+            if len(batch) == batch_size:
+                uploader.submit(batch)
+                batches += 1
+                log.info(f"Submitted batch {batches} ({uploader.upserted} chunks inserted so far)")
+                batch = []
+        if batch:
+            uploader.submit(batch)
+    upserted = uploader.upserted
+    log.info(f"Inserted {upserted} chunks with {uploader.workers} upload worker(s)")
+
+    removed = sorted(manifest.keys("index") - current)
+    for i in range(0, len(removed), batch_size):
+        batch = removed[i:i+batch_size]
+        vectors.delete([point_id(chunk_id) for chunk_id in batch])
+        for chunk_id in batch:
+            manifest.remove("index", chunk_id)
+    with tracing.span("publish"):
+        vectors.publish(len(manifest.keys("index")))
+        vectors.close()
+
+    if upserted or removed or not LexicalIndex.exists():
+        with tracing.span("lexical_index"):
+            build_lexical_index(
+                store.iter_chunks(),
+                (point_id(chunk["metadata"]["chunk_id"]) for chunk in store.iter_chunks())
+            )
+
+    manifest.save()
+    if upserted or removed:
+        bump_generation()
+    tracing.annotate(backend=backend, upserted=upserted, removed=len(removed), unchanged=len(current) - upserted)
+    tracing.metrics.inc("build_items_total", upserted, stage="index")
+    log.info(
+        f"Successfully indexed {upserted} chunks into {backend} "
+        f"({len(removed)} removed, {len(current) - upserted} unchanged)"
+    )
 
 if __name__ == "__main__":
-    index_data()
+    import argparse
+    parser = argparse.ArgumentParser(description="Index embedded chunks into the vector store.")
+    parser.add_argument("--full-rebuild", action="store_true", help="Rebuild the store from scratch (Qdrant: into a new collection version)")
+    parser.add_argument("--batch-size", type=int, default=UPSERT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=UPLOAD_WORKERS)
+    args = parser.parse_args()
+    index_data(args.full_rebuild, args.batch_size, workers=args.workers)
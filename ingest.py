@@ -1,10 +1,15 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from pdf2image import convert_from_path
 import pytesseract
 import json
+import tracing
 from logger import Logger
+from manifest import Manifest, file_hash
 
 log = Logger("Ingestion Logs", log_file_needed=True, log_file="Logs/ingestion.log")
 
@@ -12,85 +17,236 @@ PDF_DIR = Path("Interview Prep PDFs/New")  # Path to all the PDFs
 TXT_DIR = Path("Interview Prep TXTs")    # Path where the extracted/raw text are stored
 CHUNKS_DIR = Path("Interview Prep Chunks")  # Path where chunked data with metadata will be stored
 
-def ocr_page_images(pdf_path: Path):
+MAX_WORKERS = os.cpu_count() or 1   # Number of PDFs processed in parallel
+MIN_DIGITAL_CHARS = 20              # Pages with less digital text than this fall back to OCR
+OCR_DPI = 500                       # DPI used for OCR (and for re-renders in adaptive mode)
+OCR_CONFIG = '--oem 3 --psm 6'
+OCR_ADAPTIVE = False                # Start at OCR_BASE_DPI and re-render only low-confidence pages
+OCR_BASE_DPI = 300
+OCR_MIN_CONFIDENCE = 60             # Mean Tesseract word confidence below which a page is re-rendered
+
+def _ocr_image(img):
     """
-    Convert all pages of the PDF into images and run Tesseract OCR.
-    Returns a list of strings, one per page.
+    OCR a single page image.
+    Returns the page text and Tesseract's mean word confidence (0-100).
     """
+    data = pytesseract.image_to_data(
+        img,
+        lang='eng',
+        config=OCR_CONFIG,
+        output_type=pytesseract.Output.DICT
+    )
+    lines = {}
+    confidences = []
+    for word, conf, block, par, line in zip(
+        data["text"], data["conf"], data["block_num"], data["par_num"], data["line_num"]
+    ):
+        if not word.strip():
+            continue
+        lines.setdefault((block, par, line), []).append(word)
+        if float(conf) >= 0:
+            confidences.append(float(conf))
+    # Blank line between paragraphs and blocks, as in image_to_string, so both OCR paths chunk alike
+    text, previous = "", None
+    for (block, par, _), words in lines.items():
+        if previous is not None:
+            text += "\n\n" if (block, par) != previous else "\n"
+        text += " ".join(words)
+        previous = (block, par)
+    confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return text, confidence
+
+def _render_page(pdf_path: Path, page_num: int, dpi: int):
     images = convert_from_path(
         str(pdf_path),
-        dpi=500
+        dpi=dpi,
+        first_page=page_num,
+        last_page=page_num
     )
-    texts = []
-    for img in images:
-        txt = pytesseract.image_to_string(
-            img,
-            lang='eng', 
-            config='--oem 3 --psm 6'
-        )
-        texts.append(txt)
-    return texts
+    return images[0]
 
-def extract_and_save():
+def iter_ocr_pages(pdf_path: Path, page_numbers, adaptive: bool = OCR_ADAPTIVE):
     """
-    For each PDF:
-      1. Extract digital text via PyPDFLoader.
-      2. If any page's text is empty, fallback to OCR for that page.
-      3. Split text into chunks with metadata.
-      4. Save both full text and chunked data.
+    Rasterize and OCR the requested (1-based) pages one at a time.
+    Only a single page image is alive at any moment, so peak memory does not
+    grow with the length of the PDF.
+
+    With adaptive=True a page is first rendered at OCR_BASE_DPI and re-rendered
+    at OCR_DPI only if Tesseract's mean confidence is below OCR_MIN_CONFIDENCE.
+
+    Yields (page_num, text) tuples.
+    """
+    for page_num in sorted(page_numbers):
+        if not adaptive:
+            img = _render_page(pdf_path, page_num, OCR_DPI)
+            text = pytesseract.image_to_string(img, lang='eng', config=OCR_CONFIG)
+            img.close()
+            yield page_num, text
+            continue
+
+        img = _render_page(pdf_path, page_num, OCR_BASE_DPI)
+        text, confidence = _ocr_image(img)
+        img.close()
+        if confidence < OCR_MIN_CONFIDENCE:
+            log.debug(
+                f"{pdf_path.name} p{page_num}: confidence {confidence:.0f} at "
+                f"{OCR_BASE_DPI} DPI, re-rendering at {OCR_DPI} DPI"
+            )
+            img = _render_page(pdf_path, page_num, OCR_DPI)
+            text, _ = _ocr_image(img)
+            img.close()
+        yield page_num, text
+
+def ocr_page_images(pdf_path: Path, page_numbers, adaptive: bool = OCR_ADAPTIVE):
+    """
+    OCR only the requested (1-based) pages of the PDF.
+    Returns a dict mapping page number to OCR text.
     """
-    text_splitter = RecursiveCharacterTextSplitter(
+    return dict(iter_ocr_pages(pdf_path, page_numbers, adaptive=adaptive))
+
+def _make_text_splitter():
+    return RecursiveCharacterTextSplitter(
         chunk_size=512,
         chunk_overlap=50,
         length_function=len,
         separators=["\n\n", "\n", ". ", " ", ""]
     )
-    
-    for pdf_file in PDF_DIR.glob("*.pdf"):
-        log.info(f"Processing {pdf_file.name}")
-        loader = PyPDFLoader(str(pdf_file))
-        docs = loader.load()
-
-        digital_pages = [doc.page_content or "" for doc in docs]
-
-        ocr_pages = ocr_page_images(pdf_file)
-
-        merged_pages = []
-        for page_num, (d, o) in enumerate(zip(digital_pages, ocr_pages), 1):
-            if len(d.strip()) < 20:
-                merged_pages.append((page_num, o))
-            else:
-                merged_pages.append((page_num, d))
-
-        # Save full text
-        full_text = "\n".join([text for _, text in merged_pages])
-        txt_path = TXT_DIR / f"{pdf_file.stem}.txt"
-        TXT_DIR.mkdir(parents=True, exist_ok=True)
-        txt_path.write_text(full_text, encoding="utf-8")
-        log.info(f"Wrote text to {txt_path.name}")
-        
-        # Create chunks with metadata
-        chunks_data = []
-        for page_num, page_text in merged_pages:
-            chunks = text_splitter.split_text(page_text)
-            for chunk_idx, chunk in enumerate(chunks):
-                chunks_data.append({
-                    "text": chunk,
-                    "metadata": {
-                        "source": pdf_file.name,
-                        "page": page_num,
-                        "chunk_id": f"{pdf_file.stem}_p{page_num}_c{chunk_idx}"
-                    }
-                })
-        
-        # Save chunks
-        chunks_path = CHUNKS_DIR / f"{pdf_file.stem}_chunks.json"
-        CHUNKS_DIR.mkdir(parents=True, exist_ok=True)
-        with open(chunks_path, 'w', encoding='utf-8') as f:
-            json.dump(chunks_data, f, indent=2, ensure_ascii=False)
-        log.info(f"Wrote {len(chunks_data)} chunks to {chunks_path.name}")
-
-    log.info("PDF ingestion with OCR complete.")
+
+def _init_worker():
+    """Keep Tesseract single-threaded so parallelism comes from the process pool."""
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+def process_pdf(pdf_file: Path, return_chunks: bool = False):
+    """
+    Extract, chunk and save a single PDF.
+      1. Extract digital text via PyPDFLoader.
+      2. OCR only the pages whose digital text is too short.
+      3. Split text into chunks with metadata.
+      4. Save both full text and chunked data.
+
+    Returns a dict with page, OCR page and chunk counts for progress reporting,
+    plus the chunks themselves under "chunks_data" if return_chunks is set.
+    """
+    loader = PyPDFLoader(str(pdf_file))
+    docs = loader.load()
+
+    digital_pages = [doc.page_content or "" for doc in docs]
+    ocr_needed = [
+        page_num for page_num, d in enumerate(digital_pages, 1)
+        if len(d.strip()) < MIN_DIGITAL_CHARS
+    ]
+    ocr_pages = ocr_page_images(pdf_file, ocr_needed) if ocr_needed else {}
+
+    merged_pages = []
+    for page_num, d in enumerate(digital_pages, 1):
+        if page_num in ocr_pages:
+            merged_pages.append((page_num, ocr_pages[page_num]))
+        else:
+            merged_pages.append((page_num, d))
+
+    # Save full text
+    full_text = "\n".join([text for _, text in merged_pages])
+    txt_path = TXT_DIR / f"{pdf_file.stem}.txt"
+    TXT_DIR.mkdir(parents=True, exist_ok=True)
+    txt_path.write_text(full_text, encoding="utf-8")
+
+    # Create chunks with metadata
+    text_splitter = _make_text_splitter()
+    chunks_data = []
+    for page_num, page_text in merged_pages:
+        chunks = text_splitter.split_text(page_text)
+        for chunk_idx, chunk in enumerate(chunks):
+            chunks_data.append({
+                "text": chunk,
+                "metadata": {
+                    "source": pdf_file.name,
+                    "page": page_num,
+                    "chunk_id": f"{pdf_file.stem}_p{page_num}_c{chunk_idx}"
+                }
+            })
+
+    # Save chunks
+    chunks_path = CHUNKS_DIR / f"{pdf_file.stem}_chunks.json"
+    CHUNKS_DIR.mkdir(parents=True, exist_ok=True)
+    with open(chunks_path, 'w', encoding='utf-8') as f:
+        json.dump(chunks_data, f, indent=2, ensure_ascii=False)
+
+    stats = {
+        "pages": len(merged_pages),
+        "ocr_pages": len(ocr_pages),
+        "chunks": len(chunks_data),
+    }
+    if return_chunks:
+        stats["chunks_data"] = chunks_data
+    return stats
+
+def _remove_outputs(stem: str):
+    """Delete the text and chunk files produced for a PDF."""
+    for path in (TXT_DIR / f"{stem}.txt", CHUNKS_DIR / f"{stem}_chunks.json"):
+        path.unlink(missing_ok=True)
+
+@tracing.traced("build.ingest")
+def extract_and_save(max_workers: int = MAX_WORKERS, full_rebuild: bool = False):
+    """
+    Ingest every PDF in PDF_DIR, fanning the files out over a process pool.
+    Progress is reported once per finished PDF for the run as a whole.
+
+    PDFs whose content hash matches the manifest (and whose outputs still
+    exist) are skipped unless full_rebuild is set. Outputs of PDFs that were
+    removed from PDF_DIR are deleted.
+    """
+    manifest = Manifest()
+    pdf_files = sorted(PDF_DIR.glob("*.pdf"))
+
+    for name in manifest.keys("ingest") - {pdf_file.name for pdf_file in pdf_files}:
+        log.info(f"{name} was removed, deleting its outputs")
+        _remove_outputs(manifest.get("ingest", name)["stem"])
+        manifest.remove("ingest", name)
+
+    hashes = {}
+    pending = []
+    for pdf_file in pdf_files:
+        hashes[pdf_file] = file_hash(pdf_file)
+        outputs_exist = (
+            (TXT_DIR / f"{pdf_file.stem}.txt").exists()
+            and (CHUNKS_DIR / f"{pdf_file.stem}_chunks.json").exists()
+        )
+        if full_rebuild or not outputs_exist or not manifest.is_current("ingest", pdf_file.name, hashes[pdf_file]):
+            pending.append(pdf_file)
+
+    total = len(pending)
+    log.info(f"Ingesting {total} PDFs ({len(pdf_files) - total} unchanged) with {max_workers} workers")
+
+    start_time = time.time()
+    pages = ocr_pages = chunks = failed = 0
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as executor:
+        futures = {executor.submit(process_pdf, pdf_file): pdf_file for pdf_file in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            pdf_file = futures[future]
+            try:
+                stats = future.result()
+            except Exception as e:
+                failed += 1
+                log.error(f"[{done}/{total}] Failed to process {pdf_file.name}: {e}")
+                continue
+            manifest.update("ingest", pdf_file.name, hashes[pdf_file], stem=pdf_file.stem)
+            pages += stats["pages"]
+            ocr_pages += stats["ocr_pages"]
+            chunks += stats["chunks"]
+            log.info(
+                f"[{done}/{total}] {pdf_file.name}: {stats['pages']} pages "
+                f"({stats['ocr_pages']} OCR), {stats['chunks']} chunks"
+            )
+
+    manifest.save()
+    tracing.annotate(pdfs=total, failed=failed, pages=pages, ocr_pages=ocr_pages, chunks=chunks)
+    tracing.metrics.inc("build_items_total", pages, stage="ingest")
+    elapsed = time.time() - start_time
+    log.info(
+        f"PDF ingestion with OCR complete: {total - failed}/{total} PDFs, {pages} pages "
+        f"({ocr_pages} OCR), {chunks} chunks in {elapsed:.1f}s "
+        f"({pages / elapsed if elapsed else 0:.1f} pages/s)"
+    )
 
 if __name__ == "__main__":
     extract_and_save()
@@ -0,0 +1,132 @@
+import json
+import math
+import shutil
+from collections import Counter
+from pathlib import Path
+import numpy as np
+from logger import Logger
+
+log = Logger("Lexical Index Logs", log_file_needed=True, log_file="Logs/lexical_index.log")
+
+LEXICAL_PATH = Path("vector_stores/lexical")
+K1 = 1.2
+B = 0.75
+
+def tokenize(cleaned_text: str) -> list:
+    """
+    Terms of a text that already went through data_cleaning.clean_text:
+    whitespace tokens, without pure punctuation.
+    """
+    return [token for token in cleaned_text.split() if any(c.isalnum() for c in token)]
+
+def build_lexical_index(chunks, point_ids, out_dir: Path = LEXICAL_PATH):
+    """
+    Build the BM25 postings for the cleaned chunks and write them to out_dir.
+
+    Layout:
+        vocab.json         term -> [offset, df] into the postings arrays
+        postings_docs.bin  int32 row numbers, grouped by term
+        postings_tf.bin    uint16 term frequencies, aligned with postings_docs.bin
+        doc_lengths.bin    int32 number of terms per row
+        docs.json          {"chunk_ids": [...], "point_ids": [...]} per row
+        stats.json         {"num_docs", "avgdl", "num_postings"}
+
+    The index is written to a temporary directory and swapped in at the end.
+    """
+    postings = {}
+    doc_lengths = []
+    chunk_ids = []
+    row_point_ids = []
+    for row, (chunk, pid) in enumerate(zip(chunks, point_ids)):
+        terms = tokenize(chunk["text"])
+        doc_lengths.append(len(terms))
+        chunk_ids.append(chunk["metadata"]["chunk_id"])
+        row_point_ids.append(pid)
+        for term, tf in Counter(terms).items():
+            postings.setdefault(term, []).append((row, min(tf, 65535)))
+
+    tmp_dir = out_dir.with_name(out_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    vocab = {}
+    offset = 0
+    with open(tmp_dir / "postings_docs.bin", 'wb') as docs_f, open(tmp_dir / "postings_tf.bin", 'wb') as tf_f:
+        for term in sorted(postings):
+            entries = postings[term]
+            vocab[term] = [offset, len(entries)]
+            docs_f.write(np.fromiter((row for row, _ in entries), dtype=np.int32, count=len(entries)).tobytes())
+            tf_f.write(np.fromiter((tf for _, tf in entries), dtype=np.uint16, count=len(entries)).tobytes())
+            offset += len(entries)
+    np.asarray(doc_lengths, dtype=np.int32).tofile(tmp_dir / "doc_lengths.bin")
+    with open(tmp_dir / "vocab.json", 'w', encoding='utf-8') as f:
+        json.dump(vocab, f, ensure_ascii=False)
+    with open(tmp_dir / "docs.json", 'w', encoding='utf-8') as f:
+        json.dump({"chunk_ids": chunk_ids, "point_ids": row_point_ids}, f)
+    with open(tmp_dir / "stats.json", 'w', encoding='utf-8') as f:
+        json.dump({
+            "num_docs": len(doc_lengths),
+            "avgdl": sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0,
+            "num_postings": offset,
+        }, f)
+
+    old_dir = out_dir.with_name(out_dir.name + ".old")
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if out_dir.exists():
+        out_dir.rename(old_dir)
+    tmp_dir.rename(out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    log.info(f"Built lexical index: {len(doc_lengths)} chunks, {len(vocab)} terms, {offset} postings")
+
+class LexicalIndex:
+    def __init__(self, index_dir: Path = LEXICAL_PATH):
+        """BM25 search over the memory-mapped postings written by build_lexical_index()."""
+        self.index_dir = Path(index_dir)
+        with open(self.index_dir / "stats.json", 'r', encoding='utf-8') as f:
+            stats = json.load(f)
+        with open(self.index_dir / "vocab.json", 'r', encoding='utf-8') as f:
+            self.vocab = json.load(f)
+        with open(self.index_dir / "docs.json", 'r', encoding='utf-8') as f:
+            docs = json.load(f)
+        self.chunk_ids = docs["chunk_ids"]
+        self.point_ids = docs["point_ids"]
+        self.num_docs = stats["num_docs"]
+        self.avgdl = stats["avgdl"] or 1.0
+
+        num_postings = stats["num_postings"]
+        if num_postings:
+            self.postings_docs = np.memmap(self.index_dir / "postings_docs.bin", dtype=np.int32, mode='r', shape=(num_postings,))
+            self.postings_tf = np.memmap(self.index_dir / "postings_tf.bin", dtype=np.uint16, mode='r', shape=(num_postings,))
+        if self.num_docs:
+            self.doc_lengths = np.memmap(self.index_dir / "doc_lengths.bin", dtype=np.int32, mode='r', shape=(self.num_docs,))
+            self._length_norm = (K1 * (1 - B + B * self.doc_lengths / self.avgdl)).astype(np.float32)
+
+    @staticmethod
+    def exists(index_dir: Path = LEXICAL_PATH) -> bool:
+        return (Path(index_dir) / "stats.json").exists()
+
+    def search(self, query_terms: list, top_k: int):
+        """
+        BM25 top_k for already-cleaned query terms.
+        Returns a list of (row, score) sorted by descending score.
+        """
+        if not self.num_docs:
+            return []
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in set(query_terms):
+            entry = self.vocab.get(term)
+            if entry is None:
+                continue
+            offset, df = entry
+            docs = self.postings_docs[offset:offset + df]
+            tf = self.postings_tf[offset:offset + df].astype(np.float32)
+            idf = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tf * (K1 + 1) / (tf + self._length_norm[docs])
+
+        matched = np.count_nonzero(scores)
+        if not matched:
+            return []
+        top_k = min(top_k, matched)
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top]
@@ -1,19 +1,83 @@
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from typing import Literal
 
+ASYNC_LOGGING = True        # Hand records to a background writer thread instead of formatting/writing them on the calling thread
+QUEUE_SIZE = 10000          # Records buffered per async Logger before FULL_QUEUE_POLICY applies
+FULL_QUEUE_POLICY = "block" # "block": wait for room when the queue is full, so nothing is lost; "drop": discard DEBUG/INFO records instead (warnings and errors still wait)
+SAMPLE_EVERY = 1            # Keep 1 in N DEBUG/INFO records per call site (1 = keep all)
+
+_async_loggers = {}         # Logger name -> async Logger, flushed at exit and switched to synchronous writes in forked children
+_registry_lock = threading.Lock()
+
+class _SamplingFilter(logging.Filter):
+    """Keeps the first and then every n-th DEBUG/INFO record of each call site; warnings and errors always pass."""
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = every
+        self.seen = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        site = (record.pathname, record.lineno)
+        count = self.seen.get(site, 0)
+        self.seen[site] = count + 1
+        return count % self.every == 0
+
+class _BoundedQueueHandler(QueueHandler):
+    """QueueHandler with an explicit policy for a full queue, counting what it drops."""
+    def __init__(self, record_queue, policy: str):
+        super().__init__(record_queue)
+        self.policy = policy
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if self.policy == "block" or record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # The stock put_nowait() fails on a full queue; wait for room instead
+        self.queue.put(self._sentinel)
+
 class Logger:
-    def __init__(self, name: str, log_file_needed: bool = False, log_file: str = '', level: Literal['DEV', 'PROD'] = 'DEV'):
-        """Initialize logger with console and file output"""
-        
+    def __init__(self, name: str, log_file_needed: bool = False, log_file: str = '', level: Literal['DEV', 'PROD'] = 'DEV',
+                 async_mode: bool = None, queue_size: int = QUEUE_SIZE, full_policy: Literal['drop', 'block'] = FULL_QUEUE_POLICY,
+                 sample_every: int = SAMPLE_EVERY):
+        """
+        Initialize logger with console and file output. In async mode
+        (ASYNC_LOGGING by default) the calling thread only puts records on a
+        bounded queue and a background thread writes them; the queue is
+        flushed at exit.
+        """
+
         # Validate that log_file is provided when log_file_needed is True
         if log_file_needed and not log_file.strip():
             raise ValueError("A file name is required when log_file_needed is set to True")
-        
+        if full_policy not in ('drop', 'block'):
+            raise ValueError("The value of full_policy must be 'drop' or 'block'")
+        if sample_every < 1:
+            raise ValueError("sample_every must be at least 1")
+
         self.name = name
         self.log_file_needed = log_file_needed
         self.log_file = log_file
-        
+        self.async_mode = ASYNC_LOGGING if async_mode is None else async_mode
+        self.queue_size = queue_size
+        self.full_policy = full_policy
+        self.queue_handler = None
+        self.listener = None
+
         self.logger = logging.getLogger(name)
         if level.upper() == 'DEV':
             self.logger.setLevel(logging.DEBUG)
@@ -21,51 +85,125 @@ class Logger:
             self.logger.setLevel(logging.INFO)
         else:
             raise ValueError("The value of level must be 'DEV' or 'PROD'")
-        
-        # Clear any existing handlers
+
+        # Clear any existing handlers (and stop the writer thread of a previous Logger with this name)
+        with _registry_lock:
+            previous = _async_loggers.pop(name, None)
+        if previous is not None:
+            previous.close()
         self.logger.handlers.clear()
-        
+        self.logger.filters.clear()
+
         # Console handler
         console_handler = logging.StreamHandler()
         console_handler.setLevel(logging.INFO)
-        
+
         # Rotating file handler with 5MB cap
-        if self.log_file_needed:  
+        if self.log_file_needed:
             file_handler = RotatingFileHandler(
-                log_file, 
+                log_file,
                 maxBytes=5*1024*1024,  # 5MB
                 backupCount=5  # Keep 5 backup files
             )
             file_handler.setLevel(logging.DEBUG)
-        
+
         # Formatter
         formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         console_handler.setFormatter(formatter)
         if self.log_file_needed:
             file_handler.setFormatter(formatter)
-        
+        self.handlers = [console_handler, file_handler] if self.log_file_needed else [console_handler]
+
+        # Sampling happens before a record is queued or written
+        if sample_every > 1:
+            self.logger.addFilter(_SamplingFilter(sample_every))
+
         # Add handlers
-        self.logger.addHandler(console_handler)
-        if self.log_file_needed:
-            self.logger.addHandler(file_handler)
+        if self.async_mode:
+            self._start_writer()
+        else:
+            for handler in self.handlers:
+                self.logger.addHandler(handler)
+
+    def _start_writer(self):
+        record_queue = queue.Queue(self.queue_size)
+        self.queue_handler = _BoundedQueueHandler(record_queue, self.full_policy)
+        self.listener = _Listener(record_queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+        self.logger.addHandler(self.queue_handler)
+        with _registry_lock:
+            _async_loggers[self.name] = self
+
+    @property
+    def dropped(self) -> int:
+        """Records discarded because the queue was full (drop policy only)."""
+        return self.queue_handler.dropped if self.queue_handler else 0
+
+    def flush(self):
+        """Block until every queued record is written, then flush the handlers."""
+        if self.listener is not None:
+            self.queue_handler.queue.join()
+        for handler in self.handlers:
+            handler.flush()
+
+    def close(self):
+        """Write out the queue and stop the writer thread; later records are written synchronously."""
+        if self.listener is None:
+            return
+        if self.queue_handler.dropped:
+            self.logger.warning(f"Dropped {self.queue_handler.dropped} log records while the queue was full")
+        self.listener.stop()
+        self._use_sync_handlers()
+
+    def _use_sync_handlers(self):
+        self.logger.removeHandler(self.queue_handler)
+        for handler in self.handlers:
+            self.logger.addHandler(handler)
+        self.listener = None
 
     def debug(self, message):
         """Log debug message"""
-        self.logger.debug(message)
-    
+        self.logger.debug(message, stacklevel=2)
+
     def info(self, message):
         """Log info message"""
-        self.logger.info(message)
-    
+        self.logger.info(message, stacklevel=2)
+
     def warning(self, message):
         """Log warning message"""
-        self.logger.warning(message)
-    
+        self.logger.warning(message, stacklevel=2)
+
     def error(self, message):
         """Log error message"""
-        self.logger.error(message)
-    
+        self.logger.error(message, stacklevel=2)
+
     def critical(self, message):
         """Log critical message"""
-        self.logger.critical(message)
+        self.logger.critical(message, stacklevel=2)
+
+@atexit.register
+def _flush_at_exit():
+    with _registry_lock:
+        loggers = list(_async_loggers.values())
+        _async_loggers.clear()
+    for logger in loggers:
+        logger.close()
+
+def _before_fork():
+    # A writer thread forked mid-write would leave the child a locked file or
+    # stream buffer, so let every queue drain first
+    for logger in list(_async_loggers.values()):
+        logger.flush()
+
+def _after_fork_in_child():
+    # The writer threads do not survive fork(), and forked workers often leave
+    # through os._exit() without running atexit, so they write synchronously
+    global _registry_lock
+    _registry_lock = threading.Lock()
+    loggers = list(_async_loggers.values())
+    _async_loggers.clear()
+    for logger in loggers:
+        logger._use_sync_handlers()
 
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_before_fork, after_in_child=_after_fork_in_child)
@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+MANIFEST_PATH = Path("build_manifest.json")  # Shared by ingest, data_cleaning, embed and index
+
+def file_hash(path: Path) -> str:
+    """SHA-256 of a file's contents, read in 1MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def text_hash(text: str) -> str:
+    """SHA-256 of a UTF-8 string."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class Manifest:
+    def __init__(self, path: Path = MANIFEST_PATH):
+        """
+        Content-hash manifest used for incremental rebuilds.
+
+        Entries are grouped by stage ("ingest", "clean", "embed", "index") and
+        keyed by a stage-specific name (PDF name, file name or chunk_id). Each
+        entry stores the hash of the input it was built from, plus any extra
+        fields the stage needs.
+        """
+        self.path = Path(path)
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+        else:
+            self.data = {}
+
+    def stage(self, stage: str) -> dict:
+        """Return the (mutable) entries of a stage."""
+        return self.data.setdefault(stage, {})
+
+    def get(self, stage: str, key: str):
+        return self.stage(stage).get(key)
+
+    def is_current(self, stage: str, key: str, digest: str) -> bool:
+        """True if the stored hash for key matches digest."""
+        entry = self.get(stage, key)
+        return entry is not None and entry["hash"] == digest
+
+    def update(self, stage: str, key: str, digest: str, **extra):
+        self.stage(stage)[key] = {"hash": digest, **extra}
+
+    def remove(self, stage: str, key: str):
+        self.stage(stage).pop(key, None)
+
+    def clear(self, stage: str):
+        self.data[stage] = {}
+
+    def keys(self, stage: str) -> set:
+        return set(self.stage(stage))
+
+    def save(self):
+        """Atomically write the manifest back to disk."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -1,32 +1,71 @@
+import os
+import time
 import torch
+from pathlib import Path
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from logger import Logger
 
 log = Logger("Model Loader Logs", True, "Logs/model.log", "DEV")
 
+QUANTIZATION_MODES = ["fp32", "fp16", "bf16", "dynamic-int8", "int8-weight-only", "int4-weight-only"]
+CPU_QUANTIZATION = "dynamic-int8"   # Mode used for quantize=True on CPU-only hosts
+GPU_QUANTIZATION = "fp16"           # Mode used for quantize=True on CUDA/MPS
+QUANTIZED_CACHE_DIR = Path("models/quantized")   # Converted models, one directory per model and mode
+INT4_GROUP_SIZE = 128
+ASSISTED_MODES = [None, "draft", "prompt-lookup"]
+PROMPT_LOOKUP_TOKENS = 10   # Tokens drafted per step by prompt-lookup decoding
+
 class ModelHandler:
-    def __init__(self, model_name: str, quantize: bool = False):
+    def __init__(self, model_name: str, quantize=False, cache_dir: Path = QUANTIZED_CACHE_DIR,
+                 assisted: str = None, draft_model_name: str = None, prompt_lookup_tokens: int = PROMPT_LOOKUP_TOKENS):
         """
         Initialization of class arguments.
 
         1. model_name -> str -> Hugging face repo id.\n
-        2. quantize -> bool -> Whether to not quantize the model.\n
-        3. device -> str -> Select the device on which you want to load the model, e.g., "cpu" or "cuda" or "mps"\n
+        2. quantize -> bool | str -> False for fp32, True for the device's default mode (CPU_QUANTIZATION / GPU_QUANTIZATION), or a mode name from QUANTIZATION_MODES.\n
+        3. cache_dir -> Path -> Where converted (int8/int4) models are stored so later loads skip the conversion.\n
+        4. assisted -> str -> Assisted decoding: None, "draft" (draft_model_name proposes tokens) or "prompt-lookup" (n-grams copied from the prompt).\n
+        5. draft_model_name -> str -> Hugging face repo id of a small model sharing model_name's tokenizer, loaded with the same quantization.\n
+        6. prompt_lookup_tokens -> int -> Tokens drafted per step in "prompt-lookup" mode.\n
+        7. device -> str -> Select the device on which you want to load the model, e.g., "cpu" or "cuda" or "mps"\n
         """
         self.model_name = model_name
-        self.quantize = quantize
-        
+        self.cache_dir = Path(cache_dir)
+        if assisted not in ASSISTED_MODES:
+            raise ValueError(f"Unknown assisted decoding mode {assisted!r}, expected one of {ASSISTED_MODES}")
+        if assisted == "draft" and not draft_model_name:
+            raise ValueError("assisted='draft' needs a draft_model_name")
+        self.assisted = assisted
+        self.draft_model_name = draft_model_name
+        self.prompt_lookup_tokens = prompt_lookup_tokens
+
         if torch.cuda.is_available():
             self.device = "cuda"
         elif torch.backends.mps.is_available():
             self.device = "mps"
         else:
             self.device = "cpu"
+
+        if quantize is True:
+            quantize = CPU_QUANTIZATION if self.device == "cpu" else GPU_QUANTIZATION
+        elif quantize is False:
+            quantize = "fp32"
+        if quantize not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode {quantize!r}, expected one of {QUANTIZATION_MODES}")
+        if quantize == "dynamic-int8" and self.device != "cpu":
+            raise ValueError("dynamic-int8 quantization only runs on CPU")
+        self.quantize = quantize
         log.debug("Initialisation done successfully!")
-    
+
+    def cache_path(self) -> Path:
+        """Directory of the converted model for this model and mode."""
+        return self.cache_dir / f"{self.model_name.replace('/', '--')}-{self.quantize}"
+
     def load_model(self):
         """
         Loads the tokenizer and model according to the initialization parameters.
+        Quantized modes are converted on first use and loaded from cache_path()
+        afterwards.
 
         Returns:
             model: The loaded AutoModelForCausalLM on the specified device.
@@ -34,19 +73,218 @@ class ModelHandler:
         """
         tokenizer = AutoTokenizer.from_pretrained(self.model_name)
         log.debug("Model's Tokenizer successfull loaded!")
-        if self.quantize:
+        start = time.perf_counter()
+        if self.quantize in ("fp32", "fp16", "bf16"):
             model = AutoModelForCausalLM.from_pretrained(
                 self.model_name,
                 low_cpu_mem_usage=True,
-                dtype=torch.float16,
+                dtype={"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}[self.quantize],
                 device_map="auto"
             )
+        elif self.quantize == "dynamic-int8":
+            model = self._load_dynamic_int8()
         else:
-            model = AutoModelForCausalLM.from_pretrained(
-                    self.model_name,
-                    low_cpu_mem_usage=True,
-                    device_map="auto"
-                )
-        
-        log.debug("Model Loaded successfully!")
+            model = self._load_weight_only()
+        model.eval()
+
+        log.debug(f"Model Loaded successfully ({self.quantize}, {time.perf_counter() - start:.1f}s)!")
         return model, tokenizer
+
+    def load_assistant(self, tokenizer) -> dict:
+        """
+        Extra model.generate() arguments for the configured assisted decoding
+        mode ({} when it is off). In "draft" mode the draft model is loaded
+        here and must use the same vocabulary as tokenizer.
+        """
+        if self.assisted is None:
+            return {}
+        if self.assisted == "prompt-lookup":
+            return {"prompt_lookup_num_tokens": self.prompt_lookup_tokens}
+
+        draft_model, draft_tokenizer = ModelHandler(self.draft_model_name, quantize=self.quantize, cache_dir=self.cache_dir).load_model()
+        if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+            raise ValueError(f"Draft model {self.draft_model_name} does not share the tokenizer of {self.model_name}")
+        log.debug(f"Draft model {self.draft_model_name} loaded for assisted decoding!")
+        return {"assistant_model": draft_model}
+
+    def _load_dynamic_int8(self):
+        """
+        nn.Linear layers with int8 weights and activations quantized on the fly
+        (torch.ao dynamic quantization, CPU only). The first conversion goes one
+        decoder layer at a time from a bf16 load, so peak memory stays near the
+        bf16 model size rather than fp32's. Later loads rebuild the model on the
+        meta device and assign the cached int8 state dict, without touching the
+        original weights.
+        """
+        from torch.ao.quantization import quantize_dynamic
+        from transformers import AutoConfig
+
+        path = self.cache_path() / "model.pt"
+        if path.exists():
+            log.info(f"Loading cached dynamic-int8 model from {path}")
+            checkpoint = torch.load(path, weights_only=True, mmap=True)
+            with torch.device("meta"):
+                model = AutoModelForCausalLM.from_config(AutoConfig.from_pretrained(self.model_name), dtype=torch.float32)
+            _swap_dynamic_linears(model)
+            model.to_empty(device="cpu")
+            for name, linear in checkpoint["linears"].items():
+                weight = torch._make_per_tensor_quantized_tensor(linear["weight"], linear["scale"], linear["zero_point"])
+                model.get_submodule(name).set_weight_bias(weight, linear["bias"])
+            for name, tensor in checkpoint["tensors"].items():
+                module, _, attr = name.rpartition(".")
+                module = model.get_submodule(module)
+                if attr in module._parameters:
+                    module._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+                else:
+                    module._buffers[attr] = tensor
+            return model
+
+        log.info("Converting the model to dynamic int8, this happens once")
+        model = AutoModelForCausalLM.from_pretrained(self.model_name, low_cpu_mem_usage=True, dtype=torch.bfloat16)
+        decoder = model.get_decoder()
+        for layer in getattr(decoder, "layers", []):
+            layer.float()
+            quantize_dynamic(layer, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        # Embeddings, norms and the LM head; already converted layers are skipped
+        model.float()
+        quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        torch.save(_dynamic_int8_checkpoint(model), tmp_path)
+        os.replace(tmp_path, path)
+        log.info(f"Saved dynamic-int8 model to {path}")
+        return model
+
+    def _load_weight_only(self):
+        """int8/int4 weight-only quantization with torchao (optional dependency), cached with save_pretrained."""
+        from transformers import TorchAoConfig
+        try:
+            from torchao.quantization import Int4WeightOnlyConfig, Int8WeightOnlyConfig
+        except ImportError as e:
+            raise ImportError(f"{self.quantize} quantization needs torchao: pip install torchao") from e
+
+        path = self.cache_path()
+        if (path / "config.json").exists():
+            log.info(f"Loading cached {self.quantize} model from {path}")
+            return AutoModelForCausalLM.from_pretrained(path, low_cpu_mem_usage=True, device_map="auto")
+
+        if self.quantize == "int8-weight-only":
+            config = Int8WeightOnlyConfig()
+        elif self.device == "cpu":
+            from torchao.dtypes import Int4CPULayout
+            config = Int4WeightOnlyConfig(group_size=INT4_GROUP_SIZE, layout=Int4CPULayout())
+        else:
+            config = Int4WeightOnlyConfig(group_size=INT4_GROUP_SIZE)
+
+        log.info(f"Converting the model to {self.quantize}, this happens once")
+        model = AutoModelForCausalLM.from_pretrained(
+            self.model_name,
+            low_cpu_mem_usage=True,
+            dtype=torch.bfloat16,
+            device_map="auto",
+            quantization_config=TorchAoConfig(config)
+        )
+        # torchao tensor subclasses are not safetensors-serializable
+        model.save_pretrained(path, safe_serialization=False)
+        log.info(f"Saved {self.quantize} model to {path}")
+        return model
+
+def _swap_dynamic_linears(module: torch.nn.Module):
+    """Replace every nn.Linear under module with an empty dynamic int8 Linear of the same shape."""
+    from torch.ao.nn.quantized.dynamic import Linear as DynamicLinear
+    for name, child in module.named_children():
+        if type(child) is torch.nn.Linear:
+            setattr(module, name, DynamicLinear(child.in_features, child.out_features, bias_=child.bias is not None, dtype=torch.qint8))
+        else:
+            _swap_dynamic_linears(child)
+
+def _dynamic_int8_checkpoint(model: torch.nn.Module) -> dict:
+    """
+    Plain-tensor checkpoint of a dynamic int8 model: int8 weights with their
+    scale/zero point per Linear, and every other parameter and buffer
+    (including non-persistent ones such as rotary frequencies). Quantized
+    tensors and packed params are kept out since they do not pickle reliably.
+    """
+    from torch.ao.nn.quantized.dynamic import Linear as DynamicLinear
+    linears = {}
+    for name, module in model.named_modules():
+        if isinstance(module, DynamicLinear):
+            weight, bias = module._weight_bias()
+            linears[name] = {
+                "weight": weight.int_repr(),
+                "scale": weight.q_scale(),
+                "zero_point": weight.q_zero_point(),
+                "bias": bias,
+            }
+    tensors = {
+        key: value.detach() for key, value in [*model.named_parameters(), *model.named_buffers()]
+        if not any(key.startswith(f"{name}.") for name in linears)
+    }
+    return {"linears": linears, "tensors": tensors}
+
+def _peak_rss_mb() -> float:
+    import resource
+    import sys
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def measure_mode(model_name: str, mode: str, prompt: str, max_new_tokens: int = 64, cache_dir: Path = QUANTIZED_CACHE_DIR) -> dict:
+    """Load time, peak resident memory and greedy decode speed of one mode, in this process."""
+    start = time.perf_counter()
+    model, tokenizer = ModelHandler(model_name, quantize=mode, cache_dir=cache_dir).load_model()
+    load_seconds = time.perf_counter() - start
+    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+    with torch.inference_mode():
+        model.generate(**inputs, max_new_tokens=4, do_sample=False, pad_token_id=tokenizer.eos_token_id)
+        start = time.perf_counter()
+        output = model.generate(
+            **inputs, max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens,
+            do_sample=False, pad_token_id=tokenizer.eos_token_id
+        )
+        seconds = time.perf_counter() - start
+    new_tokens = output.shape[1] - inputs["input_ids"].shape[1]
+    return {
+        "mode": mode,
+        "load_seconds": load_seconds,
+        "peak_rss_mb": _peak_rss_mb(),
+        "tokens_per_second": new_tokens / seconds,
+    }
+
+def _measure_child(results, *args):
+    try:
+        results.put(measure_mode(*args))
+    except Exception as e:
+        results.put({"mode": args[1], "error": repr(e)})
+
+def compare_modes(model_name: str, modes: list = QUANTIZATION_MODES, prompt: str = "Explain the OSI model.",
+                  max_new_tokens: int = 64, cache_dir: Path = QUANTIZED_CACHE_DIR) -> list:
+    """measure_mode() for each mode, each in a fresh process so peak RSS is per mode."""
+    import multiprocessing
+    ctx = multiprocessing.get_context("spawn")
+    reports = []
+    for mode in modes:
+        results = ctx.Queue()
+        process = ctx.Process(target=_measure_child, args=(results, model_name, mode, prompt, max_new_tokens, cache_dir))
+        process.start()
+        process.join()
+        reports.append(results.get() if not results.empty() else {"mode": mode, "error": f"exited with code {process.exitcode}"})
+        log.info(f"{mode}: {reports[-1]}")
+    return reports
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert/cache quantized models and compare memory and decode speed.")
+    parser.add_argument("--model", default="meta-llama/Llama-3.2-3B-Instruct")
+    parser.add_argument("--modes", nargs="+", default=QUANTIZATION_MODES, choices=QUANTIZATION_MODES)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    for report in compare_modes(args.model, args.modes, max_new_tokens=args.max_new_tokens):
+        if "error" in report:
+            print(f"{report['mode']:>17}: ERROR {report['error']}")
+        else:
+            print(
+                f"{report['mode']:>17}: {report['tokens_per_second']:.1f} tokens/s, "
+                f"peak RSS {report['peak_rss_mb']:.0f} MB, loaded in {report['load_seconds']:.1f}s"
+            )
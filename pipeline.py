@@ -0,0 +1,242 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import ingest
+import data_cleaning
+import dedup
+import embed
+import index
+import tracing
+from embedding_store import EmbeddingStore, EmbeddingStoreWriter
+from lexical_index import build_lexical_index
+from logger import Logger
+from cache import bump_generation
+from encoder import load_encoder
+from manifest import Manifest, file_hash
+
+log = Logger("Pipeline Logs", log_file_needed=True, log_file="Logs/pipeline.log")
+
+QUEUE_SIZE = 8                    # Max batches buffered between two stages
+MAX_WORKERS = ingest.MAX_WORKERS  # PDFs ingested in parallel
+UPSERT_BATCH_SIZE = index.UPSERT_BATCH_SIZE
+
+_DONE = object()
+
+def _put(q: queue.Queue, item, stop: threading.Event):
+    """Blocking put that gives up once another stage has failed."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+def _get(q: queue.Queue, stop: threading.Event):
+    """Blocking get that gives up once another stage has failed."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+def _run_stage(target, out_q: queue.Queue, stop: threading.Event, errors: list):
+    """Run a stage function on its own thread, always signalling the next stage when done."""
+    def run():
+        try:
+            target()
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(out_q, _DONE, stop)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+def iter_ingested(pdf_files, max_workers: int = MAX_WORKERS):
+    """
+    Ingest PDFs over a process pool, yielding (pdf_file, stats) in input order.
+    At most 2 * max_workers PDFs are in flight, so finished-but-unconsumed
+    results cannot pile up in memory. PDFs that fail are logged and skipped,
+    as in ingest.extract_and_save.
+    """
+    pdf_files = iter(pdf_files)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=ingest._init_worker) as executor:
+        pending = deque()
+        for pdf_file in pdf_files:
+            pending.append((pdf_file, executor.submit(ingest.process_pdf, pdf_file, True)))
+            if len(pending) == 2 * max_workers:
+                break
+        while pending:
+            pdf_file, future = pending.popleft()
+            try:
+                stats = future.result()
+            except Exception as e:
+                log.error(f"Failed to process {pdf_file.name}: {e}")
+            else:
+                yield pdf_file, stats
+            next_file = next(pdf_files, None)
+            if next_file is not None:
+                pending.append((next_file, executor.submit(ingest.process_pdf, next_file, True)))
+
+def iter_clean_chunks(manifest: Manifest, max_workers: int = MAX_WORKERS):
+    """
+    Ingest and clean every PDF in ingest.PDF_DIR, writing the same intermediate
+    files as the individual stage scripts, and yield cleaned chunks one PDF at
+    a time.
+    """
+    for pdf_file, stats in iter_ingested(sorted(ingest.PDF_DIR.glob("*.pdf")), max_workers):
+        chunks_data = stats.pop("chunks_data")
+        manifest.update("ingest", pdf_file.name, file_hash(pdf_file), stem=pdf_file.stem)
+
+        txt_file = ingest.TXT_DIR / f"{pdf_file.stem}.txt"
+        data_cleaning.CLEAN_TXT_DIR.mkdir(parents=True, exist_ok=True)
+        (data_cleaning.CLEAN_TXT_DIR / txt_file.name).write_text(
+            data_cleaning.clean_text(txt_file.read_text(encoding="utf-8")), encoding="utf-8"
+        )
+        manifest.update("clean", f"txt:{txt_file.name}", file_hash(txt_file))
+
+        chunks_file = ingest.CHUNKS_DIR / f"{pdf_file.stem}_chunks.json"
+        cleaned_chunks = data_cleaning.clean_chunks(chunks_data)
+        data_cleaning.CLEAN_CHUNKS_DIR.mkdir(parents=True, exist_ok=True)
+        with open(data_cleaning.CLEAN_CHUNKS_DIR / chunks_file.name, 'w', encoding='utf-8') as f:
+            json.dump(cleaned_chunks, f, indent=2, ensure_ascii=False)
+        manifest.update("clean", f"chunks:{chunks_file.name}", file_hash(chunks_file))
+
+        log.info(
+            f"Ingested {pdf_file.name}: {stats['pages']} pages ({stats['ocr_pages']} OCR), "
+            f"{len(cleaned_chunks)} clean chunks"
+        )
+        yield from cleaned_chunks
+
+def iter_unique_chunks(chunks, deduplicator: dedup.Deduplicator, written: list):
+    """
+    Pass on the chunks the deduplicator keeps. Each PDF's deduplicated chunks
+    file is written as dedup.py would write it once all of that PDF's chunks
+    have been through the deduplicator, and its name appended to written.
+    """
+    name, kept = None, []
+
+    def write():
+        if kept:
+            dedup.write_chunk_file(dedup.DEDUP_CHUNKS_DIR / name, [deduplicator.with_duplicates(chunk) for chunk in kept])
+            written.append(name)
+
+    for chunk in chunks:
+        chunk_name = f"{Path(chunk['metadata']['source']).stem}_chunks.json"
+        if chunk_name != name:
+            write()
+            name, kept = chunk_name, []
+        if deduplicator.add(chunk) is None:
+            kept.append(chunk)
+            yield chunk
+    write()
+
+@tracing.traced("build.pipeline")
+def run_pipeline(max_workers: int = MAX_WORKERS, queue_size: int = QUEUE_SIZE):
+    """
+    Full streaming build: ingest -> clean -> dedup -> encode batch -> upsert batch.
+
+    Each arrow is a bounded queue between threads, so encoding of one batch
+    overlaps with upserting of the previous one and memory use is bounded by
+    queue_size batches instead of the corpus size. Intermediate files, the
+    embedding store and the manifest are written exactly as the individual
+    stage scripts would, so later incremental runs of those scripts pick up
+    from here. Duplicates are dropped as they stream past, so a canonical
+    chunk may already be stored before its later copies are seen; their
+    references are patched into the deduplicated chunk files afterwards and
+    attached by an incremental embed + index pass that re-encodes nothing.
+    """
+    start_time = time.time()
+    manifest = Manifest()
+    for name in manifest.keys("ingest") - {pdf_file.name for pdf_file in ingest.PDF_DIR.glob("*.pdf")}:
+        ingest._remove_outputs(manifest.get("ingest", name)["stem"])
+    for stage in ("ingest", "clean", "embed", "index"):
+        manifest.clear(stage)
+
+    vector_store = index.open_store()
+    index.prepare_store(vector_store, manifest, index.VECTOR_BACKEND, recreate=True)
+    model = load_encoder(embed.EMBED_MODEL)
+
+    chunk_q = queue.Queue(maxsize=queue_size)
+    vector_q = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    deduplicator = dedup.Deduplicator()
+    written = []
+
+    def produce():
+        chunks = iter_unique_chunks(iter_clean_chunks(manifest, max_workers), deduplicator, written)
+        for batch in embed.iter_batches(chunks, embed.BATCH_SIZE):
+            _put(chunk_q, batch, stop)
+            if stop.is_set():
+                return
+
+    def encode():
+        while True:
+            batch = _get(chunk_q, stop)
+            if batch is _DONE:
+                return
+            vectors = model.encode([chunk["text"] for chunk in batch], show_progress_bar=False)
+            _put(vector_q, (batch, vectors), stop)
+
+    threads = [
+        _run_stage(produce, chunk_q, stop, errors),
+        _run_stage(encode, vector_q, stop, errors),
+    ]
+
+    total = 0
+    try:
+        with EmbeddingStoreWriter(embed.OUT_PATH, dim=embed.DIM, dtype=embed.STORE_DTYPE) as writer, \
+                index.BatchUploader(vector_store, manifest) as uploader:
+            while True:
+                item = _get(vector_q, stop)
+                if item is _DONE:
+                    break
+                batch, vectors = item
+                writer.append(vectors, batch)
+                # Digest the vectors as stored, so a later index.py run sees them as unchanged
+                stored = vectors.astype(embed.STORE_DTYPE).astype("float32")
+                for i in range(0, len(batch), UPSERT_BATCH_SIZE):
+                    uploader.submit([
+                        (chunk, vector, index.chunk_digest(chunk, vector))
+                        for chunk, vector in zip(batch[i:i+UPSERT_BATCH_SIZE], stored[i:i+UPSERT_BATCH_SIZE])
+                    ])
+                for chunk in batch:
+                    manifest.update("embed", chunk["metadata"]["chunk_id"], embed.embedding_hash(chunk["text"]))
+                total += len(batch)
+                log.info(f"Indexed {total} chunks ({time.time() - start_time:.1f}s)")
+            if errors:
+                raise errors[0]
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    vector_store.publish(len(manifest.keys("index")))
+    vector_store.close()
+
+    store = EmbeddingStore(embed.OUT_PATH)
+    build_lexical_index(
+        store.iter_chunks(),
+        (index.point_id(chunk["metadata"]["chunk_id"]) for chunk in store.iter_chunks())
+    )
+    manifest.save()
+    bump_generation()
+    dedup.remove_stale_chunk_files(written)
+    stats = deduplicator.stats()
+    if stats["kept"] < stats["chunks"]:
+        dedup.patch_chunk_files(deduplicator, written)
+        log.info(f"Dropped {stats['chunks'] - stats['kept']} duplicate chunks, attaching their references")
+        embed.embed_data()
+        index.index_data()
+    tracing.annotate(indexed=total, dedup=stats)
+    elapsed = time.time() - start_time
+    log.info(f"Pipeline complete: {total} chunks in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} chunks/s)")
+
+if __name__ == "__main__":
+    run_pipeline()
@@ -0,0 +1,45 @@
+import threading
+import time
+
+STARTED_AT = time.time()   # First import of this module, i.e. process cold start
+
+_lock = threading.Lock()
+_locks = {}
+_components = {}
+_events = {}
+
+def get(name: str, factory):
+    """
+    Return the process-wide component registered under name, building it with
+    factory() on first use. Concurrent callers for the same name wait for a
+    single build instead of loading the component twice.
+    """
+    component = _components.get(name)
+    if component is not None:
+        return component
+    with _lock:
+        lock = _locks.setdefault(name, threading.Lock())
+    with lock:
+        if name not in _components:
+            start = time.time()
+            _components[name] = factory()
+            _events[f"{name}_loaded"] = time.time() - STARTED_AT
+            _events[f"{name}_load_seconds"] = time.time() - start
+    return _components[name]
+
+def drop(name: str):
+    """Forget a component so the next get() builds it again, e.g. after a configuration change."""
+    with _lock:
+        _components.pop(name, None)
+
+def is_loaded(name: str) -> bool:
+    return name in _components
+
+def mark(event: str) -> float:
+    """Record the first time (seconds since cold start) an event happened and return it."""
+    with _lock:
+        return _events.setdefault(event, time.time() - STARTED_AT)
+
+def events() -> dict:
+    """Recorded events and load timings, in seconds."""
+    return dict(_events)
@@ -1,62 +1,186 @@
-import torch
-from pathlib import Path
-from sentence_transformers import SentenceTransformer
-from qdrant_client import QdrantClient
+import tracing
+from encoder import load_encoder, ENCODER_BACKEND
 from logger import Logger
+from cache import TTLCache, normalize_query, read_generation
+from data_cleaning import clean_text
+from lexical_index import LexicalIndex, tokenize
+from vector_store import open_store, VECTOR_BACKEND
 
 log = Logger("Retrieval Logs", log_file_needed=True, log_file="Logs/retrieval.log")
 
-QDRANT_PATH = Path("vector_stores/qdrant")
-COLLECTION_NAME = "invoices"
 EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 TOP_K = 5
+QUERY_CACHE_SIZE = 1024     # Query embeddings kept in memory
+QUERY_CACHE_TTL = 24 * 3600
+RESULT_CACHE_SIZE = 512     # (query, top_k) -> results, dropped whenever the collection is re-indexed
+RESULT_CACHE_TTL = 3600
+RETRIEVAL_MODE = "dense"    # "dense", "lexical" or "hybrid" (BM25 + dense, reciprocal rank fusion; scores are RRF values, not cosines)
+HYBRID_CANDIDATES = 4       # In hybrid mode each ranker contributes top_k * HYBRID_CANDIDATES candidates
+RRF_K = 60
 
 class Retriever:
-    def __init__(self):
-        """Initialize retriever with MPS support if available."""
-        device = "mps" if torch.backends.mps.is_available() else "cpu"
-        log.info(f"Initializing retriever on device: {device}")
+    def __init__(self, backend: str = VECTOR_BACKEND):
+        """Initialize retriever with the ENCODER_BACKEND query encoder."""
+        log.info(f"Initializing retriever with {ENCODER_BACKEND} encoder, vector backend: {backend}")
         
-        self.client = QdrantClient(path=str(QDRANT_PATH))
-        self.model = SentenceTransformer(EMBED_MODEL, device=device)
+        self.backend = backend
+        self.store = open_store(backend, read_only=True)
+        self.model = load_encoder(EMBED_MODEL)
+        self.query_cache = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+        self.result_cache = TTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+        self.generation = read_generation()
+        self.lexical = self._open_lexical_index()
         log.info("Retriever initialized successfully")
+
+    @staticmethod
+    def _open_lexical_index():
+        if not LexicalIndex.exists():
+            log.warning("No lexical index found, lexical and hybrid retrieval fall back to dense")
+            return None
+        return LexicalIndex()
+
+    def embed_query(self, query: str):
+        """Embedding of the normalized query, served from the query cache when possible."""
+        return self.embed_queries([query])[0]
+
+    def embed_queries(self, queries: list) -> list:
+        """embed_query() for several queries; the uncached ones are encoded in a single batch."""
+        keys = [normalize_query(query) for query in queries]
+        embeddings = {}
+        for key in keys:
+            if key not in embeddings:
+                embeddings[key] = self.query_cache.get(key)
+        missing = [key for key, embedding in embeddings.items() if embedding is None]
+        if missing:
+            with tracing.span("embed_query", queries=len(missing)):
+                encoded = self.model.encode(missing, batch_size=len(missing))
+            for key, embedding in zip(missing, encoded):
+                embeddings[key] = embedding.tolist()
+                self.query_cache.put(key, embeddings[key])
+        return [embeddings[key] for key in keys]
+
+    def _check_generation(self):
+        """Drop cached results if the collection was re-indexed since they were stored."""
+        generation = read_generation()
+        if generation != self.generation:
+            log.info(f"Collection generation changed ({self.generation} -> {generation}), clearing result cache")
+            self.result_cache.clear()
+            self.lexical = self._open_lexical_index()
+            if self.backend != "qdrant":
+                # File-based backends are immutable snapshots; pick up the new one
+                self.store = open_store(self.backend, read_only=True)
+            self.generation = generation
+
+    def cache_stats(self) -> dict:
+        """Hit/miss counters of the query-embedding and result caches."""
+        return {
+            "query_embeddings": self.query_cache.stats(),
+            "results": self.result_cache.stats(),
+        }
     
-    def retrieve(self, query: str, top_k: int = TOP_K):
+    @staticmethod
+    def _format(payload: dict, score: float) -> dict:
+        return {
+            "text": payload["text"],
+            "source": payload["source"],
+            "page": payload["page"],
+            "chunk_id": payload["chunk_id"],
+            "duplicates": payload.get("duplicates", []),
+            "score": score
+        }
+
+    def _dense_search(self, queries: list, limit: int) -> list:
+        """(point_id, payload, score) of the dense top hits, per query."""
+        embeddings = self.embed_queries(queries)
+        with tracing.span("vector_search", queries=len(queries), limit=limit):
+            return self.store.search_batch(embeddings, limit)
+
+    def _lexical_search(self, query: str, limit: int):
+        """(point_id, score) of the BM25 top hits."""
+        with tracing.span("lexical_search", limit=limit):
+            hits = self.lexical.search(tokenize(clean_text(query)), limit)
+        return [(self.lexical.point_ids[row], score) for row, score in hits]
+
+    def _payloads(self, point_ids: list) -> dict:
+        """Fetch payloads for points that only the lexical ranker returned."""
+        return self.store.retrieve(point_ids)
+
+    def retrieve(self, query: str, top_k: int = TOP_K, mode: str = RETRIEVAL_MODE):
         """
         Retrieve top_k most relevant chunks for the given query.
         
         Args:
             query: User's question
             top_k: Number of chunks to retrieve
+            mode: "dense" (MiniLM similarity), "lexical" (BM25) or "hybrid" (both, fused with RRF)
         
         Returns:
-            List of dicts with 'text', 'source', 'page', 'chunk_id', and 'score'
+            List of dicts with 'text', 'source', 'page', 'chunk_id', 'duplicates'
+            (references of chunks dropped as its duplicates, see dedup.py) and 'score'
         """
         log.info(f"Retrieving for query: {query[:100]}...")
-        
-        # Embed the query
-        query_embedding = self.model.encode(query).tolist()
-        
-        # Search in Qdrant
-        results = self.client.query_points(
-            collection_name=COLLECTION_NAME,
-            query=query_embedding,
-            limit=top_k
-        )
-        
-        # Format results
-        retrieved = []
-        for result in results.points:
-            retrieved.append({
-                "text": result.payload["text"],
-                "source": result.payload["source"],
-                "page": result.payload["page"],
-                "chunk_id": result.payload["chunk_id"],
-                "score": result.score
-            })
-        
-        log.info(f"Retrieved {len(retrieved)} chunks")
-        return retrieved
+        return self.retrieve_batch([query], top_k=top_k, mode=mode)[0]
+
+    def retrieve_batch(self, queries: list, top_k: int = TOP_K, mode: str = RETRIEVAL_MODE) -> list:
+        """
+        retrieve() for several queries at once: the uncached queries are
+        embedded in one encode batch and searched with one batched vector
+        search. Returns one result list per query, in order.
+        """
+        with tracing.span("retrieve", queries=len(queries), top_k=top_k, mode=mode):
+            return self._retrieve_batch(queries, top_k, mode)
+
+    def _retrieve_batch(self, queries: list, top_k: int, mode: str) -> list:
+        self._check_generation()
+        if mode != "dense" and self.lexical is None:
+            mode = "dense"
+
+        results = [None] * len(queries)
+        pending = {}
+        for i, query in enumerate(queries):
+            cache_key = (normalize_query(query), top_k, mode, self.generation)
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                results[i] = [dict(chunk) for chunk in cached]
+            else:
+                pending.setdefault(cache_key, []).append(i)
+        tracing.annotate(cached=len(queries) - sum(len(positions) for positions in pending.values()))
+        if not pending:
+            log.info(f"Retrieved {len(queries)} queries (cached)")
+            return results
+
+        misses = [queries[positions[0]] for positions in pending.values()]
+        limit = top_k if mode == "dense" else top_k * HYBRID_CANDIDATES
+        dense = self._dense_search(misses, limit) if mode != "lexical" else [None] * len(misses)
+        for (cache_key, positions), query, dense_hits in zip(pending.items(), misses, dense):
+            retrieved = self._rank(query, top_k, mode, dense_hits)
+            self.result_cache.put(cache_key, [dict(chunk) for chunk in retrieved])
+            for i in positions:
+                results[i] = [dict(chunk) for chunk in retrieved]
+
+        log.info(f"Retrieved {len(queries)} queries ({len(misses)} searched, {mode})")
+        return results
+
+    def _rank(self, query: str, top_k: int, mode: str, dense_hits) -> list:
+        """Final results of one query from its dense hits (and the lexical ranker)."""
+        if mode == "dense":
+            return [self._format(payload, score) for _, payload, score in dense_hits]
+        if mode == "lexical":
+            hits = self._lexical_search(query, top_k)
+            payloads = self._payloads([pid for pid, _ in hits])
+            return [self._format(payloads[pid], score) for pid, score in hits if pid in payloads]
+
+        lexical_hits = self._lexical_search(query, top_k * HYBRID_CANDIDATES)
+        fused = {}
+        for rank, (pid, _, _) in enumerate(dense_hits):
+            fused[pid] = fused.get(pid, 0.0) + 1.0 / (RRF_K + rank + 1)
+        for rank, (pid, _) in enumerate(lexical_hits):
+            fused[pid] = fused.get(pid, 0.0) + 1.0 / (RRF_K + rank + 1)
+        top = sorted(fused, key=fused.get, reverse=True)[:top_k]
+
+        payloads = {pid: payload for pid, payload, _ in dense_hits}
+        payloads.update(self._payloads([pid for pid in top if pid not in payloads]))
+        return [self._format(payloads[pid], fused[pid]) for pid in top if pid in payloads]
 
 if __name__ == "__main__":
     retriever = Retriever()
@@ -68,3 +192,6 @@ if __name__ == "__main__":
         print(f"--- Result {idx} (Score: {result['score']:.4f}) ---")
         print(f"Source: {result['source']} | Page: {result['page']}")
         print(f"Text: {result['text'][:200]}...\n")
+
+    retriever.retrieve(test_query)
+    print(f"Cache stats: {retriever.cache_stats()}")
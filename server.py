@@ -0,0 +1,339 @@
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+import tracing
+from logger import Logger
+
+log = Logger("Server Logs", log_file_needed=True, log_file="Logs/server.log")
+
+HOST = "127.0.0.1"
+PORT = 8000
+RETRIEVAL_BATCH_SIZE = 32        # Queries embedded and searched together
+RETRIEVAL_WINDOW = 0.005         # Seconds a retrieval batch waits to fill up
+RETRIEVAL_QUEUE_SIZE = 256       # Waiting retrievals before new requests get 503
+GENERATION_WINDOW = 0.05         # Seconds a generation batch waits to fill up
+GENERATION_QUEUE_SIZE = 64       # Waiting generations before new requests get 503
+RETRIEVE_TIMEOUT = 10.0          # Default per-request deadline in seconds (overridable per request)
+ANSWER_TIMEOUT = 300.0
+MAX_BODY_BYTES = 1 << 20
+HEADER_TIMEOUT = 10.0
+
+class Overloaded(Exception):
+    """The batcher's queue is full."""
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before its result was ready."""
+
+class MicroBatcher:
+    def __init__(self, name: str, handler, max_batch: int, window: float, max_queue: int):
+        """
+        Groups concurrent submissions into batches for handler(items) -> results.
+
+        A batch is closed once it holds max_batch items or `window` seconds
+        after its first item arrived, and runs on a dedicated worker thread so
+        the event loop keeps accepting requests. New items are rejected with
+        Overloaded while max_queue items are waiting, and items whose deadline
+        passed while queued are dropped before the batch runs.
+        """
+        self.name = name
+        self.handler = handler
+        self.max_batch = max_batch
+        self.window = window
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.batches = 0
+        self.items = 0
+        self.rejected = 0
+        self.expired = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item, deadline: float):
+        """Result of item, or Overloaded / DeadlineExceeded (deadline is in loop.time())."""
+        loop = asyncio.get_running_loop()
+        if self.queue.full():
+            self.rejected += 1
+            raise Overloaded(f"{self.name} queue is full")
+        future = loop.create_future()
+        self.queue.put_nowait((item, deadline, future))
+        try:
+            return await asyncio.wait_for(future, max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"{self.name} deadline exceeded") from None
+
+    async def _next_batch(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        closes = loop.time() + self.window
+        while len(batch) < self.max_batch:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = closes - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            now = loop.time()
+            live = [(item, future) for item, deadline, future in batch if not future.done() and deadline > now]
+            self.expired += len(batch) - len(live)
+            if not live:
+                continue
+            self.batches += 1
+            self.items += len(live)
+            try:
+                results = await loop.run_in_executor(self.executor, self.handler, [item for item, _ in live])
+            except Exception as e:
+                log.error(f"{self.name} batch of {len(live)} failed: {e}")
+                for _, future in live:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(live, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "rejected": self.rejected,
+            "expired": self.expired,
+        }
+
+def retrieve_handler(items: list) -> list:
+    """
+    Batch handler for (query, top_k, mode, with_embedding) items: one
+    Retriever.retrieve_batch per distinct (top_k, mode), returning
+    (retrieved, embedding or None) per item.
+    """
+    from generation_pipeline import get_retriever
+
+    retriever = get_retriever()
+    results = [None] * len(items)
+    groups = {}
+    for i, (query, top_k, mode, _) in enumerate(items):
+        groups.setdefault((top_k, mode), []).append(i)
+    for (top_k, mode), positions in groups.items():
+        batch = retriever.retrieve_batch([items[i][0] for i in positions], top_k=top_k, mode=mode)
+        for i, retrieved in zip(positions, batch):
+            results[i] = retrieved
+    wanted = [i for i, item in enumerate(items) if item[3]]
+    embeddings = dict(zip(wanted, retriever.embed_queries([items[i][0] for i in wanted]))) if wanted else {}
+    return [(retrieved, embeddings.get(i)) for i, retrieved in enumerate(results)]
+
+def generate_handler(prompt_texts: list) -> list:
+    from generation_pipeline import generate_batch
+    return generate_batch(prompt_texts)
+
+class AnswerService:
+    def __init__(self, retrieval_batch: int = RETRIEVAL_BATCH_SIZE, generation_batch: int = None):
+        """Retrieval and answer generation behind two micro-batchers."""
+        from generation_pipeline import GENERATION_BATCH_SIZE
+
+        self.retrieval = MicroBatcher(
+            "retrieval", retrieve_handler, retrieval_batch, RETRIEVAL_WINDOW, RETRIEVAL_QUEUE_SIZE
+        )
+        self.generation = MicroBatcher(
+            "generation", generate_handler, generation_batch or GENERATION_BATCH_SIZE,
+            GENERATION_WINDOW, GENERATION_QUEUE_SIZE,
+        )
+
+    def start(self):
+        self.retrieval.start()
+        self.generation.start()
+
+    @staticmethod
+    def deadline(timeout: float) -> float:
+        return asyncio.get_running_loop().time() + timeout
+
+    async def retrieve(self, query: str, top_k: int, mode: str, timeout: float = RETRIEVE_TIMEOUT) -> list:
+        retrieved, _ = await self.retrieval.submit((query, top_k, mode, False), self.deadline(timeout))
+        return retrieved
+
+    async def answer(self, question: str, top_k: int, use_cache: bool, timeout: float = ANSWER_TIMEOUT) -> dict:
+        """Same result as generation_pipeline.generate_answer, with both stages batched."""
+        from generation_pipeline import get_answer_cache, build_context, extract_sources, prompt
+        from retrieve import RETRIEVAL_MODE
+
+        deadline = self.deadline(timeout)
+        retrieved, embedding = await self.retrieval.submit((question, top_k, RETRIEVAL_MODE, use_cache), deadline)
+        chunk_ids = [chunk["chunk_id"] for chunk in retrieved]
+        if use_cache:
+            cached = get_answer_cache().lookup(embedding, chunk_ids)
+            if cached is not None:
+                return {
+                    "answer": cached["answer"], "sources": cached["sources"], "retrieved_chunks": retrieved,
+                    "cached": True, "context_stats": None,
+                }
+
+        context, context_stats = await asyncio.to_thread(build_context, retrieved)
+        prompt_text = prompt.format(context=context, question=question)
+        answer = await self.generation.submit(prompt_text, deadline)
+        sources = extract_sources(retrieved)
+        if use_cache:
+            await asyncio.to_thread(get_answer_cache().add, question, embedding, chunk_ids, answer, sources)
+        return {
+            "answer": answer, "sources": sources, "retrieved_chunks": retrieved,
+            "cached": False, "context_stats": context_stats,
+        }
+
+    def stats(self) -> dict:
+        from generation_pipeline import is_ready
+        return {"ready": is_ready(), "retrieval": self.retrieval.stats(), "generation": self.generation.stats()}
+
+# ---------------------------------------------------------------------------
+# HTTP
+# ---------------------------------------------------------------------------
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str = ""):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+MODES = ("dense", "lexical", "hybrid")
+_KINDS = {str: "a string", int: "an integer", float: "a number", bool: "true or false"}
+
+def _field(body: dict, name: str, kind, default=None):
+    """body[name] (or default) checked against kind; ints are accepted as floats."""
+    value = body.get(name, default)
+    if kind is float and isinstance(value, int) and not isinstance(value, bool):
+        value = float(value)
+    if value is None or not isinstance(value, kind) or (isinstance(value, bool) and kind is not bool):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"'{name}' must be {_KINDS[kind]}")
+    return value
+
+async def route(service: AnswerService, method: str, path: str, body: bytes):
+    """(status, JSON payload) for one request; /metrics returns Prometheus text instead."""
+    from generation_pipeline import USE_ANSWER_CACHE
+    from retrieve import RETRIEVAL_MODE
+
+    if path == "/health":
+        if method != "GET":
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+        return HTTPStatus.OK, service.stats()
+    if path == "/metrics":
+        if method != "GET":
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+        return HTTPStatus.OK, tracing.metrics.prometheus()
+    if path not in ("/retrieve", "/answer"):
+        raise HTTPError(HTTPStatus.NOT_FOUND)
+    if method != "POST":
+        raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+    try:
+        request = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Body must be JSON") from None
+    if not isinstance(request, dict):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object")
+
+    top_k = _field(request, "top_k", int, 5)
+    if top_k < 1:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "'top_k' must be positive")
+    try:
+        if path == "/retrieve":
+            mode = _field(request, "mode", str, RETRIEVAL_MODE)
+            if mode not in MODES:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"'mode' must be one of {', '.join(MODES)}")
+            timeout = _field(request, "timeout", float, RETRIEVE_TIMEOUT)
+            results = await service.retrieve(_field(request, "query", str), top_k, mode, timeout)
+            return HTTPStatus.OK, {"results": results}
+        timeout = _field(request, "timeout", float, ANSWER_TIMEOUT)
+        result = await service.answer(
+            _field(request, "question", str), top_k, _field(request, "use_cache", bool, USE_ANSWER_CACHE), timeout
+        )
+        return HTTPStatus.OK, result
+    except Overloaded as e:
+        raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, str(e)) from None
+    except DeadlineExceeded as e:
+        raise HTTPError(HTTPStatus.GATEWAY_TIMEOUT, str(e)) from None
+
+def _response(status: HTTPStatus, payload) -> bytes:
+    if isinstance(payload, str):
+        body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+    else:
+        body, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json"
+    headers = [
+        f"HTTP/1.1 {status.value} {status.phrase}",
+        f"Content-Type: {content_type}",
+        f"Content-Length: {len(body)}",
+        "Connection: close",
+    ]
+    if status == HTTPStatus.SERVICE_UNAVAILABLE:
+        headers.append("Retry-After: 1")
+    return ("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body
+
+async def handle_connection(service: AnswerService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Serve one HTTP/1.1 request per connection."""
+    path = start = None
+    try:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), HEADER_TIMEOUT)
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), HEADER_TIMEOUT)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY_BYTES:
+                raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            body = await asyncio.wait_for(reader.readexactly(length), HEADER_TIMEOUT) if length else b""
+            path = path.split("?", 1)[0]
+            start = time.perf_counter()
+            status, payload = await route(service, method, path, body)
+        except HTTPError as e:
+            status, payload = e.status, {"error": str(e)}
+        except (ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            status, payload = HTTPStatus.BAD_REQUEST, {"error": "Malformed request"}
+        except Exception as e:
+            log.error(f"Request failed: {e}")
+            status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)}
+        if path in ("/retrieve", "/answer"):
+            # Overload (503) and deadline (504) responses included: they are what drives the tail
+            tracing.metrics.inc("http_requests_total", path=path, status=status.value)
+            if start is not None:
+                tracing.metrics.observe("http_request_duration_seconds", time.perf_counter() - start, path=path, status=status.value)
+        writer.write(_response(status, payload))
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def serve(host: str = HOST, port: int = PORT, warm_up: bool = True):
+    from generation_pipeline import start_warm_up
+
+    service = AnswerService()
+    service.start()
+    if warm_up:
+        start_warm_up()
+    server = await asyncio.start_server(lambda r, w: handle_connection(service, r, w), host, port)
+    log.info(f"Serving on http://{host}:{port} (POST /retrieve, POST /answer, GET /health)")
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batched HTTP API for retrieval and answer generation.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--no-warm-up", action="store_true", help="Load models on the first request instead")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, warm_up=not args.no_warm_up))
@@ -1,5 +1,6 @@
 import streamlit as st
-from generation_pipeline import generate_answer
+import registry
+from generation_pipeline import generate_answer_stream, start_warm_up, is_ready, USE_ANSWER_CACHE
 import time
 
 st.set_page_config(
@@ -12,11 +13,15 @@ st.set_page_config(
 if "history" not in st.session_state:
     st.session_state.history = []
 
+# Load the retriever and model in the background so the UI renders immediately
+start_warm_up()
+
 with st.sidebar:
     st.header("Settings")
     top_k = st.slider("Context chunks", min_value=1, max_value=10, value=5)
     show_sources = st.checkbox("Show sources", value=True)
     show_chunks = st.checkbox("Show retrieved context", value=False)
+    use_cache = st.checkbox("Reuse answers to similar questions", value=USE_ANSWER_CACHE)
 
     st.divider()
 
@@ -25,6 +30,32 @@ with st.sidebar:
         st.rerun()
 
     st.divider()
+
+    def warm_up_finished() -> bool:
+        return is_ready() or "warm_up_failed" in registry.events()
+
+    def show_model_status():
+        events = registry.events()
+        if is_ready():
+            st.caption(f"Model ready ({events['warm']:.1f}s after cold start)")
+        elif "warm_up_failed" in events:
+            st.caption("Model warm-up failed, see Logs/generation.log")
+        else:
+            st.caption("Model warming up... questions will wait until it is ready")
+        if "first_paint" in events:
+            st.caption(f"First paint {events['first_paint']:.2f}s after cold start")
+
+    @st.fragment(run_every=2)
+    def poll_model_status():
+        # Only rendered while warming up; one full rerun once it finishes swaps in the static status
+        if warm_up_finished():
+            st.rerun()
+        show_model_status()
+
+    if warm_up_finished():
+        show_model_status()
+    else:
+        poll_model_status()
     st.caption("Powered by Llama 3.2 3B & Qdrant")
 
 st.title("Interview Prep Assistant")
@@ -62,6 +93,7 @@ if not st.session_state.history:
         st.markdown("- What skills are needed for a Business Analyst?")
 
 prompt = st.chat_input("Type your question here...")
+registry.mark("first_paint")
 
 if prompt:
     with st.chat_message("user"):
@@ -69,34 +101,45 @@ if prompt:
 
     try:
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                start_time = time.time()
-                result = generate_answer(prompt, top_k=top_k)
-                elapsed_time = time.time() - start_time
-
-                st.markdown(result["answer"])
-
-                if show_sources and result.get("sources"):
-                    with st.expander("View sources"):
-                        for source in result["sources"]:
-                            st.markdown(f"- {source}")
-
-                if show_chunks and result.get("retrieved_chunks"):
-                    with st.expander("View retrieved context"):
-                        for i, chunk in enumerate(result["retrieved_chunks"], 1):
-                            st.markdown(
-                                f"**[{i}] {chunk['source']} - Page {chunk['page']}** "
-                                f"(Score: {chunk['score']:.3f})"
-                            )
-                            st.text(chunk["text"][:500] + "...")
-                            st.divider()
+            start_time = time.time()
+            with st.spinner("Retrieving context..."):
+                result = generate_answer_stream(prompt, top_k=top_k, use_cache=use_cache)
+
+            timings = {"ttft": None}
+
+            def timed_tokens():
+                for token in result["tokens"]:
+                    if timings["ttft"] is None:
+                        timings["ttft"] = time.time() - start_time
+                    yield token
+
+            answer = st.write_stream(timed_tokens())
+            elapsed_time = time.time() - start_time
+            if result.get("cached"):
+                st.caption("Answered from cache")
+
+            if show_sources and result.get("sources"):
+                with st.expander("View sources"):
+                    for source in result["sources"]:
+                        st.markdown(f"- {source}")
+
+            if show_chunks and result.get("retrieved_chunks"):
+                with st.expander("View retrieved context"):
+                    for i, chunk in enumerate(result["retrieved_chunks"], 1):
+                        st.markdown(
+                            f"**[{i}] {chunk['source']} - Page {chunk['page']}** "
+                            f"(Score: {chunk['score']:.3f})"
+                        )
+                        st.text(chunk["text"][:500] + "...")
+                        st.divider()
 
         st.session_state.history.append({
             "question": prompt,
-            "answer": result["answer"],
+            "answer": answer,
             "sources": result.get("sources", []),
             "chunks": result.get("retrieved_chunks", []),
             "time": elapsed_time,
+            "ttft": timings["ttft"],
         })
 
     except Exception as e:
@@ -0,0 +1,42 @@
+import json
+import sys
+from pathlib import Path
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+FIXTURES = Path(__file__).resolve().parent / "fixtures" / "clean_parity"
+
+def _fixture_texts():
+    """(id, text) for every paragraph of the .txt fixtures and every chunk of the *_chunks.json fixtures."""
+    texts = []
+    for path in sorted(FIXTURES.glob("*.txt")):
+        text = path.read_text(encoding="utf-8")
+        texts.append((path.name, text))
+        texts += [(f"{path.name}[{i}]", block) for i, block in enumerate(text.split("\n\n"))]
+    for path in sorted(FIXTURES.glob("*_chunks.json")):
+        with open(path, 'r', encoding='utf-8') as f:
+            texts += [(f"{path.name}[{i}]", chunk["text"]) for i, chunk in enumerate(json.load(f))]
+    return texts
+
+@pytest.fixture(scope="module")
+def data_cleaning(tmp_path_factory):
+    pytest.importorskip("nltk")
+    # The repo's modules log to Logs/ under the working directory
+    workdir = tmp_path_factory.mktemp("clean_parity")
+    (workdir / "Logs").mkdir()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(workdir)
+        monkeypatch.syspath_prepend(str(REPO_DIR))
+        import data_cleaning
+        if not data_cleaning.has_punkt_model():
+            pytest.skip("NLTK punkt_tab data is not installed")
+        yield data_cleaning
+    sys.modules.pop("data_cleaning", None)
+
+@pytest.mark.parametrize("name, text", _fixture_texts(), ids=[name for name, _ in _fixture_texts()])
+def test_clean_text_matches_nltk(data_cleaning, name, text):
+    assert data_cleaning.clean_text(text).split() == data_cleaning.legacy_clean_text(text).split()
+
+def test_check_parity_on_fixture_corpus(data_cleaning):
+    paths = sorted(FIXTURES.glob("*.txt")) + sorted(FIXTURES.glob("*_chunks.json"))
+    assert data_cleaning.check_parity(paths) == 0
@@ -0,0 +1,275 @@
+import os
+import re
+import sys
+import zipfile
+from functools import lru_cache
+from pathlib import Path
+
+LANGUAGE = "english"
+SENTBREAK_CACHE_SIZE = 1 << 16   # Distinct period contexts whose Punkt decision is memoized
+
+# Fallback when no local NLTK stopwords corpus is found (NLTK's English list)
+BUNDLED_STOPWORDS = frozenset("""
+a about above after again against ain all am an and any are aren aren't as at be because been before being
+below between both but by can couldn couldn't d did didn didn't do does doesn doesn't doing don don't down
+during each few for from further had hadn hadn't has hasn hasn't have haven haven't having he he'd he'll her
+here hers herself he's him himself his how i i'd if i'll i'm in into is isn isn't it it'd it'll it's its itself
+i've just ll m ma me mightn mightn't more most mustn mustn't my myself needn needn't no nor not now o of off on
+once only or other our ours ourselves out over own re s same shan shan't she she'd she'll she's should shouldn
+shouldn't should've so some such t than that that'll the their theirs them themselves then there these they
+they'd they'll they're they've this those through to too under until up ve very was wasn wasn't we we'd we'll
+we're were weren weren't we've what when where which while who whom why will with won won't wouldn wouldn't y
+you you'd you'll your you're yours yourself yourselves you've
+""".split())
+
+# ---------------------------------------------------------------------------
+# Local NLTK data (read only, never downloaded)
+# ---------------------------------------------------------------------------
+
+def nltk_data_dirs() -> list:
+    """The directories nltk.data searches by default, in the same order."""
+    dirs = [d for d in os.environ.get("NLTK_DATA", "").split(os.pathsep) if d]
+    home = os.path.expanduser("~/")
+    if home != "~/":
+        dirs.append(os.path.join(home, "nltk_data"))
+    dirs += [
+        os.path.join(sys.prefix, "nltk_data"),
+        os.path.join(sys.prefix, "share", "nltk_data"),
+        os.path.join(sys.prefix, "lib", "nltk_data"),
+        "/usr/share/nltk_data",
+        "/usr/local/share/nltk_data",
+        "/usr/lib/nltk_data",
+        "/usr/local/lib/nltk_data",
+    ]
+    return [Path(d) for d in dirs]
+
+def read_nltk_resource(resource: str):
+    """
+    Lines of a local NLTK data file such as "corpora/stopwords/english",
+    or None when it is not installed. Both unpacked directories and the
+    zip archives left behind by nltk.download are read.
+    """
+    category, package, *rest = resource.split("/")
+    for root in nltk_data_dirs():
+        path = root / resource
+        if path.is_file():
+            data = path.read_text(encoding="utf-8")
+        else:
+            archive = root / category / f"{package}.zip"
+            member = "/".join([package, *rest])
+            if not archive.is_file():
+                continue
+            with zipfile.ZipFile(archive) as zf:
+                if member not in zf.namelist():
+                    continue
+                data = zf.read(member).decode("utf-8")
+        lines = data.split("\n")
+        return lines[:-1] if lines and lines[-1] == "" else lines
+    return None
+
+@lru_cache(maxsize=None)
+def load_stopwords(language: str = LANGUAGE) -> frozenset:
+    """Stopwords from the local NLTK corpus, falling back to BUNDLED_STOPWORDS."""
+    lines = read_nltk_resource(f"corpora/stopwords/{language}")
+    if lines is None:
+        return BUNDLED_STOPWORDS
+    return frozenset(line for line in lines if line.strip())
+
+@lru_cache(maxsize=None)
+def load_punkt_params(language: str = LANGUAGE):
+    """
+    (abbrev_types, collocations, sent_starters, ortho_context) of the local
+    punkt_tab model. Without it every period-final word ends a sentence
+    unless the orthographic checks say otherwise.
+    """
+    def lines(name):
+        return read_nltk_resource(f"tokenizers/punkt_tab/{language}/{name}") or []
+
+    return (
+        frozenset(lines("abbrev_types.txt")),
+        frozenset(tuple(line.split("\t")) for line in lines("collocations.tab")),
+        frozenset(lines("sent_starters.txt")),
+        {typ: int(flags) for typ, flags in (line.split("\t") for line in lines("ortho_context.tab"))},
+    )
+
+def has_punkt_model(language: str = LANGUAGE) -> bool:
+    return read_nltk_resource(f"tokenizers/punkt_tab/{language}/abbrev_types.txt") is not None
+
+# ---------------------------------------------------------------------------
+# Sentence boundaries (Punkt, as used by nltk.sent_tokenize)
+# ---------------------------------------------------------------------------
+
+_NON_WORD = r"(?:[)\";}\]\*:@\'\({\[‘’“”\xab\xbb?!])"
+_MULTI_CHAR = r"(?:\-{2,}|\.{2,}|(?:\.\s){2,}\.)"
+_WORD_START = r"[^\(\"\`{\[:;&\#\*@\)}\]\-,]"
+
+_PERIOD_CONTEXT = re.compile(
+    rf"[.?!](?=(?P<after_tok>{_NON_WORD}|\s+(?P<next_tok>\S+)))"
+)
+_PUNKT_WORD = re.compile(
+    rf"{_MULTI_CHAR}"
+    rf"|(?={_WORD_START})\S+?(?=\s|$|{_NON_WORD}|{_MULTI_CHAR}|,(?=$|\s|{_NON_WORD}|{_MULTI_CHAR}))"
+    rf"|\S"
+)
+_REALIGN = re.compile(r'["\')\]}‘’“”\xab\xbb]+?(?:\s+|(?=--)|$)', re.MULTILINE)
+_LAST_WHITESPACE = re.compile(r"[ \t\n\r\x0b\x0c][^ \t\n\r\x0b\x0c]*\Z")
+
+_NUMERIC = re.compile(r"^-?[\.,]?\d[\d,\.-]*\.?$")
+_INITIAL = re.compile(r"[^\W\d]\.$")
+_ELLIPSIS = re.compile(r"\.\.+$")
+
+_ORTHO_BEG_UC, _ORTHO_MID_UC, _ORTHO_UNK_UC = 1 << 1, 1 << 2, 1 << 3
+_ORTHO_BEG_LC, _ORTHO_MID_LC, _ORTHO_UNK_LC = 1 << 4, 1 << 5, 1 << 6
+_ORTHO_UC = _ORTHO_BEG_UC | _ORTHO_MID_UC | _ORTHO_UNK_UC
+_ORTHO_LC = _ORTHO_BEG_LC | _ORTHO_MID_LC | _ORTHO_UNK_LC
+
+def _ortho_heuristic(tok: str, typ: str, ortho_context: dict):
+    """True / False / None (unknown): does tok start a sentence?"""
+    if tok in (";", ":", ",", ".", "!", "?"):
+        return False
+    flags = ortho_context.get(typ, 0)
+    if tok[0].isupper() and flags & _ORTHO_LC and not flags & _ORTHO_MID_UC:
+        return True
+    if tok[0].islower() and (flags & _ORTHO_UC or not flags & _ORTHO_BEG_LC):
+        return False
+    return None
+
+@lru_cache(maxsize=SENTBREAK_CACHE_SIZE)
+def _contains_sentbreak(context: str) -> bool:
+    """Punkt's decision for one candidate context ("word. next")."""
+    abbrev_types, collocations, sent_starters, ortho_context = load_punkt_params()
+    toks = [tok for line in context.split("\n") if line.strip() for tok in _PUNKT_WORD.findall(line)]
+    types, breaks, abbrs = [], [], []
+    for tok in toks:
+        typ = _NUMERIC.sub("##number##", tok.lower())
+        sentbreak = abbr = False
+        if tok in (".", "?", "!"):
+            sentbreak = True
+        elif _ELLIPSIS.match(tok):
+            abbr = None  # ellipsis
+        elif tok.endswith(".") and not tok.endswith(".."):
+            stem = tok[:-1].lower()
+            if stem in abbrev_types or stem.split("-")[-1] in abbrev_types:
+                abbr = True
+            else:
+                sentbreak = True
+        types.append(typ)
+        breaks.append(sentbreak)
+        abbrs.append(abbr)
+
+    for i in range(len(toks) - 1):
+        tok = toks[i]
+        if not tok.endswith("."):
+            continue
+        typ = types[i][:-1] if len(types[i]) > 1 and types[i][-1] == "." else types[i]
+        next_tok = toks[i + 1]
+        next_typ = types[i + 1]
+        if breaks[i + 1] and len(next_typ) > 1 and next_typ[-1] == ".":
+            next_typ = next_typ[:-1]
+        is_initial = _INITIAL.match(tok)
+
+        if (typ, next_typ) in collocations:
+            breaks[i] = False
+            continue
+        if abbrs[i] is not False and not is_initial:
+            if _ortho_heuristic(next_tok, next_typ, ortho_context) is True:
+                breaks[i] = True
+                continue
+            if next_tok[0].isupper() and next_typ in sent_starters:
+                breaks[i] = True
+                continue
+        if is_initial or typ == "##number##":
+            starter = _ortho_heuristic(next_tok, next_typ, ortho_context)
+            if starter is False:
+                breaks[i] = False
+                continue
+            if (starter is None and is_initial and next_tok[0].isupper()
+                    and not ortho_context.get(next_typ, 0) & _ORTHO_LC):
+                breaks[i] = False
+    return any(breaks[:-1])
+
+def _candidate_contexts(text: str):
+    """(match, context) for every potential sentence end, as Punkt scans them."""
+    previous_start = previous_stop = 0
+    previous_match = None
+    for match in _PERIOD_CONTEXT.finditer(text):
+        ws = _LAST_WHITESPACE.search(text, previous_stop, match.start())
+        index = ws.start() - previous_stop if ws else 0
+        word_start = previous_stop + index + 1 if index else previous_start
+        if previous_match and previous_stop <= word_start:
+            yield previous_match, text[previous_start:previous_stop] + previous_match.group() + previous_match.group("after_tok")
+        previous_match = match
+        previous_start, previous_stop = word_start, match.start()
+    if previous_match:
+        yield previous_match, text[previous_start:previous_stop] + previous_match.group() + previous_match.group("after_tok")
+
+def sentence_spans(text: str) -> list:
+    """(start, end) of each sentence, matching nltk.sent_tokenize."""
+    slices = []
+    last_break = 0
+    for match, context in _candidate_contexts(text):
+        if _contains_sentbreak(context):
+            slices.append((last_break, match.end()))
+            last_break = match.start("next_tok") if match.group("next_tok") else match.end()
+    slices.append((last_break, len(text.rstrip())))
+
+    spans = []
+    realign = 0
+    for (start, stop), following in zip(slices, slices[1:] + [None]):
+        start += realign
+        if following is None:
+            if text[start:stop]:
+                spans.append((start, stop))
+            continue
+        m = _REALIGN.match(text[following[0]:following[1]])
+        if m:
+            spans.append((start, following[0] + len(m.group(0).rstrip())))
+            realign = m.end()
+        else:
+            realign = 0
+            if text[start:stop]:
+                spans.append((start, stop))
+    return spans
+
+# ---------------------------------------------------------------------------
+# Words (NLTKWordTokenizer rules that can fire on clean_text's alphabet)
+# ---------------------------------------------------------------------------
+
+# (pattern, substitution, substrings that must occur for the pattern to match)
+_WORD_RULES = [
+    (re.compile(r'([^\.])(\.)([\]\)}>"\'' "»”’ " r"]*)\s*$"), r"\1 \2 \3 ", (".",)),
+    (re.compile(r"([:,])([^\d])"), r" \1 \2", (":", ",")),
+    (re.compile(r"([:,])$"), r" \1 ", (":", ",")),
+    (re.compile(r"\.{2,}"), r" \g<0> ", ("..",)),
+    (re.compile(r"[;@#$%&]"), r" \g<0> ", tuple(";@#$%&")),
+    (re.compile(r'([^\.])(\.)([\]\)}>"\']*)\s*$'), r"\1 \2\3 ", (".",)),
+    (re.compile(r"[\]\[\(\)\{\}\<\>]"), r" \g<0> ", tuple("[](){}<>")),
+    (re.compile(r"--"), r" -- ", ("--",)),
+]
+_CONTRACTIONS = [
+    (re.compile(r"(?i)\b(can)(not)\b"), r" \1 \2 ", ("cannot",)),
+    (re.compile(r"(?i)\b(gim)(me)\b"), r" \1 \2 ", ("gimme",)),
+    (re.compile(r"(?i)\b(gon)(na)\b"), r" \1 \2 ", ("gonna",)),
+    (re.compile(r"(?i)\b(got)(ta)\b"), r" \1 \2 ", ("gotta",)),
+    (re.compile(r"(?i)\b(lem)(me)\b"), r" \1 \2 ", ("lemme",)),
+    (re.compile(r"(?i)\b(wan)(na)(?=\s)"), r" \1 \2 ", ("wanna",)),
+]
+
+def _sentence_words(sentence: str) -> list:
+    """NLTKWordTokenizer.tokenize, skipping the rules whose trigger is absent."""
+    for regexp, substitution, triggers in _WORD_RULES:
+        if any(t in sentence for t in triggers):
+            sentence = regexp.sub(substitution, sentence)
+    sentence = f" {sentence} "
+    for regexp, substitution, triggers in _CONTRACTIONS:
+        if any(t in sentence for t in triggers):
+            sentence = regexp.sub(substitution, sentence)
+    return sentence.split()
+
+def word_tokenize(text: str) -> list:
+    """
+    Same tokens as nltk.word_tokenize for text restricted to clean_text's
+    alphabet (lowercase ASCII letters, digits, whitespace and .#/@(),:;-+%&).
+    Quote, apostrophe and ?/! rules are not applied.
+    """
+    return [word for start, stop in sentence_spans(text) for word in _sentence_words(text[start:stop])]
@@ -0,0 +1,398 @@
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import math
+import os
+import queue
+import threading
+import time
+import uuid
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from logger import Logger
+
+log = Logger("Tracing Logs", log_file_needed=True, log_file="Logs/tracing.log")
+
+TRACING = True                              # Record spans and metrics; span() is a no-op when off
+TRACE_FILE = Path("Logs/traces.jsonl")      # One JSON line per finished root span (with its children); None to disable
+TRACE_MAX_BYTES = 50 * 1024 * 1024          # TRACE_FILE is rotated at this size, keeping TRACE_BACKUPS old files
+TRACE_BACKUPS = 3
+TRACE_QUEUE_SIZE = 10000                    # Finished traces waiting for the writer thread; more are dropped (traces_dropped_total)
+METRICS_FILE = Path("Logs/metrics.prom")    # Prometheus text exposition, rewritten at exit; None to disable
+METRICS_JSONL = Path("Logs/metrics.jsonl")  # One metrics snapshot per line, appended at exit; None to disable
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+class Histogram:
+    """Cumulative-bucket latency histogram (Prometheus semantics: le = upper bound)."""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)     # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float):
+        """Quantile estimated by linear interpolation inside its bucket (None if empty)."""
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+class Metrics:
+    """Thread-safe in-process counters, gauges and histograms, keyed by name and labels."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self.lock:
+            key = (name, _labels_key(labels))
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self.lock:
+            self.gauges[(name, _labels_key(labels))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        with self.lock:
+            key = (name, _labels_key(labels))
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def empty(self) -> bool:
+        return not (self.counters or self.gauges or self.histograms)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self.lock:
+            for kind, series in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({name for name, _ in series}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (series_name, key), value in sorted(series.items()):
+                        if series_name == name:
+                            lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (series_name, key), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if series_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (math.inf,), histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, (('le', _format_value(bound)),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(histogram.sum)}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """JSON-serialisable view: counters, gauges and histogram summaries (with estimated p50/p90/p99)."""
+        with self.lock:
+            return {
+                "time": time.time(),
+                "pid": os.getpid(),
+                "counters": [{"name": name, "labels": dict(key), "value": value} for (name, key), value in self.counters.items()],
+                "gauges": [{"name": name, "labels": dict(key), "value": value} for (name, key), value in self.gauges.items()],
+                "histograms": [
+                    {"name": name, "labels": dict(key), **histogram.summary()}
+                    for (name, key), histogram in self.histograms.items()
+                ],
+            }
+
+metrics = Metrics()
+
+class Span:
+    """A timed operation with attributes and child spans; see span()."""
+    def __init__(self, name: str, parent=None, attributes: dict = None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.attributes = dict(attributes or {})
+        self.children = []
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        record = {
+            "name": self.name,
+            "start": self.start_time,
+            "seconds": self.seconds,
+            "attributes": self.attributes,
+            "children": [child.to_dict() for child in self.children],
+        }
+        if self.error:
+            record["error"] = self.error
+        return record
+
+    def breakdown(self) -> dict:
+        """{child name: total seconds} over the span's direct children."""
+        totals = {}
+        for child in self.children:
+            totals[child.name] = totals.get(child.name, 0.0) + (child.seconds or 0.0)
+        return totals
+
+class _TraceWriter:
+    """
+    Appends finished root spans to TRACE_FILE from a background thread, so
+    serialisation and disk writes stay off the request path. The queue is
+    bounded (full -> the trace is dropped and counted) and the file rotates
+    at TRACE_MAX_BYTES.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue = None
+        self.thread = None
+        self.pid = None
+
+    def submit(self, span: Span):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():     # First trace, or first in a forked child
+                    self.queue = queue.Queue(TRACE_QUEUE_SIZE)
+                    self.thread = threading.Thread(target=self._run, args=(self.queue,), name="trace-writer", daemon=True)
+                    self.thread.start()
+                    self.pid = os.getpid()
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            metrics.inc("traces_dropped_total")
+
+    @staticmethod
+    def _run(spans: queue.Queue):
+        handler = None
+        while True:
+            span = spans.get()
+            try:
+                if span is None:
+                    return
+                if handler is None:
+                    TRACE_FILE.parent.mkdir(parents=True, exist_ok=True)
+                    handler = RotatingFileHandler(TRACE_FILE, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS, encoding='utf-8')
+                record = span.to_dict()
+                record["trace_id"] = span.trace_id
+                handler.emit(logging.makeLogRecord({"msg": json.dumps(record, default=str)}))
+            except OSError as e:
+                log.warning(f"Could not write trace {span.name}: {e}")
+            finally:
+                spans.task_done()
+                if span is None and handler is not None:
+                    handler.close()
+
+    def close(self):
+        """Write every queued trace and stop the thread."""
+        if self.pid == os.getpid() and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+            self.pid = None
+
+_trace_writer = _TraceWriter()
+
+def _finish(span: Span):
+    metrics.observe("span_duration_seconds", span.seconds, span=span.name)
+    if span.error:
+        metrics.inc("span_errors_total", span=span.name)
+    if span.parent is not None:
+        span.parent.children.append(span)
+    elif TRACE_FILE is not None:
+        _trace_writer.submit(span)
+
+class _NullSpan:
+    def set(self, **attributes):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class span:
+    """
+    Context manager timing a named span under the current one (a new root
+    span, i.e. trace, if there is none):
+
+        with span("retrieve", top_k=5) as s:
+            ...
+            s.set(hits=len(hits))
+
+    Durations feed the span_duration_seconds{span=...} histogram; root spans
+    are queued for TRACE_FILE with their children when they finish. Spans
+    follow contextvars, so work on other threads starts its own trace unless
+    it runs in a copied context.
+    """
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.span = None
+        self.token = None
+
+    def __enter__(self):
+        if not TRACING:
+            return _NULL_SPAN
+        self.span = Span(self.name, _current.get(), self.attributes)
+        self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.span is None:
+            return False
+        self.span.seconds = time.perf_counter() - self.span.start
+        if exc_type is not None:
+            self.span.error = f"{exc_type.__name__}: {exc}"
+        _current.reset(self.token)
+        _finish(self.span)
+        return False
+
+def traced(name: str):
+    """Decorator running the function inside span(name)."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def current_span():
+    """The innermost open span, or a no-op stand-in."""
+    return _current.get() or _NULL_SPAN
+
+def annotate(**attributes):
+    """Set attributes on the innermost open span, if any."""
+    current_span().set(**attributes)
+
+def add_span(name: str, seconds: float, **attributes):
+    """
+    Record an already measured phase (e.g. prefill and decode, which happen
+    inside one model.generate call) as a finished child of the current span.
+    """
+    if not TRACING:
+        return
+    finished = Span(name, _current.get(), attributes)
+    finished.start_time = time.time() - seconds
+    finished.seconds = seconds
+    _finish(finished)
+
+def record_tokens(stage: str, tokens: int, seconds: float):
+    """Count generated tokens and set the tokens/s gauge of a generation stage."""
+    if not TRACING:
+        return
+    metrics.inc("generated_tokens_total", tokens, stage=stage)
+    if seconds > 0:
+        metrics.set_gauge("tokens_per_second", tokens / seconds, stage=stage)
+
+def write_metrics(prom_path: Path = METRICS_FILE, jsonl_path: Path = METRICS_JSONL):
+    """Write the Prometheus text file (atomically) and append a JSON snapshot line."""
+    if prom_path is not None:
+        prom_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = prom_path.with_name(prom_path.name + f".{os.getpid()}.tmp")
+        tmp_path.write_text(metrics.prometheus(), encoding="utf-8")
+        os.replace(tmp_path, prom_path)
+    if jsonl_path is not None:
+        jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(jsonl_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(metrics.snapshot()) + "\n")
+
+@atexit.register
+def _write_at_exit():
+    _trace_writer.close()
+    if TRACING and not metrics.empty():
+        try:
+            write_metrics()
+        except OSError as e:
+            log.warning(f"Could not write metrics at exit: {e}")
+
+def summarize_traces(path: Path = TRACE_FILE, name: str = None) -> dict:
+    """
+    {span name: {"count", "p50", "p99", "max"}} in seconds over every span
+    (at any depth) of the traces in a TRACE_FILE, optionally only inside
+    root spans called `name`.
+    """
+    durations = {}
+
+    def walk(record):
+        durations.setdefault(record["name"], []).append(record["seconds"])
+        for child in record["children"]:
+            walk(child)
+
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if name is None or record["name"] == name:
+                walk(record)
+
+    summary = {}
+    for span_name, values in durations.items():
+        values.sort()
+        summary[span_name] = {
+            "count": len(values),
+            "p50": values[len(values) // 2],
+            "p99": values[min(len(values) - 1, int(len(values) * 0.99))],
+            "max": values[-1],
+        }
+    return summary
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Summarise span latencies from a traces JSONL file.")
+    parser.add_argument("traces", type=Path, nargs="?", default=TRACE_FILE)
+    parser.add_argument("--root", default=None, help="Only traces whose root span has this name (e.g. generate_answer)")
+    args = parser.parse_args()
+    summary = summarize_traces(args.traces, args.root)
+    print(f"{'span':<28}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for span_name, stats in sorted(summary.items(), key=lambda item: -item[1]["p99"]):
+        print(f"{span_name:<28}{stats['count']:>8}{stats['p50'] * 1e3:>10.2f}{stats['p99'] * 1e3:>10.2f}{stats['max'] * 1e3:>10.2f}")
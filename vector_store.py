@@ -0,0 +1,643 @@
+import json
+import math
+import re
+import shutil
+import threading
+from pathlib import Path
+import numpy as np
+from logger import Logger
+
+log = Logger("Vector Store Logs", log_file_needed=True, log_file="Logs/vector_store.log")
+
+VECTOR_BACKEND = "qdrant"   # "qdrant", "numpy" (exact, small/medium corpora) or "hnsw" (approximate, large corpora)
+COLLECTION_NAME = "invoices"   # Qdrant alias readers query; it points at the live COLLECTION_NAME_v<n> collection
+QDRANT_KEEP_VERSIONS = 1       # Previous collection versions kept after an alias switch, for rollback
+QDRANT_PATH = Path("vector_stores/qdrant")
+QDRANT_URL = None           # e.g. "http://localhost:6333" to use a Qdrant server instead of local mode
+NUMPY_PATH = Path("vector_stores/numpy")
+HNSW_PATH = Path("vector_stores/hnsw")
+DIM = 384
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 128
+VECTOR_QUANTIZATION = None  # None, "int8" or "binary": first-pass search over quantized vectors, rescored with the float32 ones (numpy, qdrant)
+RESCORE_OVERSAMPLING = 4.0  # Quantized candidates rescored per requested hit
+QUANTIZED_BLOCK = 16384     # Rows decoded per step of the NumPy quantized scan
+
+def _check_quantization(quantization):
+    if quantization not in (None, "int8", "binary"):
+        raise ValueError(f"Unknown vector quantization {quantization!r}, expected None, 'int8' or 'binary'")
+    return quantization
+
+class VectorStore:
+    """
+    Interface shared by the vector backends used by index.py and Retriever.
+
+    Point IDs are strings (see index.point_id), payloads are JSON-serialisable
+    dicts and scores are cosine similarities (higher is better). Writes may be
+    buffered until close(). Backends with parallel_upserts accept upsert()
+    calls from several threads at once.
+    """
+    parallel_upserts = False
+    _recreate = False   # Set by recreate() until the rebuilt store is published
+
+    def exists(self) -> bool:
+        raise NotImplementedError
+
+    def recreate(self):
+        """Drop every point and start from an empty store."""
+        raise NotImplementedError
+
+    def upsert(self, ids: list, vectors, payloads: list):
+        raise NotImplementedError
+
+    def delete(self, ids: list):
+        raise NotImplementedError
+
+    def search(self, vector, limit: int) -> list:
+        """Return up to limit (point_id, payload, score) tuples, best first."""
+        raise NotImplementedError
+
+    def search_batch(self, vectors, limit: int) -> list:
+        """search() for several query vectors at once, one result list per vector."""
+        return [self.search(vector, limit) for vector in vectors]
+
+    def retrieve(self, ids: list) -> dict:
+        """Map point_id -> payload for the given IDs (missing IDs are left out)."""
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def publish(self, expected_count: int):
+        """
+        Check that the store holds expected_count points and make a rebuilt
+        store visible to readers. Raises RuntimeError (and publishes nothing)
+        on a mismatch after recreate(). Incremental updates are already
+        visible (Qdrant) or cannot be held back without blocking every later
+        run, so a mismatch there is only logged. File backends replace their
+        snapshot atomically on close(), so here they only check the count.
+        """
+        count = self._staged_count()
+        if count == expected_count:
+            return
+        if not self._recreate:
+            log.warning(f"Vector store holds {count} points after an incremental update, expected {expected_count}; "
+                        "run index.py --full-rebuild to repair it")
+            return
+        raise RuntimeError(f"Vector store holds {count} points, expected {expected_count}; not publishing")
+
+    def _staged_count(self) -> int:
+        """Points the store will hold once buffered writes are applied."""
+        return self.count()
+
+    def close(self):
+        pass
+
+class QdrantStore(VectorStore):
+    def __init__(self, read_only: bool = False, quantization: str = VECTOR_QUANTIZATION):
+        """
+        Qdrant backend. Local mode (QDRANT_PATH) holds a file lock, so only one
+        process can open it at a time; set QDRANT_URL to share a server instead.
+
+        Readers query the COLLECTION_NAME alias. recreate() builds a new
+        COLLECTION_NAME_v<n> collection next to the live one, and publish()
+        switches the alias to it in one atomic operation, so queries never see
+        a missing or half-built collection.
+
+        With `quantization`, new collections keep the float32 vectors on disk
+        and int8/binary quantized copies in RAM; searches scan the quantized
+        vectors and rescore RESCORE_OVERSAMPLING x limit candidates with the
+        originals. A writer opening a live collection built with another
+        setting updates it in place (the server re-quantizes in the
+        background). Local mode accepts the settings but always searches exactly.
+        """
+        from qdrant_client import QdrantClient
+
+        if QDRANT_URL:
+            self.client = QdrantClient(url=QDRANT_URL)
+            # Server clients are thread-safe; local mode serialises writes anyway
+            self.parallel_upserts = True
+        else:
+            QDRANT_PATH.mkdir(parents=True, exist_ok=True)
+            self.client = QdrantClient(path=str(QDRANT_PATH))
+        self.collection = COLLECTION_NAME
+        self.quantization = _check_quantization(quantization)
+        if QDRANT_URL and self.exists():
+            self._sync_quantization(read_only)
+
+    @staticmethod
+    def _quantization_mode(config):
+        """VECTOR_QUANTIZATION value matching a collection's quantization config."""
+        from qdrant_client.models import BinaryQuantization, ScalarQuantization
+
+        if isinstance(config, ScalarQuantization):
+            return "int8"
+        if isinstance(config, BinaryQuantization):
+            return "binary"
+        return None
+
+    def _sync_quantization(self, read_only: bool):
+        """Apply self.quantization to the live collection if it was built with another setting."""
+        from qdrant_client.models import Disabled, VectorParamsDiff
+
+        current = self._quantization_mode(self.client.get_collection(self.collection).config.quantization_config)
+        if current == self.quantization:
+            return
+        if read_only:
+            log.warning(f"Collection '{self.collection}' uses quantization {current}, not {self.quantization}, until it is re-indexed")
+            return
+        log.info(f"Changing the quantization of '{self.collection}' from {current} to {self.quantization}")
+        self.client.update_collection(
+            collection_name=self.collection,
+            vectors_config={"": VectorParamsDiff(on_disk=self.quantization is not None)},
+            quantization_config=self._quantization_config() or Disabled.DISABLED,
+        )
+
+    def _live_collection(self):
+        """Collection the alias points at, or None."""
+        for alias in self.client.get_aliases().aliases:
+            if alias.alias_name == COLLECTION_NAME:
+                return alias.collection_name
+        return None
+
+    def versions(self) -> list:
+        """Versioned collections (COLLECTION_NAME_v<n>), oldest first."""
+        pattern = re.compile(rf"{re.escape(COLLECTION_NAME)}_v(\d+)$")
+        versions = []
+        for collection in self.client.get_collections().collections:
+            match = pattern.match(collection.name)
+            if match:
+                versions.append((int(match.group(1)), collection.name))
+        return [name for _, name in sorted(versions)]
+
+    def _is_legacy_collection(self) -> bool:
+        """True if COLLECTION_NAME is a plain collection from before versioning, not an alias."""
+        return any(collection.name == COLLECTION_NAME for collection in self.client.get_collections().collections)
+
+    def exists(self) -> bool:
+        return self._live_collection() is not None or self._is_legacy_collection()
+
+    def recreate(self):
+        from qdrant_client.models import Distance, VectorParams
+
+        versions = self.versions()
+        number = int(versions[-1].rsplit("_v", 1)[1]) + 1 if versions else 1
+        self.collection = f"{COLLECTION_NAME}_v{number}"
+        self._recreate = True
+        log.info(f"Building collection '{self.collection}' (readers keep using '{self._live_collection() or COLLECTION_NAME}')")
+        self.client.create_collection(
+            collection_name=self.collection,
+            vectors_config=VectorParams(size=DIM, distance=Distance.COSINE, on_disk=self.quantization is not None),
+            quantization_config=self._quantization_config()
+        )
+
+    def _quantization_config(self):
+        from qdrant_client.models import (
+            BinaryQuantization, BinaryQuantizationConfig, ScalarQuantization, ScalarQuantizationConfig, ScalarType
+        )
+
+        if self.quantization == "int8":
+            return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True))
+        if self.quantization == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+        return None
+
+    def _search_params(self):
+        from qdrant_client.models import QuantizationSearchParams, SearchParams
+
+        if self.quantization is None or not QDRANT_URL:
+            return None    # Local mode always searches exactly (and warns about search params)
+        return SearchParams(quantization=QuantizationSearchParams(rescore=True, oversampling=RESCORE_OVERSAMPLING))
+
+    def publish(self, expected_count: int):
+        """Verify the point count, then atomically point the alias at the collection built by recreate() and GC old versions."""
+        from qdrant_client.models import CreateAlias, CreateAliasOperation, DeleteAlias, DeleteAliasOperation
+
+        super().publish(expected_count)
+        if self.collection == COLLECTION_NAME:
+            return
+        live = self._live_collection()
+        operations = [CreateAliasOperation(create_alias=CreateAlias(collection_name=self.collection, alias_name=COLLECTION_NAME))]
+        if live is not None:
+            operations.insert(0, DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=COLLECTION_NAME)))
+        elif self._is_legacy_collection():
+            # The alias cannot be created while a collection holds its name; queries fail for this one step
+            log.warning(f"Replacing the unversioned collection '{COLLECTION_NAME}' with an alias")
+            self.client.delete_collection(COLLECTION_NAME)
+        self.client.update_collection_aliases(change_aliases_operations=operations)
+        log.info(f"Alias '{COLLECTION_NAME}' now points at '{self.collection}' ({expected_count} points), was '{live}'")
+        self.collection = COLLECTION_NAME
+        self._recreate = False
+        self.gc()
+
+    def gc(self, keep: int = QDRANT_KEEP_VERSIONS) -> list:
+        """
+        Delete versioned collections other than the live one and the `keep`
+        newest versions before it (also removing builds that never got
+        published). Returns the deleted names.
+        """
+        live = self._live_collection()
+        versions = self.versions()
+        if live not in versions:
+            return []
+        older = versions[:versions.index(live)]
+        doomed = older[:max(len(older) - keep, 0)] + versions[versions.index(live) + 1:]
+        for name in doomed:
+            log.info(f"Deleting old collection version '{name}'")
+            self.client.delete_collection(name)
+        return doomed
+
+    def upsert(self, ids: list, vectors, payloads: list):
+        from qdrant_client.models import Batch
+
+        self.client.upsert(
+            collection_name=self.collection,
+            points=Batch(ids=list(ids), vectors=np.asarray(vectors, dtype=np.float32).tolist(), payloads=list(payloads))
+        )
+
+    def delete(self, ids: list):
+        from qdrant_client.models import PointIdsList
+
+        self.client.delete(collection_name=self.collection, points_selector=PointIdsList(points=list(ids)))
+
+    def search(self, vector, limit: int) -> list:
+        results = self.client.query_points(
+            collection_name=self.collection,
+            query=np.asarray(vector, dtype=np.float32).tolist(),
+            limit=limit,
+            search_params=self._search_params()
+        )
+        return [(str(point.id), point.payload, point.score) for point in results.points]
+
+    def search_batch(self, vectors, limit: int) -> list:
+        from qdrant_client.models import QueryRequest
+
+        if not len(vectors):
+            return []
+        responses = self.client.query_batch_points(
+            collection_name=self.collection,
+            requests=[
+                QueryRequest(query=vector.tolist(), limit=limit, with_payload=True, params=self._search_params())
+                for vector in np.asarray(vectors, dtype=np.float32)
+            ]
+        )
+        return [[(str(point.id), point.payload, point.score) for point in response.points] for response in responses]
+
+    def retrieve(self, ids: list) -> dict:
+        if not ids:
+            return {}
+        records = self.client.retrieve(collection_name=self.collection, ids=list(ids), with_payload=True)
+        return {str(record.id): record.payload for record in records}
+
+    def count(self) -> int:
+        return self.client.count(collection_name=self.collection, exact=True).count
+
+    def close(self):
+        self.client.close()
+
+class NumpyStore(VectorStore):
+    def __init__(self, path: Path = NUMPY_PATH, read_only: bool = False, quantization: str = VECTOR_QUANTIZATION):
+        """
+        Exact search over a memory-mapped matrix of normalised float32 vectors.
+
+        The store is a directory snapshot:
+            vectors.bin     (count, DIM) float32, L2-normalised
+            labels.bin      int64 stable, increasing label per row (used by HNSW)
+            offsets.bin     int64 byte offset of each row in payloads.jsonl
+            payloads.jsonl  one payload per row
+            ids.json        point ID per row
+            info.json       {"dim", "count", "next_label", "quantization", "int8_scale"}
+            codes.int8.bin  (count, DIM) int8 per-dimension scaled vectors   (quantization "int8")
+            codes.binary.bin (count, DIM / 8) uint8 packed sign bits          (quantization "binary")
+
+        Writes are buffered and close() writes a complete new snapshot next to
+        the old one and swaps it in, so any number of read-only processes can
+        keep searching the previous snapshot without locks: their memmaps and
+        open payloads file still point at the old files until they reopen.
+
+        With `quantization`, close() also writes the quantized codes and
+        searches scan only those (4x / 32x smaller than the float matrix),
+        then rescore RESCORE_OVERSAMPLING x limit candidates with their float32
+        rows, which are read from the memory-mapped file on demand.
+        """
+        self.path = Path(path)
+        self.read_only = read_only
+        self.quantization = _check_quantization(quantization)
+        self._pending = {}
+        self._deleted = set()
+        self._recreate = False
+        self._payloads = None
+        self._payloads_lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if self._payloads is not None:
+            self._payloads.close()
+        self._payloads = None
+        if not self.exists():
+            self.ids = []
+            self.id_to_row = {}
+            self.next_label = 0
+            self.vectors = np.empty((0, DIM), dtype=np.float32)
+            self.labels = np.empty(0, dtype=np.int64)
+            self.offsets = np.empty(0, dtype=np.int64)
+            self.codes = None
+            self._codes_missing = False
+            return
+        with open(self.path / "info.json", 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        with open(self.path / "ids.json", 'r', encoding='utf-8') as f:
+            self.ids = json.load(f)
+        self.id_to_row = {pid: row for row, pid in enumerate(self.ids)}
+        self.next_label = info["next_label"]
+        count = info["count"]
+        if count:
+            self.vectors = np.memmap(self.path / "vectors.bin", dtype=np.float32, mode='r', shape=(count, info["dim"]))
+            self.labels = np.memmap(self.path / "labels.bin", dtype=np.int64, mode='r', shape=(count,))
+            self.offsets = np.memmap(self.path / "offsets.bin", dtype=np.int64, mode='r', shape=(count,))
+            # Kept open like the memmaps, so a swapped-in snapshot never pairs new payloads with old offsets
+            self._payloads = open(self.path / "payloads.jsonl", 'rb')
+        else:
+            self.vectors = np.empty((0, info["dim"]), dtype=np.float32)
+            self.labels = np.empty(0, dtype=np.int64)
+            self.offsets = np.empty(0, dtype=np.int64)
+
+        self.codes = None
+        self._codes_missing = bool(self.quantization and count and info.get("quantization") != self.quantization)
+        if self._codes_missing:
+            if self.read_only:
+                log.warning(f"{self.path} has no {self.quantization} codes, searching at full precision until it is re-indexed")
+        elif self.quantization and count:
+            if self.quantization == "int8":
+                self.codes = np.memmap(self.path / "codes.int8.bin", dtype=np.int8, mode='r', shape=(count, info["dim"]))
+                self.int8_scale = np.asarray(info["int8_scale"], dtype=np.float32)
+            else:
+                self.codes = np.memmap(self.path / "codes.binary.bin", dtype=np.uint8, mode='r', shape=(count, info["dim"] // 8))
+
+    def exists(self) -> bool:
+        return (self.path / "info.json").exists()
+
+    def recreate(self):
+        self._recreate = True
+        self._pending.clear()
+        self._deleted.clear()
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def upsert(self, ids: list, vectors, payloads: list):
+        for pid, vector, payload in zip(ids, self._normalize(vectors), payloads):
+            self._pending[pid] = (vector, payload)
+            self._deleted.discard(pid)
+
+    def delete(self, ids: list):
+        for pid in ids:
+            self._pending.pop(pid, None)
+            self._deleted.add(pid)
+
+    @staticmethod
+    def _best(scores, limit: int):
+        """Column indices of the top-limit scores of each row, best first."""
+        top = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+        return [row_top[np.argsort(-row_scores[row_top])] for row_scores, row_top in zip(scores, top)]
+
+    def _top_rows(self, vectors, limit: int) -> list:
+        """(rows, scores) of the top-limit rows for each query vector, best first (exact, or rescored quantized)."""
+        vectors = self._normalize(vectors).reshape(-1, DIM)
+        if not len(self.ids):
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))] * len(vectors)
+        limit = min(limit, len(self.ids))
+        if self.codes is None:
+            scores = vectors @ self.vectors.T
+            return [(row_top, row_scores[row_top]) for row_scores, row_top in zip(scores, self._best(scores, limit))]
+
+        candidates = self._best(self._quantized_scores(vectors), min(math.ceil(limit * RESCORE_OVERSAMPLING), len(self.ids)))
+        results = []
+        for vector, rows in zip(vectors, candidates):
+            rows = np.sort(rows)    # Sequential reads of the on-disk float rows
+            scores = self.vectors[rows] @ vector
+            best = self._best(scores[None, :], limit)[0]
+            results.append((rows[best], scores[best]))
+        return results
+
+    def _quantized_scores(self, vectors) -> np.ndarray:
+        """Approximate scores of every row from the quantized codes: dot product (int8) or -Hamming distance (binary)."""
+        scores = np.empty((len(vectors), len(self.ids)), dtype=np.float32)
+        if self.quantization == "int8":
+            scaled = vectors * self.int8_scale
+            for i in range(0, len(self.ids), QUANTIZED_BLOCK):
+                scores[:, i:i + QUANTIZED_BLOCK] = scaled @ self.codes[i:i + QUANTIZED_BLOCK].astype(np.float32).T
+        else:
+            bits = np.packbits(vectors > 0, axis=1)
+            for i in range(0, len(self.ids), QUANTIZED_BLOCK):
+                block = np.asarray(self.codes[i:i + QUANTIZED_BLOCK])
+                scores[:, i:i + QUANTIZED_BLOCK] = -np.bitwise_count(block[None] ^ bits[:, None]).sum(axis=2, dtype=np.int32)
+        return scores
+
+    def _write_codes(self, tmp_dir: Path, count: int) -> dict:
+        """Quantize the snapshot's float vectors into codes.<quantization>.bin; returns the info.json entries."""
+        if not self.quantization or not count:
+            return {}
+        vectors = np.memmap(tmp_dir / "vectors.bin", dtype=np.float32, mode='r', shape=(count, DIM))
+        info = {"quantization": self.quantization}
+        with open(tmp_dir / f"codes.{self.quantization}.bin", 'wb') as f:
+            if self.quantization == "int8":
+                max_abs = np.zeros(DIM, dtype=np.float32)
+                for i in range(0, count, QUANTIZED_BLOCK):
+                    max_abs = np.maximum(max_abs, np.abs(vectors[i:i + QUANTIZED_BLOCK]).max(axis=0))
+                scale = np.where(max_abs > 0, max_abs / 127, 1.0).astype(np.float32)
+                info["int8_scale"] = scale.tolist()
+                for i in range(0, count, QUANTIZED_BLOCK):
+                    f.write(np.clip(np.rint(vectors[i:i + QUANTIZED_BLOCK] / scale), -127, 127).astype(np.int8).tobytes())
+            else:
+                for i in range(0, count, QUANTIZED_BLOCK):
+                    f.write(np.packbits(vectors[i:i + QUANTIZED_BLOCK] > 0, axis=1).tobytes())
+        return info
+
+    def search(self, vector, limit: int) -> list:
+        return self.search_batch([vector], limit)[0]
+
+    def search_batch(self, vectors, limit: int) -> list:
+        results = []
+        for rows, scores in self._top_rows(vectors, limit):
+            payloads = self._read_payloads(rows)
+            results.append([(self.ids[row], payload, float(score)) for row, payload, score in zip(rows, payloads, scores)])
+        return results
+
+    def _read_payloads(self, rows) -> list:
+        if self._payloads is None or not len(rows):
+            return []
+        payloads = []
+        with self._payloads_lock:
+            for row in rows:
+                self._payloads.seek(int(self.offsets[row]))
+                payloads.append(json.loads(self._payloads.readline()))
+        return payloads
+
+    def retrieve(self, ids: list) -> dict:
+        found = [(pid, self.id_to_row[pid]) for pid in ids if pid in self.id_to_row]
+        payloads = self._read_payloads([row for _, row in found]) if found else []
+        return {pid: payload for (pid, _), payload in zip(found, payloads)}
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def _staged_count(self) -> int:
+        if self._recreate:
+            return len(self._pending)
+        kept = sum(1 for pid in self.ids if pid not in self._pending and pid not in self._deleted)
+        return kept + len(self._pending)
+
+    def close(self):
+        if self.read_only or not (self._pending or self._deleted or self._recreate or self._codes_missing):
+            return
+        self._write_snapshot()
+
+    def _write_snapshot(self):
+        tmp_dir = self.path.with_name(self.path.name + ".tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+
+        if self._recreate:
+            keep = np.empty(0, dtype=np.int64)
+        else:
+            keep = np.array(
+                [row for row, pid in enumerate(self.ids) if pid not in self._pending and pid not in self._deleted],
+                dtype=np.int64
+            )
+        removed_labels = np.setdiff1d(np.asarray(self.labels), np.asarray(self.labels)[keep]) if len(self.labels) else np.empty(0, dtype=np.int64)
+        new_ids = list(self._pending)
+        new_vectors = np.array([self._pending[pid][0] for pid in new_ids], dtype=np.float32).reshape(-1, DIM)
+        new_labels = np.arange(self.next_label, self.next_label + len(new_ids), dtype=np.int64)
+
+        block = 65536
+        with open(tmp_dir / "vectors.bin", 'wb') as f:
+            for i in range(0, len(keep), block):
+                f.write(np.ascontiguousarray(self.vectors[keep[i:i + block]]).tobytes())
+            f.write(new_vectors.tobytes())
+        np.concatenate([np.asarray(self.labels)[keep], new_labels]).astype(np.int64).tofile(tmp_dir / "labels.bin")
+
+        offsets = []
+        with open(tmp_dir / "payloads.jsonl", 'w', encoding='utf-8') as out:
+            position = 0
+            if len(keep):
+                keep_set = set(keep.tolist())
+                with open(self.path / "payloads.jsonl", 'r', encoding='utf-8') as f:
+                    for row, line in enumerate(f):
+                        if row in keep_set:
+                            offsets.append(position)
+                            out.write(line)
+                            position += len(line.encode("utf-8"))
+            for pid in new_ids:
+                line = json.dumps(self._pending[pid][1], ensure_ascii=False) + "\n"
+                offsets.append(position)
+                out.write(line)
+                position += len(line.encode("utf-8"))
+        np.asarray(offsets, dtype=np.int64).tofile(tmp_dir / "offsets.bin")
+
+        ids = [self.ids[row] for row in keep] + new_ids
+        with open(tmp_dir / "ids.json", 'w', encoding='utf-8') as f:
+            json.dump(ids, f)
+        quantization = self._write_codes(tmp_dir, len(ids))
+        with open(tmp_dir / "info.json", 'w', encoding='utf-8') as f:
+            json.dump({"dim": DIM, "count": len(ids), "next_label": self.next_label + len(new_ids), **quantization}, f)
+
+        self._write_extra(tmp_dir, removed_labels, new_labels, new_vectors)
+
+        old_dir = self.path.with_name(self.path.name + ".old")
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if self.path.exists():
+            self.path.rename(old_dir)
+        tmp_dir.rename(self.path)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        log.info(f"Wrote {self.path}: {len(ids)} points ({len(new_ids)} upserted, {len(self._deleted)} deleted)")
+
+        self._pending.clear()
+        self._deleted.clear()
+        self._recreate = False
+        self._load()
+
+    def _write_extra(self, tmp_dir: Path, removed_labels, new_labels, new_vectors):
+        """Hook for backends that keep extra files in the snapshot."""
+        pass
+
+class HNSWStore(NumpyStore):
+    def __init__(self, path: Path = HNSW_PATH, read_only: bool = False):
+        """
+        Approximate search with an hnswlib graph on top of the NumpyStore
+        snapshot. Graph labels are the stable row labels, so updates only add
+        the new points and mark removed ones as deleted; the graph is rebuilt
+        from scratch once deleted points outnumber live ones. hnswlib keeps
+        its own float copy of every vector, so VECTOR_QUANTIZATION does not
+        apply here.
+        """
+        super().__init__(path, read_only, quantization=None)
+
+    def _load(self):
+        super()._load()
+        self.index = None
+        if len(self.ids):
+            import hnswlib
+
+            self.index = hnswlib.Index(space="cosine", dim=DIM)
+            self.index.load_index(str(self.path / "hnsw.bin"))
+            self.index.set_ef(HNSW_EF_SEARCH)
+
+    def _top_rows(self, vectors, limit: int) -> list:
+        vectors = self._normalize(vectors).reshape(-1, DIM)
+        if self.index is None:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))] * len(vectors)
+        limit = min(limit, len(self.ids))
+        self.index.set_ef(max(HNSW_EF_SEARCH, limit))
+        labels, distances = self.index.knn_query(vectors, k=limit)
+        return [
+            (np.searchsorted(self.labels, row_labels.astype(np.int64)), 1.0 - row_distances)
+            for row_labels, row_distances in zip(labels, distances)
+        ]
+
+    def _write_extra(self, tmp_dir: Path, removed_labels, new_labels, new_vectors):
+        import hnswlib
+
+        with open(tmp_dir / "info.json", 'r', encoding='utf-8') as f:
+            count = json.load(f)["count"]
+        if not count:
+            return
+
+        index = None
+        if self.index is not None and not self._recreate:
+            deleted = self.index.get_current_count() - len(self.ids) + len(removed_labels)
+            if deleted <= count:
+                index = self.index
+                for label in removed_labels:
+                    index.mark_deleted(int(label))
+                if index.get_current_count() + len(new_labels) > index.get_max_elements():
+                    index.resize_index(max(index.get_current_count() + len(new_labels), 2 * index.get_max_elements()))
+                if len(new_labels):
+                    index.add_items(new_vectors, new_labels)
+
+        if index is None:
+            log.info(f"Building HNSW graph over {count} points")
+            index = hnswlib.Index(space="cosine", dim=DIM)
+            index.init_index(max_elements=max(count, 1), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+            vectors = np.memmap(tmp_dir / "vectors.bin", dtype=np.float32, mode='r', shape=(count, DIM))
+            labels = np.fromfile(tmp_dir / "labels.bin", dtype=np.int64)
+            block = 65536
+            for i in range(0, count, block):
+                index.add_items(np.asarray(vectors[i:i + block]), labels[i:i + block])
+        index.save_index(str(tmp_dir / "hnsw.bin"))
+
+def open_store(backend: str = None, read_only: bool = False) -> VectorStore:
+    """Open the configured (or given) vector backend."""
+    backend = backend or VECTOR_BACKEND
+    if backend == "qdrant":
+        return QdrantStore(read_only=read_only)
+    if backend == "numpy":
+        return NumpyStore(NUMPY_PATH, read_only=read_only)
+    if backend == "hnsw":
+        return HNSWStore(HNSW_PATH, read_only=read_only)
+    raise ValueError("The value of backend must be 'qdrant', 'numpy' or 'hnsw'")